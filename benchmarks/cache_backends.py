@@ -0,0 +1,189 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""Benchmark shared caches with several workers.
+
+Each worker process runs an event loop of concurrent cache readers and
+writers against the shared backend, with in-process entries disabled so
+every call reaches it. Calls are made with the blocking get / set and
+with the async aget / aset, reporting call latency and how long the
+event loop was blocked, the latency every other request of the worker
+sees.
+
+With --lock-ms another process periodically holds the SQLite write lock,
+as a long write of another worker would.
+
+Usage:
+    python -m benchmarks.cache_backends
+    python -m benchmarks.cache_backends --workers 8 --lock-ms 100
+    python -m benchmarks.cache_backends --workers 8 --backend redis
+"""
+
+import argparse
+import concurrent.futures
+import multiprocessing
+import os
+import random
+import sqlite3
+import statistics
+import time
+from typing import Any, Dict, List
+
+import asyncio
+
+from server.common import cache
+from server.common import cache_backends
+
+
+# A product search result, the most common shared entry.
+VALUE = {
+    "title": "Apples",
+    "product_names": [
+        {"title": f"Organic Apples {i}", "price": "$4.99",
+         "url": f"https://example.com/products/{i}", "sku": 1000 + i}
+        for i in range(10)
+    ],
+}
+
+
+async def _measure_lag(stop: asyncio.Event, lags: List[float]) -> None:
+    # Oversleeping a short sleep is time the loop was blocked.
+    interval = 0.005
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, time.perf_counter() - start - interval))
+
+
+async def _client(
+    ttl_cache: cache.TTLCache,
+    mode: str,
+    args: argparse.Namespace,
+    latencies: List[float]
+) -> None:
+    rng = random.Random()
+    for _ in range(args.ops):
+        key = f"query {rng.randrange(args.keys)}"
+        write = rng.random() < args.write_ratio
+        start = time.perf_counter()
+        if mode == "sync":
+            if write:
+                ttl_cache.set(key, VALUE)
+            else:
+                ttl_cache.get(key)
+        elif write:
+            await ttl_cache.aset(key, VALUE)
+        else:
+            await ttl_cache.aget(key)
+        latencies.append(time.perf_counter() - start)
+        # Other work of the request between cache calls.
+        await asyncio.sleep(args.interval)
+
+
+async def _worker(mode: str, args: argparse.Namespace) -> Dict[str, Any]:
+    ttl_cache = cache.TTLCache(
+        name="benchmark",
+        ttl=60,
+        backend=cache_backends.get_backend(),
+        local_ttl=0
+    )
+    latencies: List[float] = []
+    lags: List[float] = []
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(_measure_lag(stop, lags))
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        _client(ttl_cache, mode, args, latencies)
+        for _ in range(args.concurrency)
+    ])
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await lag_task
+    return {"latencies": latencies, "lags": lags, "elapsed": elapsed}
+
+
+def hold_write_lock(path: str, hold: float, stop_at: float) -> None:
+    """Hold the SQLite write lock for hold seconds every 4 * hold.
+
+    Stands in for a worker making a long write, e.g. pruning entries.
+    """
+    connection = sqlite3.connect(path, timeout=10)
+    while time.time() < stop_at:
+        connection.execute("BEGIN IMMEDIATE")
+        time.sleep(hold)
+        connection.rollback()
+        time.sleep(3 * hold)
+
+
+def run_worker(mode: str, args: argparse.Namespace) -> Dict[str, Any]:
+    """Run one worker process of a mode."""
+    os.environ["cache_backend"] = args.backend
+    os.environ["cache_sqlite_path"] = args.sqlite_path
+    os.environ["cache_redis_url"] = args.redis_url
+    return asyncio.run(_worker(mode, args))
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Value at a fraction of sorted values."""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def main(args: argparse.Namespace) -> None:
+    print(
+        f"{args.workers} workers x {args.concurrency} tasks on "
+        f"{args.backend}, {100 * args.write_ratio:.0f}% writes\n")
+    print(f"{'mode':<6}{'ops/s':>10}{'p50':>10}{'p99':>10}"
+          f"{'loop p99':>10}{'loop max':>10}")
+    context = multiprocessing.get_context("spawn")
+    for mode in ("sync", "async"):
+        with concurrent.futures.ProcessPoolExecutor(
+                args.workers + 1, mp_context=context) as pool:
+            if args.lock_ms and args.backend == "sqlite":
+                # Creates the database before the lock holder opens it.
+                run_worker(mode, argparse.Namespace(**{
+                    **vars(args), "ops": 1, "concurrency": 1}))
+                pool.submit(
+                    hold_write_lock, args.sqlite_path,
+                    args.lock_ms / 1000, time.time() + args.lock_seconds)
+            results = list(pool.map(
+                run_worker, [mode] * args.workers, [args] * args.workers))
+        latencies = [v for r in results for v in r["latencies"]]
+        lags = [v for r in results for v in r["lags"]]
+        ops = len(latencies) / statistics.mean(
+            r["elapsed"] for r in results)
+        print(
+            f"{mode:<6}{ops:>10.0f}"
+            f"{1000 * percentile(latencies, 0.5):>8.2f}ms"
+            f"{1000 * percentile(latencies, 0.99):>8.2f}ms"
+            f"{1000 * percentile(lags, 0.99):>8.2f}ms"
+            f"{1000 * max(lags):>8.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("--workers", type=int, default=4,
+                        help="Worker processes.")
+    parser.add_argument("--concurrency", type=int, default=16,
+                        help="Concurrent cache clients per worker.")
+    parser.add_argument("--ops", type=int, default=200,
+                        help="Cache calls per client.")
+    parser.add_argument("--interval", type=float, default=0.005,
+                        help="Seconds between calls of a client.")
+    parser.add_argument("--keys", type=int, default=500,
+                        help="Distinct cache keys.")
+    parser.add_argument("--write-ratio", type=float, default=0.2,
+                        help="Share of calls that are writes.")
+    parser.add_argument("--backend", default="sqlite",
+                        choices=["sqlite", "redis"])
+    parser.add_argument("--sqlite-path",
+                        default="/tmp/sme_cache_benchmark.sqlite3")
+    parser.add_argument("--redis-url", default="redis://localhost:6379/0")
+    parser.add_argument("--lock-ms", type=float, default=0,
+                        help="Hold the SQLite write lock this long from "
+                             "another process, 0 for no lock holder.")
+    parser.add_argument("--lock-seconds", type=float, default=10,
+                        help="Seconds the lock holder runs per mode.")
+    main(parser.parse_args())
@@ -0,0 +1,168 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""Run micro-benchmarks and compare against a stored baseline.
+
+Usage:
+    # Run and print timings.
+    python -m benchmarks.run
+    # Store timings as the new baseline.
+    python -m benchmarks.run --save-baseline
+    # Flag benchmarks more than 20% slower than the baseline.
+    python -m benchmarks.run --compare --threshold 0.2
+"""
+
+import argparse
+import inspect
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from typing import Any, Callable, Dict
+
+import asyncio
+
+from benchmarks import suite
+
+
+BASELINE_PATH = "benchmarks/baseline.json"
+
+# Target seconds of a single timing repeat.
+TARGET_REPEAT_SECONDS = 0.2
+
+
+async def _time_async(func: Callable[[], Any], iterations: int) -> float:
+    """Seconds to await func iterations times in the running loop."""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await func()
+    return time.perf_counter() - start
+
+
+def _time(func: Callable[[], Any], iterations: int) -> float:
+    """Seconds to call func iterations times."""
+    if inspect.iscoroutinefunction(func):
+        return asyncio.run(_time_async(func, iterations))
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return time.perf_counter() - start
+
+
+def run_benchmark(func: Callable[[], Any], repeats: int) -> Dict[str, float]:
+    """Time a benchmark.
+
+    Iterations are calibrated so a repeat takes TARGET_REPEAT_SECONDS.
+    The minimum of the repeats is the least noisy estimate.
+
+    Args:
+        func: Callable to time.
+        repeats: Number of timing repeats.
+
+    Returns:
+        Minimum and median microseconds per call.
+    """
+    iterations = 1
+    while True:
+        elapsed = _time(func, iterations)
+        if elapsed >= TARGET_REPEAT_SECONDS / 10:
+            break
+        iterations *= 10
+    iterations = max(1, int(iterations * TARGET_REPEAT_SECONDS / elapsed))
+
+    per_call = [
+        _time(func, iterations) / iterations * 1e6 for _ in range(repeats)
+    ]
+    return {
+        "min_us": min(per_call),
+        "median_us": statistics.median(per_call),
+        "iterations": iterations,
+    }
+
+
+def compare(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    threshold: float
+) -> bool:
+    """Print comparison against baseline.
+
+    Returns:
+        Boolean of whether any benchmark regressed beyond threshold.
+    """
+    regressed = False
+    print(f"\n{'benchmark':<40}{'baseline':>12}{'current':>12}{'change':>9}")
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"{name:<40}{'-':>12}{result['min_us']:>10.2f}us")
+            continue
+        base = baseline[name]["min_us"]
+        change = result["min_us"] / base - 1
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressed = True
+        print(
+            f"{name:<40}{base:>10.2f}us{result['min_us']:>10.2f}us"
+            f"{change:>+8.0%}{flag}"
+        )
+    return regressed
+
+
+def main(args: argparse.Namespace) -> int:
+    results = {}
+    for name, setup in suite.BENCHMARKS.items():
+        if args.filter and args.filter not in name:
+            continue
+        results[name] = run_benchmark(setup(), repeats=args.repeats)
+        print(
+            f"{name:<40}{results[name]['min_us']:>10.2f}us "
+            f"(median {results[name]['median_us']:.2f}us)"
+        )
+
+    if args.save_baseline:
+        # Filtered runs only replace the benchmarks they ran.
+        saved = {}
+        if args.filter and os.path.exists(args.baseline):
+            with open(args.baseline, "r", encoding="utf-8") as f:
+                saved = json.load(f)["benchmarks"]
+        saved.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({
+                "python": sys.version.split()[0],
+                "machine": platform.platform(),
+                "benchmarks": saved,
+            }, f, indent=2)
+            f.write("\n")
+        print(f"\nSaved baseline to {args.baseline}")
+
+    if args.compare:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("machine") != platform.platform():
+            print(
+                f"\nNote: baseline was recorded on {baseline.get('machine')}, "
+                "compare on the same machine for meaningful results."
+            )
+        if compare(results, baseline["benchmarks"], args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("--filter", help="Only run benchmarks matching this.")
+    parser.add_argument("--repeats", type=int, default=5,
+                        help="Timing repeats per benchmark.")
+    parser.add_argument("--baseline", default=BASELINE_PATH,
+                        help="Baseline JSON file.")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="Store results as the baseline.")
+    parser.add_argument("--compare", action="store_true",
+                        help="Compare results against the baseline.")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Slowdown fraction flagged as a regression.")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,104 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""Benchmark app import and startup time.
+
+Each repeat runs in a fresh Python process, so module caches of earlier
+repeats do not hide import cost. Startup (client initialization and
+cache warm-up) runs against the fake backends unless --live is set.
+
+Usage:
+    python -m benchmarks.startup
+    python -m benchmarks.startup --repeats 10 --top 20
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Any, Dict, List, Tuple
+
+
+# Run in a child process: import main, then run its lifespan startup.
+_CHILD = """
+import asyncio, json, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+async def startup():
+    async with main.lifespan(main.app):
+        pass
+asyncio.run(startup())
+print(json.dumps({
+    "import_s": imported - start,
+    "startup_s": time.perf_counter() - imported,
+}))
+"""
+
+
+def run_once(env: Dict[str, str]) -> Dict[str, float]:
+    """Import and start the app in a fresh process.
+
+    Returns:
+        Seconds to import main and to complete startup.
+    """
+    output = subprocess.run(
+        [sys.executable, "-c", _CHILD],
+        env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def slowest_imports(env: Dict[str, str], top: int) -> List[Tuple[float, str]]:
+    """Modules of main with the largest cumulative import time.
+
+    Returns:
+        Milliseconds and module name, slowest first.
+    """
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        env=env, capture_output=True, text=True, check=True
+    ).stderr
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, module = line.split("|")
+        if cumulative.strip().isdigit():
+            imports.append((int(cumulative) / 1000, module.strip()))
+    return sorted(imports, reverse=True)[:top]
+
+
+def main(args: argparse.Namespace) -> None:
+    env = dict(os.environ)
+    if not args.live:
+        env["backend_mode"] = "fake"
+
+    runs = [run_once(env) for _ in range(args.repeats)]
+    results: Dict[str, Any] = {}
+    for key in ("import_s", "startup_s"):
+        values = [run[key] for run in runs]
+        results[key] = {
+            "min": min(values), "median": statistics.median(values)}
+        print(
+            f"{key:<12}{1000 * results[key]['min']:>10.0f}ms "
+            f"(median {1000 * results[key]['median']:.0f}ms)"
+        )
+
+    print("\nSlowest imports of main (cumulative):")
+    for milliseconds, module in slowest_imports(env, args.top):
+        print(f"{milliseconds:>10.0f}ms  {module}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("--repeats", type=int, default=5,
+                        help="Fresh processes to time.")
+    parser.add_argument("--top", type=int, default=15,
+                        help="Slowest imports to list.")
+    parser.add_argument("--live", action="store_true",
+                        help="Start against live backends.")
+    main(parser.parse_args())
@@ -0,0 +1,150 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""Micro-benchmarks of the pure Python hot paths.
+
+Each benchmark is a function returning the callable to time. Async
+callables are timed inside a single running event loop.
+"""
+
+import json
+import os
+from types import SimpleNamespace
+from typing import Any, Callable, Dict
+
+from server.common import gemini
+from server.common import prompts
+from server.common import utils
+from server.fakes import common as fake_common
+from server.fakes import gemini as fake_gemini
+from server.services import sme
+from server.services.products import product_search
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+
+# Registered benchmarks by name.
+BENCHMARKS: Dict[str, Callable[[], Callable[[], Any]]] = {}
+
+
+def benchmark(func: Callable[[], Callable[[], Any]]):
+    """Register a benchmark."""
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def load_vertex_response(path: str = None) -> SimpleNamespace:
+    """Load a recorded Vertex Search response.
+
+    Args:
+        path: JSON file of results with derived_struct_data. Defaults to
+            VERTEX_FIXTURE env variable or the bundled fixture.
+    """
+    path = path or os.getenv(
+        "VERTEX_FIXTURE", os.path.join(DATA_DIR, "vertex_response.json"))
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return SimpleNamespace(results=[
+        SimpleNamespace(document=SimpleNamespace(
+            derived_struct_data=result["derived_struct_data"]))
+        for result in data["results"]
+    ])
+
+
+def product_categories(num_categories: int = 6):
+    """Product search payloads as returned for a recipe grocery list."""
+    products = product_search.parse_es_result(load_vertex_response())
+    return [
+        {"title": f"Category {i}", "product_names": products}
+        for i in range(num_categories)
+    ]
+
+
+def sme_runner() -> sme.SmeRunner:
+    """SmeRunner without a Gemini client, only its pure methods are used."""
+    return sme.SmeRunner.__new__(sme.SmeRunner)
+
+
+@benchmark
+def parse_es_result():
+    response = load_vertex_response()
+    return lambda: product_search.parse_es_result(response)
+
+
+@benchmark
+def parse_product_sku():
+    url = "https://www.albertsons.com/shop/product-details.970555032.html"
+    return lambda: product_search.parse_product_sku(url)
+
+
+@benchmark
+def get_product_names():
+    runner = sme_runner()
+    products = product_categories()
+    return lambda: runner.get_product_names(products=products)
+
+
+@benchmark
+def get_recipe_names():
+    runner = sme_runner()
+    recipes = [{"name": name} for name in fake_gemini.RECIPE_NAMES]
+    return lambda: runner.get_recipe_names(recipes=recipes)
+
+
+@benchmark
+def format_recipe_data_prompt():
+    product_list = fake_gemini.GROCERY_ITEMS
+    return lambda: prompts.recipe_data_prompt.format(
+        recipe="Lemon Garlic Salmon", product_list=product_list)
+
+
+@benchmark
+def format_recipes_recommendations_prompt():
+    return lambda: prompts.recipes_recommendations_prompt.format(
+        user_query="3 day meal plan for a family of 4 on a budget")
+
+
+@benchmark
+def format_product_title_prompt():
+    products = [
+        product["title"] for product in
+        product_search.parse_es_result(load_vertex_response())
+    ]
+    return lambda: prompts.product_title_prompt.format(
+        query="vegan ice cream", products=products)
+
+
+@benchmark
+def format_summarize_result_prompt():
+    runner = sme_runner()
+    result = {
+        "products": runner.get_product_names(product_categories()),
+        "recipes": fake_gemini.RECIPE_NAMES,
+    }
+    return lambda: prompts.summarize_result_prompt.format(
+        query="easy pasta recipes", result=result)
+
+
+@benchmark
+def parse_gemini_json_response():
+    # Only the parsing method is timed, no model is created.
+    manager = gemini.GeminiModelManager.__new__(gemini.GeminiModelManager)
+    rng = fake_common.seeded_random("benchmark")
+    text = json.dumps(fake_gemini.recipe_metadata(rng))
+    response = SimpleNamespace(candidates=[SimpleNamespace(
+        content=SimpleNamespace(parts=[SimpleNamespace(text=text)]))])
+    return lambda: manager.parse_gemini_text_response(
+        response=response, is_json=True)
+
+
+@benchmark
+def make_parallel_calls_20():
+    async def no_op(item):
+        return item
+
+    items = list(range(20))
+
+    async def run():
+        return await utils.make_parallel_calls(
+            items=items, async_processing_func=no_op)
+    return run
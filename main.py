@@ -3,17 +3,26 @@
 # agreement with Google.
 """FastAPI App."""
 
+import contextlib
 import os
 
+import asyncio
 from fastapi import FastAPI
 import uvicorn
 
+from server.common import admission
+from server.common import metrics
+from server.common import rate_limit
 from server.common import utils
+from server.routes import batch
+from server import startup
 from server.routes import chat
+from server.routes import health
+from server.routes import metrics as metrics_routes
 from server.routes import saved_recipes
-
-
-app = FastAPI()
+from server.routes import ws_chat
+from server.services import prefetch
+from server.services.image import preprocess
 
 
 # Env variables for local dev.
@@ -22,9 +31,40 @@ if ENV == "DEV":
     utils.load_config_to_env("./config.yaml")
 
 
+@contextlib.asynccontextmanager
+async def lifespan(_: FastAPI):
+    # By default requests are served once clients are initialized and
+    # caches warmed, so the first users after a deploy do not pay for
+    # them. Otherwise startup runs in the background and /readyz
+    # reports when it is done.
+    if os.getenv("startup_wait_for_ready", "true").lower() == "true":
+        await startup.start()
+        yield
+        return
+    task = asyncio.create_task(startup.start())
+    yield
+    task.cancel()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+# Middleware.
+app.middleware("http")(rate_limit.retry_budget_middleware)
+app.middleware("http")(metrics.timing_middleware)
+app.middleware("http")(prefetch.foreground_middleware)
+app.middleware("http")(preprocess.upload_size_middleware)
+# Added last so it runs first, rejecting before any other work.
+app.middleware("http")(admission.admission_middleware)
+
+
 # Routes.
 app.include_router(chat.router, prefix="/api")
 app.include_router(saved_recipes.router, prefix="/api")
+app.include_router(batch.router, prefix="/api")
+app.include_router(ws_chat.router, prefix="/api")
+app.include_router(metrics_routes.router)
+app.include_router(health.router)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,62 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+# pylint: disable=invalid-name
+"""Run a batch of queries from the command line.
+
+Usage:
+    python -m server.batch --input queries.jsonl --output results.jsonl \
+        --concurrency 8 --rps 4
+
+Re-running the same command resumes from the checkpoint file.
+"""
+
+import argparse
+import os
+
+import asyncio
+
+from server.batch import runner
+from server.common import utils
+
+
+def main(args: argparse.Namespace) -> None:
+    if os.getenv("ENV", "DEV") == "DEV":
+        utils.load_config_to_env("./config.yaml")
+    if args.fake:
+        os.environ["backend_mode"] = "fake"
+    if args.rps is not None:
+        # The only run of the process, its limit is the process limit.
+        os.environ["batch_rate_limit"] = str(args.rps)
+
+    batch = runner.BatchRunner(
+        input_path=args.input,
+        output_path=args.output,
+        checkpoint_path=args.checkpoint,
+        concurrency=args.concurrency
+    )
+    status = asyncio.run(batch.run())
+    print(
+        f"{status['state']}: {status['completed']} completed, "
+        f"{status['failed']} failed, {status['skipped']} skipped "
+        f"in {status['elapsed_s']:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("--input", required=True,
+                        help="JSONL file of queries.")
+    parser.add_argument("--output", required=True,
+                        help="JSONL file results are appended to.")
+    parser.add_argument("--checkpoint",
+                        help="Checkpoint file. Defaults to "
+                             "<output>.checkpoint.")
+    parser.add_argument("--concurrency", type=int,
+                        help="Max queries in flight.")
+    parser.add_argument("--rps", type=float,
+                        help="Max queries started per second, 0 for none.")
+    parser.add_argument("--fake", action="store_true",
+                        help="Use fake backends.")
+    main(parser.parse_args())
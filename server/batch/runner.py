@@ -0,0 +1,283 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""Batch runner for bulk queries.
+
+Each line of the input JSONL file is one query:
+    {"id": "summer-1", "user_query": "easy summer grilling recipes"}
+    {"user_query": "vegan ice cream", "intent": "generic_product_search"}
+
+A known intent skips intent classification. Queries are independent
+single turns without chat history.
+
+Results are appended to the output JSONL as they complete, one line per
+query with its input line index, so output order may differ from input
+order. Progress is checkpointed as the highest index below which every
+query completed (the watermark) plus completed indices above it. A
+resumed run skips checkpointed queries. Queries that completed after the
+last checkpoint write are re-run, so readers should dedupe by index.
+"""
+
+import json
+import os
+import threading
+import time
+import traceback
+from typing import Any, Dict, Iterator, Optional, Set, Tuple
+
+import asyncio
+
+from server.common import deadline
+from server.common import rate_limit
+from server.common import scheduler
+from server.config.logging import logger
+from server.turns import multi_turn
+
+
+class BatchCancelled(Exception):
+    """Batch run was cancelled."""
+
+
+# Shared by the batch runs of this process, so concurrent jobs together
+# start at most batch_rate_limit queries per second.
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> Optional[rate_limit.TokenBucket]:
+    """Process wide limiter of batch queries, None without a limit."""
+    global _rate_limiter
+    rate = float(os.getenv("batch_rate_limit", "2"))
+    if rate <= 0:
+        return None
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            _rate_limiter = rate_limit.TokenBucket(rate)
+        return _rate_limiter
+
+
+class Checkpoint:
+    """Completed query indices of a batch run."""
+    def __init__(self, path: Optional[str] = None):
+        """Init checkpoint, loading previous progress from path.
+
+        Args:
+            path: JSON checkpoint file. Progress is not saved without one.
+        """
+        self.path = path
+        self.watermark = -1
+        self.completed: Set[int] = set()
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.watermark = data["watermark"]
+            self.completed = set(data["completed"])
+
+    def is_done(self, index: int) -> bool:
+        return index <= self.watermark or index in self.completed
+
+    def mark_done(self, index: int) -> None:
+        self.completed.add(index)
+        # Fold contiguous indices into the watermark.
+        while self.watermark + 1 in self.completed:
+            self.watermark += 1
+            self.completed.remove(self.watermark)
+
+    def save(self) -> None:
+        """Write checkpoint atomically."""
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({
+                "watermark": self.watermark,
+                "completed": sorted(self.completed)
+            }, f)
+        os.replace(tmp_path, self.path)
+
+
+def read_queries(
+    path: str
+) -> Iterator[Tuple[int, Optional[Dict[str, Any]]]]:
+    """Stream queries of a JSONL file with their line index.
+
+    Args:
+        path: JSONL file of queries.
+
+    Yields:
+        Line index and query, None for lines without a query.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for index, line in enumerate(f):
+            entry = None
+            try:
+                if line.strip():
+                    entry = json.loads(line)
+            except json.JSONDecodeError as e:
+                logger.error(f"Skipping invalid batch line {index}: {e}")
+            if isinstance(entry, dict) and entry.get("user_query"):
+                yield index, entry
+            else:
+                yield index, None
+
+
+class BatchRunner:
+    """Run a JSONL file of queries through the chat pipeline."""
+    def __init__(
+        self,
+        input_path: str,
+        output_path: str,
+        checkpoint_path: Optional[str] = None,
+        concurrency: Optional[int] = None,
+        rate: Optional[float] = None,
+        checkpoint_every: int = 10
+    ):
+        """Init batch runner.
+
+        Args:
+            input_path: JSONL file of queries.
+            output_path: JSONL file results are appended to.
+            checkpoint_path: Progress file to resume from. Defaults to
+                output_path with a .checkpoint suffix.
+            concurrency: Max queries in flight. Defaults to
+                batch_concurrency env variable.
+            rate: Max queries started per second by this run. Every
+                run is also limited by the process wide batch_rate_limit
+                env variable.
+            checkpoint_every: Completed queries between checkpoint writes.
+        """
+        self.input_path = input_path
+        self.output_path = output_path
+        self.checkpoint = Checkpoint(
+            checkpoint_path or f"{output_path}.checkpoint")
+        self.concurrency = concurrency or int(
+            os.getenv("batch_concurrency", "4"))
+        self.rate_limiters = [
+            limiter for limiter in (
+                rate_limit.TokenBucket(rate) if rate else None,
+                get_rate_limiter()
+            ) if limiter
+        ]
+        self.checkpoint_every = checkpoint_every
+        # Batch queries are not interactive, allow complete results.
+        self.deadline = float(os.getenv("batch_deadline", "120"))
+
+        self.state = "pending"
+        self.stats = {"completed": 0, "failed": 0, "skipped": 0}
+        self.started_at = None
+        self.finished_at = None
+        self._cancelled = asyncio.Event()
+
+    def cancel(self) -> None:
+        """Stop starting new queries, in flight queries finish."""
+        self._cancelled.set()
+
+    def status(self) -> Dict[str, Any]:
+        """Progress of the run."""
+        elapsed = None
+        if self.started_at:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+        return {
+            "state": self.state,
+            "input_path": self.input_path,
+            "output_path": self.output_path,
+            "elapsed_s": elapsed,
+            "watermark": self.checkpoint.watermark,
+            **self.stats
+        }
+
+    async def process_query(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        """Run one query as a single turn.
+
+        Returns:
+            Result line without the index.
+        """
+        start = time.perf_counter()
+        result, error = None, None
+        try:
+            # Batch calls yield backend slots to live chat turns.
+            with rate_limit.retry_budget(), deadline.deadline_scope(
+                seconds=self.deadline
+            ), scheduler.priority(scheduler.BATCH):
+                result = await multi_turn.MultiTurn(
+                    query=entry["user_query"],
+                    history=[],
+                    intent=entry.get("intent")
+                ).process()
+            if result is None:
+                error = "blocked"
+            elif result.get("intent") is None:
+                error = "fallback"
+        except Exception as e:
+            traceback.print_exc()
+            error = f"{type(e).__name__}: {e}"
+        return {
+            "id": entry.get("id"),
+            "user_query": entry["user_query"],
+            "result": result,
+            "error": error,
+            "latency_s": time.perf_counter() - start
+        }
+
+    async def run(self) -> Dict[str, Any]:
+        """Process all queries not yet checkpointed.
+
+        Returns:
+            Final status of the run.
+        """
+        self.state = "running"
+        self.started_at = time.time()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+        since_checkpoint = 0
+
+        with open(self.output_path, "a", encoding="utf-8") as output:
+            async def process(index, entry):
+                nonlocal since_checkpoint
+                try:
+                    line = await self.process_query(entry)
+                    output.write(json.dumps({"index": index, **line}) + "\n")
+                    output.flush()
+                    self.stats["failed" if line["error"] else "completed"] += 1
+                    self.checkpoint.mark_done(index)
+                    since_checkpoint += 1
+                    if since_checkpoint >= self.checkpoint_every:
+                        since_checkpoint = 0
+                        self.checkpoint.save()
+                finally:
+                    semaphore.release()
+
+            try:
+                for index, entry in read_queries(self.input_path):
+                    if self.checkpoint.is_done(index):
+                        self.stats["skipped"] += 1
+                        continue
+                    if entry is None:
+                        self.checkpoint.mark_done(index)
+                        continue
+                    # Bound queries in flight, and memory, before reading on.
+                    await semaphore.acquire()
+                    if self._cancelled.is_set():
+                        semaphore.release()
+                        raise BatchCancelled
+                    for limiter in self.rate_limiters:
+                        await limiter.acquire()
+                    task = asyncio.create_task(process(index, entry))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                state = "completed"
+            except BatchCancelled:
+                state = "cancelled"
+            except Exception as e:
+                logger.error(f"Error running batch {self.input_path}: {e}")
+                state = "failed"
+            finally:
+                if tasks:
+                    await asyncio.gather(*tasks, return_exceptions=True)
+                self.checkpoint.save()
+                self.finished_at = time.time()
+            # Set once queries in flight are done.
+            self.state = state
+
+        logger.info(f"Batch {self.input_path} {self.state}: {self.stats}")
+        return self.status()
@@ -0,0 +1,254 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""Admission Control Functions.
+
+Bounds the API requests processed at a time. Requests beyond
+max_in_flight wait in a bounded queue and are rejected with 503 and a
+Retry-After header when the queue is full or they wait too long, so a
+traffic spike is shed at the door instead of slowing every request down
+until they all time out.
+
+As the queue fills, admitted requests also do less work, following a
+degradation ladder. Each rung is enabled at a share of the queue:
+    summarize: Template message instead of an LLM summary.
+    recipe_nutrition: Recipe metadata without nutritional information.
+    product_page_size: Fewer products per search.
+"""
+
+import collections
+import contextlib
+import contextvars
+import math
+import os
+import time
+from typing import AsyncIterator, Dict, Optional
+
+import asyncio
+from fastapi import Request
+from fastapi.responses import JSONResponse
+
+from server.common import metrics
+from server.config.logging import logger
+
+
+SUMMARIZE = "summarize"
+RECIPE_NUTRITION = "recipe_nutrition"
+PRODUCT_PAGE_SIZE = "product_page_size"
+
+# Queue share at which each rung of the ladder is enabled.
+DEFAULT_LADDER = {
+    SUMMARIZE: 0.25,
+    RECIPE_NUTRITION: 0.5,
+    PRODUCT_PAGE_SIZE: 0.75,
+}
+
+# Products per search when product_page_size is shed.
+DEFAULT_DEGRADED_PAGE_SIZE = 5
+
+# Rungs shed for the current request.
+_shed: contextvars.ContextVar[frozenset] = contextvars.ContextVar(
+    "shed", default=frozenset())
+
+
+class AdmissionRejected(Exception):
+    """Request rejected by admission control."""
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"Request rejected: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Bounded in-flight requests with a bounded FIFO queue."""
+    def __init__(
+        self,
+        max_in_flight: int = 64,
+        max_queue: int = 128,
+        queue_timeout: float = 5.0,
+        ladder: Optional[Dict[str, float]] = None
+    ):
+        """Init admission controller.
+
+        Args:
+            max_in_flight: Max requests processed at a time.
+            max_queue: Max requests waiting, more are rejected.
+            queue_timeout: Max seconds a request waits.
+            ladder: Queue share at which each rung is shed.
+        """
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.ladder = ladder if ladder is not None else dict(DEFAULT_LADDER)
+
+        self.in_flight = 0
+        self._waiters = collections.deque()
+        # Moving average of request latency for Retry-After.
+        self._avg_seconds = 1.0
+
+    @property
+    def queued(self) -> int:
+        """Requests waiting for a slot."""
+        return sum(1 for waiter in self._waiters if not waiter.done())
+
+    def shed_rungs(self) -> frozenset:
+        """Rungs of the ladder shed at the current queue depth."""
+        if not self.max_queue:
+            return frozenset()
+        share = self.queued / self.max_queue
+        return frozenset(
+            rung for rung, threshold in self.ladder.items()
+            if share >= threshold
+        )
+
+    def retry_after(self) -> int:
+        """Seconds until the queue is likely to have drained."""
+        pending = self.queued + self.in_flight
+        seconds = pending * self._avg_seconds / max(1, self.max_in_flight)
+        return max(1, math.ceil(seconds))
+
+    async def acquire(self) -> None:
+        """Wait for a slot.
+
+        Raises:
+            AdmissionRejected: When the queue is full or the wait times
+                out.
+        """
+        if self.in_flight < self.max_in_flight and not self.queued:
+            self.in_flight += 1
+            return
+        if self.queued >= self.max_queue:
+            raise AdmissionRejected("queue_full", self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        metrics.ADMISSION_QUEUE.inc()
+        try:
+            await asyncio.wait_for(
+                asyncio.shield(waiter), timeout=self.queue_timeout)
+        except asyncio.TimeoutError as e:
+            if not waiter.done():
+                waiter.cancel()
+                raise AdmissionRejected(
+                    "queue_timeout", self.retry_after()) from e
+            # Granted as the wait timed out, keep the slot.
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                waiter.cancel()
+            raise
+        finally:
+            metrics.ADMISSION_QUEUE.dec()
+
+    def release(self, seconds: Optional[float] = None) -> None:
+        """Free a slot and admit the next waiter.
+
+        Args:
+            seconds: Latency of the finished request, for Retry-After.
+        """
+        if seconds is not None:
+            self._avg_seconds = 0.9 * self._avg_seconds + 0.1 * seconds
+        self.in_flight -= 1
+        while self._waiters and self.in_flight < self.max_in_flight:
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self.in_flight += 1
+            waiter.set_result(None)
+
+
+def is_shed(rung: str) -> bool:
+    """Whether a rung of the ladder is shed for the current request.
+
+    Args:
+        rung: SUMMARIZE, RECIPE_NUTRITION or PRODUCT_PAGE_SIZE.
+    """
+    return rung in _shed.get()
+
+
+def product_page_size(default: int = 10) -> int:
+    """Products per search for the current request.
+
+    Args:
+        default: Page size when not shed.
+    """
+    if is_shed(PRODUCT_PAGE_SIZE):
+        return min(default, int(os.getenv(
+            "admission_degraded_page_size", str(DEFAULT_DEGRADED_PAGE_SIZE))))
+    return default
+
+
+_controller = None
+
+
+def get_controller() -> Optional[AdmissionController]:
+    """Admission controller of this process.
+
+    Returns:
+        AdmissionController, None when admission_enabled is false.
+    """
+    global _controller
+    if os.getenv("admission_enabled", "true").lower() != "true":
+        return None
+    if _controller is None:
+        _controller = AdmissionController(
+            max_in_flight=int(os.getenv("admission_max_in_flight", "64")),
+            max_queue=int(os.getenv("admission_max_queue", "128")),
+            queue_timeout=float(os.getenv("admission_queue_timeout", "5")),
+            ladder={
+                rung: float(os.getenv(f"admission_shed_{rung}_at", str(share)))
+                for rung, share in DEFAULT_LADDER.items()
+            }
+        )
+    return _controller
+
+
+@contextlib.asynccontextmanager
+async def admitted(name: str) -> AsyncIterator[None]:
+    """Hold an admission slot, shedding rungs for the work within.
+
+    Args:
+        name: Name of the request in logs, e.g. its path.
+
+    Raises:
+        AdmissionRejected: When overloaded.
+    """
+    controller = get_controller()
+    if controller is None:
+        yield
+        return
+
+    try:
+        await controller.acquire()
+    except AdmissionRejected as e:
+        logger.warning(f"Rejected {name}: {e.reason}")
+        metrics.ADMISSION_REJECTED.labels(reason=e.reason).inc()
+        raise
+
+    # Shed rungs at the queue depth the request was admitted with.
+    shed = controller.shed_rungs()
+    metrics.DEGRADATION_LEVEL.set(len(shed))
+    token = _shed.set(shed)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _shed.reset(token)
+        controller.release(time.perf_counter() - start)
+
+
+async def admission_middleware(request: Request, call_next):
+    """Admit API requests, rejecting with 503 when overloaded."""
+    if not request.url.path.startswith("/api/"):
+        return await call_next(request)
+
+    try:
+        async with admitted(request.url.path):
+            return await call_next(request)
+    except AdmissionRejected as e:
+        return JSONResponse(
+            {"msg": "Server busy, please retry."},
+            status_code=503,
+            headers={"Retry-After": str(e.retry_after)}
+        )
@@ -0,0 +1,343 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""Cache Module.
+
+Caches are in process. Caches listed in the shared_caches env variable
+are also kept in the shared backend (cache_backends) of all workers,
+with in-process entries as a short lived first level.
+
+Backend calls may block, so async code uses aget, aset and adelete,
+which make them from threads (writes in the background) instead of on
+the event loop.
+"""
+
+import collections
+import os
+import threading
+import time
+from typing import Any, Dict, Hashable, Optional
+
+import asyncio
+
+from server.common import cache_backends
+from server.common import metrics
+from server.config.logging import logger
+
+
+# Caches kept in the shared backend by default.
+DEFAULT_SHARED_CACHES = (
+    "product_title,product_search,embedding,saved_recipes,recipe_metadata")
+
+# Seconds the shared backend is skipped after an error.
+BACKEND_RETRY_SECONDS = 30.0
+
+# Marks a key missing from the in-process entries.
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread safe in-memory LRU cache with per entry expiry."""
+    def __init__(
+        self,
+        name: str,
+        max_entries: int = 1024,
+        ttl: Optional[float] = None,
+        backend: Optional[cache_backends.CacheBackend] = None,
+        local_ttl: Optional[float] = None
+    ):
+        """Init cache.
+
+        Args:
+            name: Name of cache, used for stats.
+            max_entries: Max entries before least recently used are evicted.
+            ttl: Default seconds an entry is valid for. None never expires.
+            backend: Shared backend read on in-process misses.
+            local_ttl: Max seconds an entry is kept in process when
+                shared, so writes of other workers are seen soon.
+        """
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.backend = backend
+        self.local_ttl = local_ttl
+        self._backend_retry_at = 0.0
+        # Background writes of aset by shared key.
+        self._writes: Dict[str, asyncio.Future] = {}
+
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get an entry from cache.
+
+        Args:
+            key: Cache key.
+            default: Value returned on a miss.
+
+        Returns:
+            Cached value or default.
+        """
+        value = self._get_local(key)
+        if value is not _MISSING:
+            return value
+        if self.backend is None:
+            return default
+        shared = self._backend_call(
+            "get", self._get_shared, cache_backends.key_to_str(key))
+        return self._shared_result(key, shared, default)
+
+    async def aget(self, key: Hashable, default: Any = None) -> Any:
+        """Get an entry from cache, reading a blocking backend in a thread.
+
+        Args:
+            key: Cache key.
+            default: Value returned on a miss.
+
+        Returns:
+            Cached value or default.
+        """
+        value = self._get_local(key)
+        if value is not _MISSING:
+            return value
+        if self.backend is None:
+            return default
+        shared_key = cache_backends.key_to_str(key)
+        if self.backend.blocking_reads:
+            shared = await asyncio.to_thread(
+                self._backend_call, "get", self._get_shared, shared_key)
+        else:
+            shared = self._backend_call("get", self._get_shared, shared_key)
+        return self._shared_result(key, shared, default)
+
+    def _get_local(self, key: Hashable) -> Any:
+        """In-process value of a key, or _MISSING.
+
+        Misses are counted here unless the shared backend is read next.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    metrics.CACHE_REQUESTS.labels(
+                        cache=self.name, result="hit").inc()
+                    return value
+                del self._entries[key]
+            if self.backend is None:
+                self._misses += 1
+                metrics.CACHE_REQUESTS.labels(
+                    cache=self.name, result="miss").inc()
+            return _MISSING
+
+    def _shared_result(self, key: Hashable, value: Any, default: Any) -> Any:
+        """Count a shared backend read and keep its value in process."""
+        with self._lock:
+            if value is None:
+                self._misses += 1
+                metrics.CACHE_REQUESTS.labels(
+                    cache=self.name, result="miss").inc()
+                return default
+            self._hits += 1
+            metrics.CACHE_REQUESTS.labels(
+                cache=self.name, result="shared_hit").inc()
+        self._set_local(key, value, self.local_ttl)
+        return value
+
+    def set(
+        self,
+        key: Hashable,
+        value: Any,
+        ttl: Optional[float] = None
+    ) -> None:
+        """Add an entry to cache.
+
+        Args:
+            key: Cache key.
+            value: Value to cache.
+            ttl: Seconds entry is valid for, defaults to cache ttl.
+        """
+        ttl = ttl if ttl is not None else self.ttl
+        if self.backend is not None:
+            self._backend_call(
+                "set", self._set_shared,
+                cache_backends.key_to_str(key), value, ttl)
+        self._set_local(key, value, self._local_ttl(ttl))
+
+    async def aset(
+        self,
+        key: Hashable,
+        value: Any,
+        ttl: Optional[float] = None
+    ) -> None:
+        """Add an entry to cache, writing the shared backend in the background.
+
+        The value is serialized before returning, so later changes of it
+        are not written.
+
+        Args:
+            key: Cache key.
+            value: Value to cache.
+            ttl: Seconds entry is valid for, defaults to cache ttl.
+        """
+        ttl = ttl if ttl is not None else self.ttl
+        self._set_local(key, value, self._local_ttl(ttl))
+        if self.backend is None:
+            return
+        data = self._backend_call("set", cache_backends.dumps, value)
+        if data is None:
+            return
+        shared_key = cache_backends.key_to_str(key)
+        write = asyncio.ensure_future(asyncio.to_thread(
+            self._backend_call, "set", self.backend.set,
+            self.name, shared_key, data, self._shared_ttl(ttl)))
+        self._writes[shared_key] = write
+        write.add_done_callback(
+            lambda task: self._write_done(shared_key, task))
+
+    def _write_done(self, key: str, task: asyncio.Future) -> None:
+        if self._writes.get(key) is task:
+            del self._writes[key]
+
+    def _local_ttl(self, ttl: Optional[float]) -> Optional[float]:
+        """Seconds an entry is kept in process."""
+        if self.backend is None or self.local_ttl is None:
+            return ttl
+        return min(ttl, self.local_ttl) if ttl is not None else self.local_ttl
+
+    def _set_local(
+        self,
+        key: Hashable,
+        value: Any,
+        ttl: Optional[float]
+    ) -> None:
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        """Invalidate an entry."""
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.backend is not None:
+            self._backend_call(
+                "delete", self.backend.delete,
+                self.name, cache_backends.key_to_str(key))
+
+    async def adelete(self, key: Hashable) -> None:
+        """Invalidate an entry, deleting it from the backend in a thread.
+
+        Waits for a background write of the key first, so the write
+        cannot restore the entry.
+        """
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.backend is None:
+            return
+        shared_key = cache_backends.key_to_str(key)
+        write = self._writes.get(shared_key)
+        if write is not None:
+            await asyncio.wait([write])
+        await asyncio.to_thread(
+            self._backend_call, "delete", self.backend.delete,
+            self.name, shared_key)
+
+    def clear(self) -> None:
+        """Invalidate all entries."""
+        with self._lock:
+            self._entries.clear()
+        if self.backend is not None:
+            self._backend_call("clear", self.backend.clear, self.name)
+
+    def _get_shared(self, key: str) -> Any:
+        data = self.backend.get(self.name, key)
+        return cache_backends.loads(data) if data is not None else None
+
+    def _set_shared(self, key: str, value: Any, ttl: Optional[float]) -> None:
+        self.backend.set(
+            self.name, key, cache_backends.dumps(value),
+            self._shared_ttl(ttl))
+
+    def _shared_ttl(self, ttl: Optional[float]) -> float:
+        # Shared entries always expire, the backend is not bounded by
+        # max_entries.
+        if ttl is None:
+            return float(os.getenv("shared_cache_default_ttl", "86400"))
+        return ttl
+
+    def _backend_call(self, operation: str, func, *args) -> Any:
+        """Call the shared backend, None when it fails or is skipped.
+
+        Errors are logged and the backend is skipped for a while, the
+        cache keeps working in process only.
+        """
+        if time.monotonic() < self._backend_retry_at:
+            return None
+        try:
+            return func(*args)
+        except Exception as e:
+            logger.warning(
+                f"Shared cache {self.name} {operation} failed: {e}")
+            metrics.CACHE_BACKEND_ERRORS.labels(
+                cache=self.name, operation=operation).inc()
+            self._backend_retry_at = time.monotonic() + BACKEND_RETRY_SECONDS
+            return None
+
+    def stats(self) -> Dict[str, Any]:
+        """Get hit / miss counts of cache."""
+        with self._lock:
+            return {
+                "name": self.name,
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "shared": self.backend is not None,
+            }
+
+
+# Named caches shared across requests in a worker.
+_caches: Dict[str, TTLCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(
+    name: str,
+    max_entries: int = 1024,
+    ttl: Optional[float] = None
+) -> TTLCache:
+    """Get or create a named cache.
+
+    Caches are created on first use so settings loaded from
+    config.yaml at startup are respected. Caches listed in shared_caches
+    use the shared backend set as cache_backend, keeping entries in
+    process for at most shared_cache_local_ttl seconds.
+
+    Args:
+        name: Name of cache.
+        max_entries: Max entries of cache if created.
+        ttl: Default expiry of entries if created.
+
+    Returns:
+        Shared cache instance.
+    """
+    with _caches_lock:
+        if name not in _caches:
+            shared = os.getenv("shared_caches", DEFAULT_SHARED_CACHES)
+            backend = None
+            if name in [n.strip() for n in shared.split(",")]:
+                backend = cache_backends.get_backend()
+            _caches[name] = TTLCache(
+                name=name,
+                max_entries=max_entries,
+                ttl=ttl,
+                backend=backend,
+                local_ttl=float(os.getenv("shared_cache_local_ttl", "5"))
+            )
+        return _caches[name]
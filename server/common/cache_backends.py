@@ -0,0 +1,285 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""Shared Cache Backends.
+
+In-process caches are duplicated per worker and cold after a restart.
+A shared backend holds cache entries for all workers:
+    sqlite: Local file with a memory-mapped SQLite store, for several
+        workers on one host.
+    redis: Redis protocol server, for workers on several hosts.
+
+Values are serialized with msgpack, compressed with zlib when large.
+The cache_backend env variable selects the backend, memory (default)
+keeps caches in process only.
+"""
+
+import abc
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Hashable, Optional
+
+import msgpack
+
+from server.config.logging import logger
+
+
+MEMORY = "memory"
+SQLITE = "sqlite"
+REDIS = "redis"
+
+# Serialized values larger than this are compressed.
+COMPRESS_MIN_BYTES = 1024
+
+# First byte of a serialized value.
+_RAW = b"\x00"
+_ZLIB = b"\x01"
+
+
+def _default(value: Any) -> Any:
+    # Sequences msgpack does not know, e.g. proto repeated fields.
+    if hasattr(value, "__iter__"):
+        return list(value)
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def dumps(value: Any) -> bytes:
+    """Serialize a cache value.
+
+    Tuples are restored as lists.
+
+    Args:
+        value: JSON like value, bytes are kept as is.
+    """
+    data = msgpack.packb(value, use_bin_type=True, default=_default)
+    if len(data) > COMPRESS_MIN_BYTES:
+        compressed = zlib.compress(data, 1)
+        if len(compressed) < len(data):
+            return _ZLIB + compressed
+    return _RAW + data
+
+
+def loads(data: bytes) -> Any:
+    """Deserialize a value serialized with dumps."""
+    flag, payload = data[:1], data[1:]
+    if flag == _ZLIB:
+        payload = zlib.decompress(payload)
+    return msgpack.unpackb(payload, raw=False, strict_map_key=False)
+
+
+def key_to_str(key: Hashable) -> str:
+    """Shared key of a cache key, e.g. of an embedding's tuple key."""
+    return key if isinstance(key, str) else repr(key)
+
+
+class CacheBackend(abc.ABC):
+    """Store of serialized cache entries shared by workers."""
+    # Whether reads may wait, e.g. on the network, and are made from a
+    # thread by async callers. Writes always are.
+    blocking_reads = True
+
+    @abc.abstractmethod
+    def get(self, namespace: str, key: str) -> Optional[bytes]:
+        """Get an entry, None on a miss."""
+
+    @abc.abstractmethod
+    def set(
+        self,
+        namespace: str,
+        key: str,
+        data: bytes,
+        ttl: Optional[float]
+    ) -> None:
+        """Add an entry valid for ttl seconds, None never expires."""
+
+    @abc.abstractmethod
+    def delete(self, namespace: str, key: str) -> None:
+        """Invalidate an entry."""
+
+    @abc.abstractmethod
+    def clear(self, namespace: str) -> None:
+        """Invalidate all entries of a cache."""
+
+
+class SQLiteBackend(CacheBackend):
+    """Cache entries in a local SQLite file shared by workers of a host."""
+    # In WAL mode reads never wait on writers, only writes wait on other
+    # workers' writes.
+    blocking_reads = False
+
+    def __init__(
+        self,
+        path: str,
+        mmap_size: int = 256 * 1024 * 1024,
+        prune_every: int = 1000
+    ):
+        """Init SQLite backend.
+
+        Args:
+            path: Database file, created if missing.
+            mmap_size: Bytes of the file read through memory mapping.
+            prune_every: Writes between deletions of expired entries.
+        """
+        self.path = path
+        self.mmap_size = mmap_size
+        self.prune_every = prune_every
+        self._local = threading.local()
+        self._writes = 0
+        self._connect().execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " namespace TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value BLOB NOT NULL,"
+            " expires_at REAL,"
+            " PRIMARY KEY (namespace, key)"
+            ") WITHOUT ROWID"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        # SQLite connections are not shared across threads.
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.path, timeout=1.0, isolation_level=None,
+                check_same_thread=False)
+            # Readers do not block the writer of another worker.
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+            self._local.connection = connection
+        return connection
+
+    def get(self, namespace: str, key: str) -> Optional[bytes]:
+        row = self._connect().execute(
+            "SELECT value FROM entries WHERE namespace = ? AND key = ?"
+            " AND (expires_at IS NULL OR expires_at > ?)",
+            (namespace, key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(
+        self,
+        namespace: str,
+        key: str,
+        data: bytes,
+        ttl: Optional[float]
+    ) -> None:
+        # Wall clock, expiry is shared between processes.
+        expires_at = time.time() + ttl if ttl is not None else None
+        connection = self._connect()
+        connection.execute(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+            (namespace, key, sqlite3.Binary(data), expires_at)
+        )
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            connection.execute(
+                "DELETE FROM entries WHERE expires_at <= ?", (time.time(),))
+
+    def delete(self, namespace: str, key: str) -> None:
+        self._connect().execute(
+            "DELETE FROM entries WHERE namespace = ? AND key = ?",
+            (namespace, key)
+        )
+
+    def clear(self, namespace: str) -> None:
+        self._connect().execute(
+            "DELETE FROM entries WHERE namespace = ?", (namespace,))
+
+
+class RedisBackend(CacheBackend):
+    """Cache entries in a Redis protocol server shared by hosts."""
+    def __init__(
+        self,
+        url: str,
+        timeout: float = 0.1,
+        prefix: str = "sme"
+    ):
+        """Init Redis backend.
+
+        Args:
+            url: Server url, e.g. redis://localhost:6379/0.
+            timeout: Max seconds of a call.
+            prefix: Prefix of keys, entries are stored as
+                <prefix>:<namespace>:<key>.
+        """
+        import redis  # pylint: disable=import-outside-toplevel
+
+        self.client = redis.Redis.from_url(
+            url,
+            socket_timeout=timeout,
+            socket_connect_timeout=timeout
+        )
+        self.prefix = prefix
+
+    def _key(self, namespace: str, key: str) -> str:
+        return f"{self.prefix}:{namespace}:{key}"
+
+    def get(self, namespace: str, key: str) -> Optional[bytes]:
+        return self.client.get(self._key(namespace, key))
+
+    def set(
+        self,
+        namespace: str,
+        key: str,
+        data: bytes,
+        ttl: Optional[float]
+    ) -> None:
+        self.client.set(
+            self._key(namespace, key),
+            data,
+            px=int(ttl * 1000) if ttl is not None else None
+        )
+
+    def delete(self, namespace: str, key: str) -> None:
+        self.client.delete(self._key(namespace, key))
+
+    def clear(self, namespace: str) -> None:
+        keys = list(self.client.scan_iter(
+            match=f"{self.prefix}:{namespace}:*", count=500))
+        if keys:
+            self.client.delete(*keys)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> Optional[CacheBackend]:
+    """Shared cache backend of this process.
+
+    Selected with cache_backend (memory, sqlite or redis), configured
+    with cache_sqlite_path, cache_redis_url and cache_redis_timeout.
+
+    Returns:
+        CacheBackend, None for in-process caches only or when the
+        backend cannot be created.
+    """
+    global _backend
+    kind = os.getenv("cache_backend", MEMORY).lower()
+    if kind == MEMORY:
+        return None
+    with _backend_lock:
+        if _backend is None:
+            try:
+                if kind == SQLITE:
+                    _backend = SQLiteBackend(
+                        path=os.getenv(
+                            "cache_sqlite_path", "/tmp/sme_cache.sqlite3"))
+                elif kind == REDIS:
+                    _backend = RedisBackend(
+                        url=os.getenv(
+                            "cache_redis_url", "redis://localhost:6379/0"),
+                        timeout=float(
+                            os.getenv("cache_redis_timeout", "0.1")))
+                else:
+                    logger.error(f"Unknown cache_backend {kind}.")
+                    return None
+            except Exception as e:
+                logger.error(f"Error creating {kind} cache backend: {e}")
+                return None
+            logger.info(f"Using shared {kind} cache backend.")
+        return _backend
@@ -0,0 +1,212 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""Circuit Breaker Functions.
+
+A breaker per backend tracks the outcome of recent calls. When too many
+fail or are slow it opens and calls fail fast with CircuitOpenError, so
+callers use their fallback instead of waiting on a degraded backend.
+After open_seconds a few probe calls are let through (half open), and
+the breaker closes again when they succeed.
+"""
+
+import collections
+import contextlib
+import os
+import threading
+import time
+from typing import Iterator
+
+import asyncio
+from google.api_core import exceptions
+
+from server.common import metrics
+from server.config.logging import logger
+
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+
+# Gauge value of each state.
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# Calls slower than this many seconds count against a backend.
+DEFAULT_SLOW_SECONDS = {
+    "gemini": 15.0,
+    "vertex_search": 3.0,
+    "vector_search": 2.0,
+}
+
+# Errors of one request or of quota rather than of the backend, not
+# counted as failures: quota throttling (429 / ResourceExhausted) is
+# handled by rate limits, and an invalid request fails on any backend.
+# Other 4xx, e.g. PermissionDenied, Unauthenticated or NotFound of an
+# expired credential or a wrong model name, fail every call and count.
+CLIENT_ERRORS = (exceptions.TooManyRequests, exceptions.InvalidArgument)
+
+# Breakers of this process by backend.
+_breakers = {}
+
+
+class CircuitOpenError(Exception):
+    """Call rejected because the backend's circuit is open."""
+
+
+class CircuitBreaker:
+    """Error rate and latency based circuit breaker."""
+    def __init__(
+        self,
+        name: str,
+        window: int = 20,
+        min_calls: int = 10,
+        failure_rate: float = 0.5,
+        slow_seconds: float = 5.0,
+        slow_rate: float = 0.5,
+        open_seconds: float = 30.0,
+        half_open_probes: int = 2
+    ):
+        """Init circuit breaker.
+
+        Args:
+            name: Backend name used in logs and metrics.
+            window: Number of recent calls considered.
+            min_calls: Calls needed in the window before opening.
+            failure_rate: Share of failed calls that opens the circuit.
+            slow_seconds: Calls slower than this count as slow.
+            slow_rate: Share of slow calls that opens the circuit.
+            open_seconds: Seconds open before probing.
+            half_open_probes: Successful probes needed to close.
+        """
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_seconds = slow_seconds
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+
+        # Recent calls as (failed, slow) tuples.
+        self.calls = collections.deque(maxlen=window)
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probes_in_flight = 0
+        self.probes_succeeded = 0
+        self._lock = threading.Lock()
+        metrics.CIRCUIT_STATE.labels(dependency=name).set(0)
+
+    def _set_state(self, state: str) -> None:
+        if state == self.state:
+            return
+        logger.warning(f"Circuit {self.name}: {self.state} -> {state}")
+        self.state = state
+        self.calls.clear()
+        self.probes_in_flight = 0
+        self.probes_succeeded = 0
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        metrics.CIRCUIT_STATE.labels(dependency=self.name).set(
+            STATE_VALUES[state])
+
+    def allow(self) -> bool:
+        """Whether a call may go through now.
+
+        Allowed half open calls are probes and must be recorded.
+        """
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.open_seconds:
+                    return False
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self.probes_in_flight >= self.half_open_probes:
+                    return False
+                self.probes_in_flight += 1
+            return True
+
+    def record(self, failed: bool, elapsed: float) -> None:
+        """Record the outcome of an allowed call.
+
+        Args:
+            failed: Whether the call raised an error.
+            elapsed: Seconds the call took.
+        """
+        slow = elapsed >= self.slow_seconds
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.probes_in_flight = max(0, self.probes_in_flight - 1)
+                if failed or slow:
+                    self._set_state(OPEN)
+                    return
+                self.probes_succeeded += 1
+                if self.probes_succeeded >= self.half_open_probes:
+                    self._set_state(CLOSED)
+                return
+            if self.state == OPEN:
+                return
+
+            self.calls.append((failed, slow))
+            if len(self.calls) < self.min_calls:
+                return
+            failures = sum(1 for call in self.calls if call[0])
+            slow_calls = sum(1 for call in self.calls if call[1])
+            if (failures >= self.failure_rate * len(self.calls)
+                    or slow_calls >= self.slow_rate * len(self.calls)):
+                self._set_state(OPEN)
+
+    @contextlib.contextmanager
+    def guard(self) -> Iterator[None]:
+        """Run a call through the breaker.
+
+        Works around both sync and async code, e.g.
+            with breaker.guard():
+                response = await client.search(request)
+
+        Quota and invalid request errors (CLIENT_ERRORS) do not count as
+        failures.
+
+        Raises:
+            CircuitOpenError: If the circuit is open.
+        """
+        if not self.allow():
+            metrics.CIRCUIT_REJECTED.labels(dependency=self.name).inc()
+            raise CircuitOpenError(f"Circuit {self.name} is {self.state}.")
+        start = time.perf_counter()
+        try:
+            yield
+        except asyncio.CancelledError:
+            # Cancelled by a caller deadline, only count it if slow.
+            self.record(failed=False, elapsed=time.perf_counter() - start)
+            raise
+        except CLIENT_ERRORS:
+            self.record(failed=False, elapsed=time.perf_counter() - start)
+            raise
+        except Exception:
+            self.record(failed=True, elapsed=time.perf_counter() - start)
+            raise
+        self.record(failed=False, elapsed=time.perf_counter() - start)
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """Breaker of a backend shared by this process.
+
+    Configured with breaker_<name>_slow_seconds, breaker_window,
+    breaker_min_calls, breaker_failure_rate, breaker_slow_rate
+    and breaker_open_seconds env variables.
+
+    Args:
+        name: Backend name, e.g. "vertex_search".
+    """
+    if name not in _breakers:
+        _breakers[name] = CircuitBreaker(
+            name=name,
+            window=int(os.getenv("breaker_window", "20")),
+            min_calls=int(os.getenv("breaker_min_calls", "10")),
+            failure_rate=float(os.getenv("breaker_failure_rate", "0.5")),
+            slow_seconds=float(os.getenv(
+                f"breaker_{name}_slow_seconds",
+                str(DEFAULT_SLOW_SECONDS.get(name, 5.0)))),
+            slow_rate=float(os.getenv("breaker_slow_rate", "0.5")),
+            open_seconds=float(os.getenv("breaker_open_seconds", "30"))
+        )
+    return _breakers[name]
@@ -0,0 +1,176 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""Request Deadline Functions.
+
+A deadline set by a route propagates to every stage of the turn through
+a context variable, including fan-out tasks. Optional stages run with a
+slice of the remaining budget and fall back to a degraded result when
+it runs out, so a slow call cannot hold the whole response.
+"""
+
+import contextlib
+import contextvars
+import os
+import time
+from typing import Any, Awaitable, Iterator, List, Optional, Tuple, Type
+
+import asyncio
+
+from server.config.logging import logger
+
+
+# Seconds kept back for summarizing the result after other stages.
+SUMMARY_RESERVE_SECONDS = 1.5
+
+_deadline: contextvars.ContextVar[
+    Optional["Deadline"]
+] = contextvars.ContextVar("deadline", default=None)
+
+
+class Deadline:
+    """Time budget of a request and the stages degraded to meet it."""
+    def __init__(self, seconds: float):
+        """Init deadline.
+
+        Args:
+            seconds: Budget from now.
+        """
+        self.expires_at = time.monotonic() + seconds
+        self.degraded: List[str] = []
+
+    def remaining(self) -> float:
+        """Seconds left, negative once expired."""
+        return self.expires_at - time.monotonic()
+
+
+@contextlib.contextmanager
+def deadline_scope(seconds: Optional[float] = None) -> Iterator[Deadline]:
+    """Set the deadline of the current request.
+
+    A nested scope never extends an outer deadline.
+
+    Args:
+        seconds: Budget in seconds. Defaults to request_deadline env
+            variable.
+    """
+    if seconds is None:
+        seconds = float(os.getenv("request_deadline", "15"))
+    deadline = Deadline(seconds)
+    outer = _deadline.get()
+    if outer is not None:
+        deadline.expires_at = min(deadline.expires_at, outer.expires_at)
+        deadline.degraded = outer.degraded
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+
+def share() -> Optional[Deadline]:
+    """Replace the current deadline with a copy that can be extended.
+
+    Used for work shared by several requests, see extend(). Run in the
+    context of the shared work, e.g. a copied context.
+
+    Returns:
+        Shared deadline, None without a current deadline.
+    """
+    current = _deadline.get()
+    if current is None:
+        return None
+    shared = Deadline(current.remaining())
+    shared.expires_at = current.expires_at
+    shared.degraded = current.degraded
+    _deadline.set(shared)
+    return shared
+
+
+def extend(shared: Optional[Deadline]) -> None:
+    """Extend a shared deadline to the current request's deadline.
+
+    Args:
+        shared: Deadline of shared work, from share().
+    """
+    current = _deadline.get()
+    if shared is not None and current is not None:
+        shared.expires_at = max(shared.expires_at, current.expires_at)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left of the current deadline, None without one."""
+    deadline = _deadline.get()
+    return deadline.remaining() if deadline else None
+
+
+def degraded() -> List[str]:
+    """Stages of the current request that returned a fallback."""
+    deadline = _deadline.get()
+    return sorted(set(deadline.degraded)) if deadline else []
+
+
+def mark_degraded(stage: str) -> None:
+    """Record a stage returned a fallback result."""
+    deadline = _deadline.get()
+    if deadline is not None:
+        deadline.degraded.append(stage)
+
+
+def stage_budget(
+    fraction: float = 1.0,
+    reserve: float = 0.0
+) -> Optional[float]:
+    """Seconds a stage may take.
+
+    Args:
+        fraction: Share of the remaining budget, after reserve.
+        reserve: Seconds kept back for later stages.
+
+    Returns:
+        Budget in seconds, None without a deadline.
+    """
+    left = remaining()
+    if left is None:
+        return None
+    return max(0.0, (left - reserve) * fraction)
+
+
+async def run_with_budget(
+    awaitable: Awaitable[Any],
+    fallback: Any,
+    stage: str,
+    fraction: float = 1.0,
+    reserve: float = 0.0,
+    errors: Tuple[Type[Exception], ...] = (Exception,)
+) -> Any:
+    """Run an optional stage, falling back when out of time or failing.
+
+    Args:
+        awaitable: Stage to run.
+        fallback: Degraded result returned instead.
+        stage: Stage name reported in the response.
+        fraction: Share of the remaining budget, after reserve.
+        reserve: Seconds kept back for later stages.
+        errors: Errors of the stage falling back, others are raised.
+
+    Returns:
+        Stage result or fallback.
+    """
+    budget = stage_budget(fraction=fraction, reserve=reserve)
+    if budget is not None and budget <= 0:
+        # Never started, close it to avoid a "never awaited" warning.
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        logger.warning(f"No time left for {stage}, using fallback.")
+        mark_degraded(stage)
+        return fallback
+
+    try:
+        return await asyncio.wait_for(awaitable, timeout=budget)
+    except asyncio.TimeoutError:
+        logger.warning(f"Out of time for {stage}, using fallback.")
+    except errors as e:
+        logger.error(f"Error in {stage}, using fallback: {e}")
+    mark_degraded(stage)
+    return fallback
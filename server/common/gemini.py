@@ -1,57 +1,117 @@
 # Copyright 2024 Google LLC. This software is provided as-is, without warranty
 # or representation for any use or purpose. Your use of it is subject to your
 # agreement with Google.
-"""Gemini Model Functions."""
+"""Gemini Model Functions.
+
+The Vertex AI SDK takes seconds to import, so it is imported on first
+use rather than with this module.
+"""
 
 import json
-from typing import Any, Dict, Optional, Union
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple, Union
+
+import asyncio
+from google.api_core import exceptions
+
+from server import fakes
+from server.common import metrics
+from server.common import model_config
+from server.common import rate_limit
+from server.common import single_flight
+from server.common import token_budget
+
+if TYPE_CHECKING:
+    from vertexai.generative_models import (
+        GenerationConfig, GenerationResponse, GenerativeModel
+    )
+
+
+# GenerativeModel instances by model name and system prompt, shared by
+# model managers so per request managers do not rebuild them.
+_models: Dict[Tuple[str, Optional[str]], "GenerativeModel"] = {}
+_models_lock = threading.Lock()
+
+
+def default_safety_settings() -> Dict[Any, Any]:
+    """Safety settings blocking only high probability harm."""
+    from vertexai.generative_models import HarmBlockThreshold, HarmCategory  # pylint: disable=import-outside-toplevel
+    return {
+        HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_ONLY_HIGH,  # pylint: disable=line-too-long
+        HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_ONLY_HIGH,  # pylint: disable=line-too-long
+        HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_ONLY_HIGH,  # pylint: disable=line-too-long
+        HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_ONLY_HIGH,  # pylint: disable=line-too-long
+        HarmCategory.HARM_CATEGORY_UNSPECIFIED: HarmBlockThreshold.BLOCK_ONLY_HIGH,  # pylint: disable=line-too-long
+    }
 
-from vertexai.generative_models import (
-    HarmCategory,
-    HarmBlockThreshold,
-    GenerationConfig,
-    GenerationResponse,
-    GenerativeModel,
-)
 
+def get_generative_model(
+    model_name: str,
+    system_prompt: Optional[str] = None,
+    safety_settings: Optional[Dict[str, Any]] = None
+) -> "GenerativeModel":
+    """Get a GenerativeModel, cached unless safety settings are custom.
+
+    Returns the fake Gemini model when backend_mode is fake.
+
+    Args:
+        model_name: Gemini model name.
+        system_prompt: System prompt of model.
+        safety_settings: Safety settings, defaults to
+            default_safety_settings().
+    """
+    if fakes.enabled():
+        from server.fakes import gemini as fake_gemini  # pylint: disable=import-outside-toplevel
+        return fake_gemini.FakeGenerativeModel(model_name, system_prompt)
+
+    from vertexai.generative_models import GenerativeModel  # pylint: disable=import-outside-toplevel
+
+    # Add system instruction if not none.
+    system_instruction = [system_prompt] if system_prompt else None
+    if safety_settings is not None:
+        return GenerativeModel(
+            model_name=model_name,
+            safety_settings=safety_settings,
+            system_instruction=system_instruction,
+        )
 
-DEFAULT_SAFETY_SETTINGS = {
-    HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_ONLY_HIGH,  # pylint: disable=line-too-long
-    HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-    HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-    HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_ONLY_HIGH,  # pylint: disable=line-too-long
-    HarmCategory.HARM_CATEGORY_UNSPECIFIED: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-}
+    key = (model_name, system_prompt)
+    with _models_lock:
+        if key not in _models:
+            _models[key] = GenerativeModel(
+                model_name=model_name,
+                safety_settings=default_safety_settings(),
+                system_instruction=system_instruction,
+            )
+        return _models[key]
 
 
 class GeminiModelManager:
     """A llm model manager class."""
     def __init__(
         self,
-        model_name: str = "gemini-1.5-flash-001",
+        model_name: Optional[str] = None,
         system_prompt: Optional[str] = None,
         safety_settings: Optional[Dict[str, Any]] = None,
     ):
         """Initialize a Gemini model instance.
 
         Args:
-            model_name (str, optional): Gemini model name.
+            model_name (str, optional): Gemini model name. Defaults to
+                model_config.default_model(). Stages configured with a
+                model in model_config use that instead.
             system_prompt (str, optional): A system prompt to
                 guide the model's behavior.
             safety_settings (Dict[str, Any], optional): Safety settings
                 to control content filtering.
         """
-        # Safety settings for model.
-        safety_settings = safety_settings or DEFAULT_SAFETY_SETTINGS
-
-        # Add system instruction if not none.
-        system_instruction = [system_prompt] if system_prompt else None
-
-        self.model = GenerativeModel(
-            model_name=model_name,
-            safety_settings=safety_settings,
-            system_instruction=system_instruction,
-        )
+        self.model_name = model_name or model_config.default_model()
+        self.system_prompt = system_prompt
+        self.safety_settings = safety_settings
+        self.model = get_generative_model(
+            self.model_name, system_prompt, safety_settings)
 
     async def generate_response(
         self,
@@ -59,23 +119,109 @@ class GeminiModelManager:
         temperature: Optional[float] = 0.2,
         max_output_tokens:  Optional[int] = 8192,
         top_p: Optional[float] = 0.95,
-        response_mime_type: Optional[str] = "text/plain"
+        response_mime_type: Optional[str] = "text/plain",
+        response_schema: Optional[Dict[str, Any]] = None,
+        stage: str = "gemini",
+        coalesce: Optional[bool] = None
     ):
-        """Generate LLM response."""
-        generation_config = GenerationConfig(
-            temperature=temperature,
-            max_output_tokens=max_output_tokens,
-            top_p=top_p,
-            response_mime_type=response_mime_type
-        )
-        response = await self.model.generate_content_async(
-            contents=contents,
-            generation_config=generation_config
+        """Generate LLM response.
+
+        Args:
+            contents: Prompt or list of prompt parts.
+            temperature: Sampling temperature.
+            max_output_tokens: Max tokens to generate.
+            top_p: Nucleus sampling probability.
+            response_mime_type: Mime type of response.
+            response_schema (Dict[str, Any], optional): OpenAPI schema
+                constraining a JSON response.
+            stage: Pipeline stage name used in metrics.
+            coalesce: Whether identical concurrent requests share one
+                call. Defaults to True for deterministic requests
+                (temperature 0). Requests with images never coalesce.
+        """
+        key = coalesce_key(
+            self.model_name, self.system_prompt, stage, contents,
+            temperature, max_output_tokens, top_p, response_mime_type,
+            response_schema
         )
+        if key is not None and (coalesce or (
+                coalesce is None and temperature == 0)):
+            return await single_flight.get_group("gemini").do(
+                key,
+                lambda: self._generate_response(
+                    contents, temperature, max_output_tokens, top_p,
+                    response_mime_type, response_schema, stage)
+            )
+        return await self._generate_response(
+            contents, temperature, max_output_tokens, top_p,
+            response_mime_type, response_schema, stage)
+
+    async def _generate_response(
+        self,
+        contents,
+        temperature: Optional[float],
+        max_output_tokens: Optional[int],
+        top_p: Optional[float],
+        response_mime_type: Optional[str],
+        response_schema: Optional[Dict[str, Any]],
+        stage: str
+    ):
+        """Generate LLM response, see generate_response."""
+        # Model and settings of stage, routed by latency.
+        settings = model_config.resolve(
+            stage, self.model_name, temperature, max_output_tokens)
+        model_name = settings["model"]
+        model = self.model
+        if model_name != self.model_name:
+            model = get_generative_model(
+                model_name, self.system_prompt, self.safety_settings)
 
         # If response should be json.
         is_json = response_mime_type != "text/plain"
 
+        async def generate(max_tokens: Optional[int]) -> "GenerationResponse":
+            generation_config = make_generation_config(
+                temperature=settings["temperature"],
+                max_output_tokens=max_tokens,
+                top_p=top_p,
+                response_mime_type=response_mime_type,
+                response_schema=response_schema
+            )
+
+            async def call():
+                with metrics.track_stage(stage):
+                    return await timed_call(
+                        stage,
+                        model_name,
+                        settings["timeout"],
+                        model.generate_content_async(
+                            contents=contents,
+                            generation_config=generation_config
+                        )
+                    )
+
+            # Rate limited, retried on quota and transient errors.
+            response = await rate_limit.call_with_retries(
+                model_name=model_name,
+                stage=stage,
+                call=call
+            )
+            metrics.record_llm_usage(stage, model_name, response)
+            return response
+
+        # Truncated JSON does not parse, so JSON stages use a learned
+        # token limit and retry only truncated responses with more.
+        if is_json:
+            response = await token_budget.generate_within_budget(
+                stage, settings["max_output_tokens"], generate)
+        else:
+            response = await generate(settings["max_output_tokens"])
+
+        # Record responses for replay by the fake Gemini backend.
+        record_file = os.getenv("gemini_record_file")
+        if record_file:
+            self.record_response(record_file, contents, stage, response)
+
         # Parse LLM result.
         result = self.parse_gemini_text_response(
             response=response,
@@ -86,7 +232,7 @@ class GeminiModelManager:
 
     def parse_gemini_text_response(
         self,
-        response: GenerationResponse,
+        response: "GenerationResponse",
         is_json: bool = False
     ) -> Union[str, Dict]:
         """Extracts text content from Gemini response.
@@ -105,3 +251,114 @@ class GeminiModelManager:
         except Exception:
             text = None
         return text
+
+    def record_response(
+        self,
+        path: str,
+        contents,
+        stage: str,
+        response: "GenerationResponse"
+    ) -> None:
+        """Append a response to a recording file.
+
+        Args:
+            path: JSON lines file to record to.
+            contents: Prompt or list of prompt parts.
+            stage: Pipeline stage name.
+            response: Gemini API response object.
+        """
+        from server.fakes import recording  # pylint: disable=import-outside-toplevel
+        try:
+            text = response.candidates[0].content.parts[0].text
+        except Exception:
+            text = None
+        recording.record_response(
+            path=path,
+            key=recording.request_key(stage, self.system_prompt, contents),
+            stage=stage,
+            text=text
+        )
+
+
+def make_generation_config(**kwargs) -> "GenerationConfig":
+    """GenerationConfig of a call, a dict with the fake Gemini model.
+
+    Args:
+        kwargs: GenerationConfig init args.
+    """
+    if fakes.enabled():
+        return kwargs
+    from vertexai.generative_models import GenerationConfig  # pylint: disable=import-outside-toplevel
+    return GenerationConfig(**kwargs)
+
+
+def coalesce_key(
+    model_name: str,
+    system_prompt: Optional[str],
+    stage: str,
+    contents,
+    *generation_params
+) -> Optional[Tuple]:
+    """Key of identical Gemini requests.
+
+    Args:
+        model_name: Gemini model name.
+        system_prompt: System prompt of model.
+        stage: Pipeline stage name.
+        contents: Prompt or list of prompt parts.
+        generation_params: Generation config values.
+
+    Returns:
+        Hashable key, None when contents are not all text.
+    """
+    parts = contents if isinstance(contents, list) else [contents]
+    if not all(isinstance(part, str) for part in parts):
+        return None
+    return (
+        model_name, system_prompt, stage, tuple(parts),
+        json.dumps(generation_params, sort_keys=True, default=str)
+    )
+
+
+async def timed_call(
+    stage: str,
+    model_name: str,
+    timeout: Optional[float],
+    awaitable
+) -> Any:
+    """Await a model call, recording its latency for routing.
+
+    Args:
+        stage: Pipeline stage name.
+        model_name: Gemini model called.
+        timeout: Seconds the call may take, None for no timeout.
+        awaitable: Model call.
+
+    Returns:
+        Result of call.
+
+    Raises:
+        DeadlineExceeded: When the call times out, retried as a
+            transient error.
+    """
+    start = time.perf_counter()
+    try:
+        result = await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError as e:
+        model_config.get_router().record(stage, model_name, timeout)
+        raise exceptions.DeadlineExceeded(
+            f"{stage} on {model_name} timed out after {timeout}s") from e
+    model_config.get_router().record(
+        stage, model_name, time.perf_counter() - start)
+    return result
+
+
+def create_model_manager(**kwargs) -> GeminiModelManager:
+    """Create a Gemini model manager.
+
+    When backend_mode is fake, the manager calls the fake Gemini model.
+
+    Args:
+        kwargs: GeminiModelManager init args.
+    """
+    return GeminiModelManager(**kwargs)
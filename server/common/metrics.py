@@ -0,0 +1,363 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""Metrics Module.
+
+Prometheus metrics for backend calls and a per request
+breakdown of stage timings.
+"""
+
+import contextlib
+import contextvars
+import os
+import time
+from typing import Any, Iterator, List, Optional, Tuple
+
+import asyncio
+from fastapi import Request
+from prometheus_client import Counter, Gauge, Histogram
+
+
+LATENCY_BUCKETS = (
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0
+)
+
+STAGE_LATENCY = Histogram(
+    "sme_stage_latency_seconds",
+    "Latency of a backend call by pipeline stage.",
+    ["stage", "outcome"],
+    buckets=LATENCY_BUCKETS,
+)
+
+# Intents served by SME, other turn intent labels are counted as other.
+INTENTS = ("generic_product_search", "product_recommendations", "recipes")
+
+TURN_LATENCY = Histogram(
+    "sme_turn_latency_seconds",
+    "Latency of a full chat turn by intent.",
+    ["intent"],
+    buckets=LATENCY_BUCKETS,
+)
+
+LLM_TOKENS = Counter(
+    "sme_llm_tokens_total",
+    "Gemini tokens by stage, model and kind (prompt / response).",
+    ["stage", "model", "kind"],
+)
+
+LLM_COST = Counter(
+    "sme_llm_cost_usd_total",
+    "Estimated Gemini cost in USD by stage and model.",
+    ["stage", "model"],
+)
+
+CACHE_REQUESTS = Counter(
+    "sme_cache_requests_total",
+    "Cache lookups by cache and result.",
+    ["cache", "result"],
+)
+
+IMAGE_BYTES = Histogram(
+    "sme_image_bytes",
+    "Size of uploaded images before and after preprocessing.",
+    ["kind"],
+    buckets=(5e4, 1e5, 2.5e5, 5e5, 1e6, 2e6, 4e6, 8e6, 1.6e7),
+)
+
+THROTTLE_WAIT = Histogram(
+    "sme_throttle_wait_seconds",
+    "Time a model call waited for the client side rate / concurrency limit.",
+    ["stage", "model"],
+    buckets=LATENCY_BUCKETS,
+)
+
+LLM_RETRIES = Counter(
+    "sme_llm_retries_total",
+    "Gemini call retries by stage and error, or exhausted when giving up.",
+    ["stage", "outcome"],
+)
+
+CONCURRENCY_LIMIT = Gauge(
+    "sme_concurrency_limit",
+    "Current adaptive concurrency limit by limiter.",
+    ["limiter"],
+    multiprocess_mode="max",
+)
+
+CIRCUIT_STATE = Gauge(
+    "sme_circuit_state",
+    "Circuit breaker state by dependency: 0 closed, 1 half open, 2 open.",
+    ["dependency"],
+    multiprocess_mode="max",
+)
+
+CIRCUIT_REJECTED = Counter(
+    "sme_circuit_rejected_total",
+    "Calls failed fast by an open circuit breaker.",
+    ["dependency"],
+)
+
+FALLBACKS = Counter(
+    "sme_fallbacks_total",
+    "Results served by a local fallback instead of a backend.",
+    ["fallback"],
+)
+
+SINGLE_FLIGHT_CALLS = Counter(
+    "sme_single_flight_calls_total",
+    "Deduplicated calls by call and result (leader / coalesced).",
+    ["call", "result"],
+)
+
+SEMANTIC_CACHE_SECONDS_SAVED = Counter(
+    "sme_semantic_cache_seconds_saved_total",
+    "Turn latency saved by semantic cache hits, as originally measured.",
+)
+
+MODEL_SELECTIONS = Counter(
+    "sme_model_selections_total",
+    "Gemini model chosen per call by stage, model and routing reason.",
+    ["stage", "model", "reason"],
+)
+
+TOKEN_BUDGET_RETRIES = Counter(
+    "sme_token_budget_retries_total",
+    "Gemini responses cut off by the learned token limit, by stage and "
+    "outcome (truncated and retried / exhausted at the ceiling).",
+    ["stage", "outcome"],
+)
+
+PREFETCH_ITEMS = Counter(
+    "sme_prefetch_items_total",
+    "Speculative prefetch work by kind and outcome (ok, error, skipped "
+    "while busy, dropped over budget).",
+    ["kind", "outcome"],
+)
+
+SCHEDULER_WAIT = Histogram(
+    "sme_scheduler_wait_seconds",
+    "Time a backend call queued in the scheduler by backend and priority.",
+    ["backend", "priority"],
+    buckets=LATENCY_BUCKETS,
+)
+
+SCHEDULER_QUEUED = Gauge(
+    "sme_scheduler_queued",
+    "Backend calls queued in the scheduler by backend and priority.",
+    ["backend", "priority"],
+    multiprocess_mode="livesum",
+)
+
+ADMISSION_QUEUE = Gauge(
+    "sme_admission_queue",
+    "API requests waiting for admission.",
+    multiprocess_mode="livesum",
+)
+
+ADMISSION_REJECTED = Counter(
+    "sme_admission_rejected_total",
+    "API requests rejected with 503 by reason (queue_full, queue_timeout).",
+    ["reason"],
+)
+
+DEGRADATION_LEVEL = Gauge(
+    "sme_degradation_level",
+    "Rungs of the degradation ladder shed for the last admitted request.",
+    multiprocess_mode="max",
+)
+
+WARMUP_ITEMS = Counter(
+    "sme_warmup_items_total",
+    "Cache warm-up items by kind and outcome (ok, error).",
+    ["kind", "outcome"],
+)
+
+WEBSOCKET_CONNECTIONS = Gauge(
+    "sme_websocket_connections",
+    "Open WebSocket chat connections.",
+    multiprocess_mode="livesum",
+)
+
+WEBSOCKET_TURNS = Counter(
+    "sme_websocket_turns_total",
+    "WebSocket chat turns by outcome (ok, cancelled, rejected, error).",
+    ["outcome"],
+)
+
+CACHE_BACKEND_ERRORS = Counter(
+    "sme_cache_backend_errors_total",
+    "Shared cache backend errors by cache and operation.",
+    ["cache", "operation"],
+)
+
+# Estimated USD per million (prompt, response) tokens by model prefix.
+# Longer prefixes first, the first match is used.
+MODEL_PRICING = {
+    "gemini-1.5-flash-8b": (0.0375, 0.15),
+    "gemini-1.5-flash": (0.075, 0.30),
+    "gemini-1.5-pro": (1.25, 5.00),
+}
+
+# Stage timings of the current request, set by timing_middleware.
+_request_timings: contextvars.ContextVar[
+    Optional[List[Tuple[str, float]]]
+] = contextvars.ContextVar("request_timings", default=None)
+
+# Innermost stage being tracked, e.g. the stage of a Gemini call.
+_stage: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "stage", default=None)
+
+
+@contextlib.contextmanager
+def track_stage(stage: str) -> Iterator[None]:
+    """Record latency and outcome of a stage.
+
+    Works around both sync and async code, e.g.
+        with metrics.track_stage("vertex_search"):
+            response = await client.search(request)
+
+    Args:
+        stage: Name of pipeline stage.
+    """
+    start = time.perf_counter()
+    outcome = "ok"
+    token = _stage.set(stage)
+    try:
+        yield
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        _stage.reset(token)
+        elapsed = time.perf_counter() - start
+        STAGE_LATENCY.labels(stage=stage, outcome=outcome).observe(elapsed)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((stage, elapsed))
+
+
+def current_stage() -> Optional[str]:
+    """Innermost stage tracked by track_stage, None outside of stages."""
+    return _stage.get()
+
+
+def intent_label(intent: Optional[str]) -> str:
+    """Bounded metric label of a classified or caller given intent."""
+    if intent is None:
+        return "none"
+    return intent if intent in INTENTS else "other"
+
+
+def record_llm_usage(stage: str, model_name: str, response: Any) -> None:
+    """Record token counts and estimated cost of a Gemini response.
+
+    Args:
+        stage: Name of pipeline stage.
+        model_name: Gemini model name.
+        response: Gemini GenerationResponse.
+    """
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+    response_tokens = getattr(usage, "candidates_token_count", 0) or 0
+    LLM_TOKENS.labels(stage=stage, model=model_name, kind="prompt").inc(
+        prompt_tokens)
+    LLM_TOKENS.labels(stage=stage, model=model_name, kind="response").inc(
+        response_tokens)
+
+    for prefix, (prompt_price, response_price) in MODEL_PRICING.items():
+        if model_name.startswith(prefix):
+            cost = (prompt_tokens * prompt_price
+                    + response_tokens * response_price) / 1e6
+            LLM_COST.labels(stage=stage, model=model_name).inc(cost)
+            break
+
+
+def record_throttle_wait(stage: str, model_name: str, seconds: float) -> None:
+    """Record time a call waited on client side limits.
+
+    Shown as a separate "<stage>_throttle" Server-Timing entry so
+    throttling is not mistaken for model latency.
+
+    Args:
+        stage: Name of pipeline stage.
+        model_name: Gemini model name.
+        seconds: Time waited.
+    """
+    THROTTLE_WAIT.labels(stage=stage, model=model_name).observe(seconds)
+    timings = _request_timings.get()
+    # Skip uncontended waits to keep the header short.
+    if timings is not None and seconds >= 0.001:
+        timings.append((f"{stage}_throttle", seconds))
+
+
+def record_scheduler_wait(
+    backend: str,
+    priority: str,
+    stage: Optional[str],
+    seconds: float
+) -> None:
+    """Record time a call queued for a backend slot.
+
+    Shown as a separate "<stage>_queue" Server-Timing entry.
+
+    Args:
+        backend: Backend name.
+        priority: Priority class of call.
+        stage: Name of pipeline stage.
+        seconds: Time queued.
+    """
+    SCHEDULER_WAIT.labels(backend=backend, priority=priority).observe(seconds)
+    timings = _request_timings.get()
+    if timings is not None and stage and seconds >= 0.001:
+        timings.append((f"{stage}_queue", seconds))
+
+
+def format_server_timing(timings: List[Tuple[str, float]]) -> str:
+    """Format stage timings as a Server-Timing header.
+
+    Stages called more than once are summed, e.g.
+        "intent;dur=412.3, vertex_search;dur=903.1;desc=\"x6\""
+
+    Args:
+        timings: List of stage name and seconds.
+
+    Returns:
+        Header value.
+    """
+    totals = {}
+    for stage, elapsed in timings:
+        total, count = totals.get(stage, (0.0, 0))
+        totals[stage] = (total + elapsed, count + 1)
+
+    entries = []
+    for stage, (total, count) in totals.items():
+        entry = f"{stage};dur={total * 1000:.1f}"
+        if count > 1:
+            entry += f';desc="x{count}"'
+        entries.append(entry)
+    return ", ".join(entries)
+
+
+async def timing_middleware(request: Request, call_next):
+    """Add a Server-Timing breakdown of backend stages to responses.
+
+    Enabled with the timing_header env variable.
+    """
+    if os.getenv("timing_header", "false").lower() != "true":
+        return await call_next(request)
+
+    timings = []
+    token = _request_timings.set(timings)
+    try:
+        response = await call_next(request)
+    finally:
+        _request_timings.reset(token)
+
+    if timings:
+        response.headers["Server-Timing"] = format_server_timing(timings)
+    return response
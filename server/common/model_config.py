@@ -0,0 +1,249 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""Model Config Functions.
+
+Maps each pipeline stage to the Gemini model and generation settings it
+uses. Stages use the settings of their call unless a YAML file
+(model_config_path env variable) of stage name to settings sets them,
+where the "default" entry applies to every stage, e.g.
+    default:
+      model: gemini-1.5-flash-001
+    product_title:
+      max_output_tokens: 20
+      fallback_model: gemini-1.5-flash-002
+      p95_target: 0.8
+
+The model of the "default" entry is only used by model managers created
+without a model; a stage's own model is used by every manager.
+
+Stages with a fallback model and a p95 target are routed by latency: when
+the p95 of the stage on its model exceeds the target, calls shift to the
+fallback model, with every probe_every-th call still sent to the primary
+model so it is used again once it recovers. Routing is opt-in, fallback
+models must be Vertex AI publisher models.
+"""
+
+import collections
+import dataclasses
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+import yaml
+
+from server.common import metrics
+from server.config.logging import logger
+
+
+DEFAULT_MODEL = "gemini-1.5-flash-001"
+
+# Settings of stages in code, overridden by model_config_path. None by
+# default: stages use the settings of their call, without timeouts or
+# latency routing, unless a config file sets them.
+DEFAULT_STAGE_CONFIGS: Dict[str, Dict[str, Any]] = {}
+
+
+@dataclasses.dataclass
+class StageConfig:
+    """Model settings of a pipeline stage.
+
+    Properties:
+        model: Gemini model name, None for the model manager's model.
+        max_output_tokens: Max tokens to generate, None for the caller's.
+        temperature: Sampling temperature, None for the caller's.
+        timeout: Seconds an attempt may take, None for no timeout.
+        fallback_model: Faster model used while the stage is slow.
+        p95_target: Seconds of p95 latency above which the stage is
+            routed to its fallback model.
+    """
+    model: Optional[str] = None
+    max_output_tokens: Optional[int] = None
+    temperature: Optional[float] = None
+    timeout: Optional[float] = None
+    fallback_model: Optional[str] = None
+    p95_target: Optional[float] = None
+
+
+_file_configs: Dict[str, Dict[str, Dict[str, Any]]] = {}
+_file_configs_lock = threading.Lock()
+
+
+def load_config_file(path: str) -> Dict[str, Dict[str, Any]]:
+    """Load stage settings of a YAML file once per path.
+
+    Args:
+        path: YAML file of stage name to settings.
+
+    Returns:
+        Stage name to settings, empty if the file is invalid.
+    """
+    with _file_configs_lock:
+        if path not in _file_configs:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    _file_configs[path] = yaml.safe_load(f) or {}
+            except (OSError, yaml.YAMLError) as e:
+                logger.error(f"Error loading model config {path}: {e}")
+                _file_configs[path] = {}
+        return _file_configs[path]
+
+
+def default_model() -> str:
+    """Model of model managers created without one.
+
+    Returns:
+        Model of the "default" entry of model_config_path, else the
+        gemini_model env variable or DEFAULT_MODEL.
+    """
+    path = os.getenv("model_config_path")
+    if path:
+        model = (load_config_file(path).get("default") or {}).get("model")
+        if model:
+            return model
+    return os.getenv("gemini_model", DEFAULT_MODEL)
+
+
+def get_stage_config(stage: str) -> StageConfig:
+    """Settings of a stage, from defaults and model_config_path.
+
+    Args:
+        stage: Pipeline stage name.
+    """
+    settings = dict(DEFAULT_STAGE_CONFIGS.get(stage, {}))
+    path = os.getenv("model_config_path")
+    if path:
+        file_configs = load_config_file(path)
+        # The default model is the model manager's, see default_model().
+        settings.update({
+            key: value
+            for key, value in (file_configs.get("default") or {}).items()
+            if key != "model"
+        })
+        settings.update(file_configs.get(stage) or {})
+
+    fields = {field.name for field in dataclasses.fields(StageConfig)}
+    return StageConfig(**{
+        key: value for key, value in settings.items() if key in fields
+    })
+
+
+class LatencyRouter:
+    """Routes stages to a fallback model while their p95 is too high."""
+    def __init__(
+        self,
+        window: int = 50,
+        min_calls: int = 10,
+        probe_every: int = 10
+    ):
+        """Init latency router.
+
+        Args:
+            window: Recent latencies kept per stage and model.
+            min_calls: Latencies needed before routing on p95.
+            probe_every: Every nth routed call still uses the primary
+                model to measure whether it recovered.
+        """
+        self.window = window
+        self.min_calls = min_calls
+        self.probe_every = probe_every
+        self._latencies: Dict[Tuple[str, str], collections.deque] = {}
+        self._fallback_calls: Dict[str, int] = collections.Counter()
+        self._lock = threading.Lock()
+
+    def p95(self, stage: str, model_name: str) -> Optional[float]:
+        """p95 latency of a stage on a model, None without enough calls."""
+        with self._lock:
+            latencies = self._latencies.get((stage, model_name))
+            if not latencies or len(latencies) < self.min_calls:
+                return None
+            ordered = sorted(latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def record(self, stage: str, model_name: str, seconds: float) -> None:
+        """Record latency of a call.
+
+        Args:
+            stage: Pipeline stage name.
+            model_name: Gemini model called.
+            seconds: Latency of call, or its timeout when it timed out.
+        """
+        with self._lock:
+            key = (stage, model_name)
+            if key not in self._latencies:
+                self._latencies[key] = collections.deque(maxlen=self.window)
+            self._latencies[key].append(seconds)
+
+    def select_model(self, stage: str, config: StageConfig) -> str:
+        """Model of the next call of a stage.
+
+        Args:
+            stage: Pipeline stage name.
+            config: Settings of stage, with its primary model set.
+
+        Returns:
+            Primary or fallback model name.
+        """
+        model_name = config.model
+        reason = "primary"
+        if config.fallback_model and config.p95_target:
+            p95 = self.p95(stage, config.model)
+            if p95 is not None and p95 > config.p95_target:
+                with self._lock:
+                    self._fallback_calls[stage] += 1
+                    probe = self._fallback_calls[stage] % self.probe_every == 0
+                if probe:
+                    reason = "probe"
+                else:
+                    model_name = config.fallback_model
+                    reason = "latency_fallback"
+        metrics.MODEL_SELECTIONS.labels(
+            stage=stage, model=model_name, reason=reason).inc()
+        return model_name
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> LatencyRouter:
+    """Latency router shared by this process."""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = LatencyRouter(
+                window=int(os.getenv("model_routing_window", "50")),
+                min_calls=int(os.getenv("model_routing_min_calls", "10")),
+                probe_every=int(os.getenv("model_routing_probe_every", "10"))
+            )
+        return _router
+
+
+def resolve(
+    stage: str,
+    model_name: str,
+    temperature: Optional[float],
+    max_output_tokens: Optional[int]
+) -> Dict[str, Any]:
+    """Model and settings of the next call of a stage.
+
+    Stage settings take precedence over the caller's values.
+
+    Args:
+        stage: Pipeline stage name.
+        model_name: Model of the model manager.
+        temperature: Temperature passed by the caller.
+        max_output_tokens: Max tokens passed by the caller.
+
+    Returns:
+        Dictionary of model, temperature, max_output_tokens and timeout.
+    """
+    config = get_stage_config(stage)
+    config.model = config.model or model_name
+    return {
+        "model": get_router().select_model(stage, config),
+        "temperature": (
+            config.temperature if config.temperature is not None
+            else temperature),
+        "max_output_tokens": config.max_output_tokens or max_output_tokens,
+        "timeout": config.timeout,
+    }
@@ -207,6 +207,37 @@ Generate each recipe's information following this JSON schema:
 """
 
 
+## Recipe data prompt without nutritional information, used under load.
+recipe_data_lite_prompt = """
+Your task is to generate a list of instructions and ingredients with measurements from a recipe name.
+
+<INSTRUCTIONS>
+1.Use the given grocery list to help guide some of the ingredients for each recipe.
+2.Each ingredient should have a measurement needed to prep the recipe.
+</INSTRUCTIONS>
+
+<GROCERY_LIST>
+{product_list}
+</GROCERY_LIST>
+
+Generate each recipe's information following this JSON schema:
+<OUTPUT_SCHEMA>
+{{
+  "ingredients": "[List of ingredients with measurement]",
+  "instructions": "[List of instructions to cook recipe]",
+  "serving_size": "[The number of people the recipe is for]",
+  "recipe_type": "[whether recipe is breakfast, lunch, or dinner]",
+  "prep_time": "[Time in minutes to prepare recipe]",
+  "cook_time": "[Time in minutes to cook recipe]"
+}}
+</OUTPUT_SCHEMA>
+
+<RECIPE_NAME>
+{recipe}
+</RECIPE_NAME>
+"""
+
+
 # IMAGE PROCESSING PROMPTS>
 image_classification_prompt = """
 Is this image a grocery list or meal? Output your answer as only either "meal" or "grocery_list"
@@ -230,3 +261,19 @@ What is are recipe names for this image?
 [Recipe names this image could be]
 </OUTPUT_SCHEMA>
 """
+
+## Image classification and extraction in a single call.
+image_classify_and_extract_prompt = """
+Is this image a grocery list or meal?
+If it is a grocery list, list the names of the products or ingredients in the image.
+If it is a meal, list the recipe names this image could be.
+
+Generate the output following this JSON schema:
+
+<OUTPUT_SCHEMA>
+{
+  "image_type": "grocery_list" or "meal",
+  "items": [List of product types or recipe names in the image]
+}
+</OUTPUT_SCHEMA>
+"""
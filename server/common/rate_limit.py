@@ -0,0 +1,312 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""Rate Limiting Functions.
+
+Client side limits of backend calls: token buckets cap request rate,
+AIMD limiters adapt concurrency to quota errors, and retries back off
+with jitter within a per request retry budget.
+"""
+
+import contextlib
+import contextvars
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterator, Optional
+
+import asyncio
+from fastapi import Request
+from google.api_core import exceptions
+
+from server.common import circuit_breaker
+from server.common import deadline
+from server.common import metrics
+from server.common import scheduler
+from server.config.logging import logger
+
+
+# Errors worth retrying, quota errors also reduce concurrency.
+THROTTLE_ERRORS = (exceptions.ResourceExhausted, exceptions.TooManyRequests)
+RETRYABLE_ERRORS = THROTTLE_ERRORS + (
+    exceptions.ServiceUnavailable,
+    exceptions.DeadlineExceeded,
+    exceptions.InternalServerError,
+)
+
+# Retries left for the current request, shared by its fan-out tasks.
+_retry_budget: contextvars.ContextVar[
+    Optional[Dict[str, int]]
+] = contextvars.ContextVar("retry_budget", default=None)
+
+# Limiters of this process by model name.
+_model_limiters = {}
+
+
+class TokenBucket:
+    """Async token bucket rate limiter.
+
+    Tokens refill continuously at `rate` per second up to `capacity`.
+    Callers wait until a token is available, so bursts up to capacity
+    go through immediately and sustained throughput is capped at rate.
+    """
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """Init token bucket.
+
+        Args:
+            rate: Tokens added per second.
+            capacity: Max tokens held. Defaults to one second of tokens.
+        """
+        if rate <= 0:
+            raise ValueError("Token bucket rate must be positive.")
+        self.rate = rate
+        self.capacity = max(1.0, capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens: float = 1.0) -> float:
+        """Wait for tokens.
+
+        Waiters are served in order, a waiter holds the lock while it
+        sleeps so later callers cannot take its refilled tokens.
+
+        Args:
+            tokens: Tokens to take.
+
+        Returns:
+            Seconds waited.
+        """
+        start = time.monotonic()
+        async with self._lock:
+            self._refill()
+            while self.tokens < tokens:
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= tokens
+        return time.monotonic() - start
+
+
+class AIMDLimiter:
+    """Async concurrency limit with additive increase, multiplicative decrease.
+
+    Each successful call raises the limit by 1 / limit (about +1 per
+    window of calls), each throttled call cuts it by `backoff`. Cuts are
+    at most once per `cooldown` seconds so a burst of 429s from calls
+    already in flight counts as one signal.
+    """
+    def __init__(
+        self,
+        name: str,
+        limit: float,
+        min_limit: float = 1,
+        max_limit: float = 64,
+        backoff: float = 0.5,
+        cooldown: float = 1.0
+    ):
+        """Init limiter.
+
+        Args:
+            name: Name used in metrics.
+            limit: Initial concurrency limit.
+            min_limit: Lowest limit after decreases.
+            max_limit: Highest limit after increases.
+            backoff: Multiplier of limit on throttling.
+            cooldown: Min seconds between decreases.
+        """
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = min(max(limit, min_limit), max_limit)
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+        metrics.CONCURRENCY_LIMIT.labels(limiter=name).set(self.limit)
+
+    async def acquire(self) -> None:
+        """Wait for a free slot."""
+        async with self._condition:
+            await self._condition.wait_for(
+                lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self, throttled: bool = False) -> None:
+        """Free a slot and adjust the limit.
+
+        Args:
+            throttled: Whether the call was rejected for quota.
+        """
+        async with self._condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                if now - self._last_decrease >= self.cooldown:
+                    self._last_decrease = now
+                    self.limit = max(
+                        self.min_limit, self.limit * self.backoff)
+                    logger.info(
+                        f"Throttled, {self.name} concurrency limit "
+                        f"cut to {int(self.limit)}"
+                    )
+            else:
+                self.limit = min(
+                    self.max_limit, self.limit + 1 / self.limit)
+            metrics.CONCURRENCY_LIMIT.labels(limiter=self.name).set(
+                self.limit)
+            self._condition.notify_all()
+
+
+class ModelLimiter:
+    """Rate and adaptive concurrency limit of one model."""
+    def __init__(self, model_name: str):
+        """Init limiter from env variables.
+
+        gemini_rate_limit caps requests per second (0 for no cap) and
+        gemini_max_concurrency / gemini_min_concurrency bound the
+        adaptive concurrency limit.
+
+        Args:
+            model_name: Gemini model name.
+        """
+        self.model_name = model_name
+        rate = float(os.getenv("gemini_rate_limit", "0"))
+        self.bucket = TokenBucket(rate) if rate > 0 else None
+        max_limit = float(os.getenv("gemini_max_concurrency", "32"))
+        self.concurrency = AIMDLimiter(
+            name=model_name,
+            limit=max_limit,
+            min_limit=float(os.getenv("gemini_min_concurrency", "2")),
+            max_limit=max_limit
+        )
+
+    async def acquire(self, stage: str) -> None:
+        """Wait for a rate token and a concurrency slot.
+
+        Args:
+            stage: Pipeline stage name used in metrics.
+        """
+        start = time.perf_counter()
+        if self.bucket:
+            await self.bucket.acquire()
+        await self.concurrency.acquire()
+        metrics.record_throttle_wait(
+            stage, self.model_name, time.perf_counter() - start)
+
+    async def release(self, throttled: bool = False) -> None:
+        await self.concurrency.release(throttled=throttled)
+
+
+def get_model_limiter(model_name: str) -> ModelLimiter:
+    """Limiter shared by all calls to a model in this process."""
+    if model_name not in _model_limiters:
+        _model_limiters[model_name] = ModelLimiter(model_name)
+    return _model_limiters[model_name]
+
+
+@contextlib.contextmanager
+def retry_budget(retries: Optional[int] = None) -> Iterator[None]:
+    """Limit total retries of backend calls within a request.
+
+    Bounds the extra load a request adds when a backend is struggling,
+    e.g. a recipe fan-out of 10 calls cannot retry 30 times.
+
+    Args:
+        retries: Retries allowed. Defaults to gemini_retry_budget env
+            variable.
+    """
+    if retries is None:
+        retries = int(os.getenv("gemini_retry_budget", "4"))
+    token = _retry_budget.set({"remaining": retries})
+    try:
+        yield
+    finally:
+        _retry_budget.reset(token)
+
+
+def _take_retry() -> bool:
+    """Use one retry of the request budget, if any is left."""
+    budget = _retry_budget.get()
+    if budget is None:
+        return True
+    if budget["remaining"] <= 0:
+        return False
+    budget["remaining"] -= 1
+    return True
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full jitter exponential backoff in seconds.
+
+    Args:
+        attempt: Retry number, starting at 0.
+    """
+    base = float(os.getenv("gemini_retry_base_delay", "0.5"))
+    cap = float(os.getenv("gemini_retry_max_delay", "8"))
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+async def call_with_retries(
+    model_name: str,
+    stage: str,
+    call: Callable[[], Awaitable[Any]]
+) -> Any:
+    """Call a model under its limiter, retrying transient errors.
+
+    Each attempt waits for a Gemini scheduler slot of the current
+    priority class first, then for the model's rate and concurrency
+    limits.
+
+    Calls fail fast with CircuitOpenError while the Gemini circuit
+    breaker is open.
+
+    Args:
+        model_name: Gemini model name.
+        stage: Pipeline stage name used in metrics.
+        call: Function returning a new awaitable per attempt.
+
+    Returns:
+        Result of call.
+    """
+    limiter = get_model_limiter(model_name)
+    max_retries = int(os.getenv("gemini_max_retries", "3"))
+    attempt = 0
+    while True:
+        # Queued by priority class before the model's own limits.
+        async with scheduler.get_scheduler("gemini").slot(stage):
+            await limiter.acquire(stage)
+            throttled = False
+            try:
+                with circuit_breaker.get_breaker("gemini").guard():
+                    return await call()
+            except RETRYABLE_ERRORS as e:
+                throttled = isinstance(e, THROTTLE_ERRORS)
+                delay = backoff_delay(attempt)
+                # No retry that would sleep past the request deadline.
+                time_left = deadline.remaining()
+                if (attempt >= max_retries
+                        or (time_left is not None and delay >= time_left)
+                        or not _take_retry()):
+                    metrics.LLM_RETRIES.labels(
+                        stage=stage, outcome="exhausted").inc()
+                    raise
+                reason = type(e).__name__
+                metrics.LLM_RETRIES.labels(stage=stage, outcome=reason).inc()
+                logger.info(f"Retrying {stage} after {reason}: {e}")
+            finally:
+                await limiter.release(throttled=throttled)
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+async def retry_budget_middleware(request: Request, call_next):
+    """Give each request its own retry budget."""
+    with retry_budget():
+        return await call_next(request)
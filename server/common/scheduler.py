@@ -0,0 +1,314 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""Backend Call Scheduler.
+
+Outbound Gemini and Vertex Search calls of every kind of work share one
+quota. Each backend has a scheduler that admits calls by priority class:
+    interactive: Live chat turns (default).
+    batch: Batch jobs.
+    background: Enrichment after a response, e.g. saving a recipe.
+    prefetch: Speculative prefetching.
+
+A backend runs at most `capacity` calls at a time and each class at most
+its own limit. When calls queue, classes are served by weighted fair
+queuing, so with the default weights live users get most slots but
+background work is never starved. The class of a call is set with the
+priority() context manager and propagates to fan-out tasks. Work shared
+by several callers, e.g. coalesced calls, runs at the highest class of
+its callers, see share() and join().
+"""
+
+import collections
+import contextlib
+import contextvars
+import os
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import asyncio
+
+from server.common import metrics
+
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+BACKGROUND = "background"
+PREFETCH = "prefetch"
+PRIORITY_CLASSES = (INTERACTIVE, BATCH, BACKGROUND, PREFETCH)
+
+# Share of queued slots of each class relative to the others.
+DEFAULT_WEIGHTS = {INTERACTIVE: 8, BATCH: 2, BACKGROUND: 1, PREFETCH: 1}
+
+# Share of a backend's capacity each class may use at most.
+DEFAULT_CLASS_SHARES = {
+    INTERACTIVE: 1.0, BATCH: 0.5, BACKGROUND: 0.25, PREFETCH: 0.125
+}
+
+# Default concurrent calls of each backend.
+DEFAULT_CAPACITY = {"gemini": 32, "vertex_search": 32}
+
+_priority: contextvars.ContextVar[str] = contextvars.ContextVar(
+    "priority", default=INTERACTIVE)
+_shared: contextvars.ContextVar[Optional["SharedPriority"]] = (
+    contextvars.ContextVar("shared_priority", default=None))
+
+# Schedulers of this process by backend.
+_schedulers = {}
+
+
+@contextlib.contextmanager
+def priority(priority_class: str) -> Iterator[None]:
+    """Set the priority class of backend calls made within.
+
+    Args:
+        priority_class: One of PRIORITY_CLASSES.
+    """
+    if priority_class not in PRIORITY_CLASSES:
+        raise ValueError(f"Unknown priority class {priority_class}.")
+    token = _priority.set(priority_class)
+    shared_token = _shared.set(None)
+    try:
+        yield
+    finally:
+        _shared.reset(shared_token)
+        _priority.reset(token)
+
+
+def current_priority() -> str:
+    """Priority class of the current context."""
+    shared = _shared.get()
+    return shared.priority_class if shared else _priority.get()
+
+
+class SharedPriority:
+    """Priority class of work shared by several callers."""
+    def __init__(self, priority_class: str):
+        """Init shared priority.
+
+        Args:
+            priority_class: Class of the first caller.
+        """
+        self.priority_class = priority_class
+        # Calls of the work waiting for a slot, as (scheduler, future).
+        self.queued: List[Tuple["Scheduler", asyncio.Future]] = []
+
+
+def share() -> SharedPriority:
+    """Replace the current priority class with one callers can raise.
+
+    Used for work shared by several callers, see join(). Run in the
+    context of the shared work, e.g. a copied context.
+
+    Returns:
+        Shared priority class.
+    """
+    shared = SharedPriority(current_priority())
+    _shared.set(shared)
+    return shared
+
+
+def join(shared: Optional[SharedPriority]) -> None:
+    """Raise a shared priority class to the current caller's class.
+
+    Calls of the shared work already queued move to the raised class.
+
+    Args:
+        shared: Priority class of shared work, from share().
+    """
+    priority_class = current_priority()
+    if shared is None or (PRIORITY_CLASSES.index(priority_class)
+                          >= PRIORITY_CLASSES.index(shared.priority_class)):
+        return
+    shared.priority_class = priority_class
+    for backend_scheduler, future in list(shared.queued):
+        backend_scheduler.promote(future, priority_class)
+
+
+class Scheduler:
+    """Concurrency limits and weighted fair queuing of a backend's calls."""
+    def __init__(
+        self,
+        name: str,
+        capacity: int,
+        weights: Optional[Dict[str, float]] = None,
+        class_limits: Optional[Dict[str, int]] = None
+    ):
+        """Init scheduler.
+
+        Args:
+            name: Backend name used in metrics.
+            capacity: Max concurrent calls of backend.
+            weights: Weight of each priority class.
+            class_limits: Max concurrent calls of each priority class.
+        """
+        self.name = name
+        self.capacity = capacity
+        self.weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+        self.class_limits = {
+            priority_class: capacity for priority_class in PRIORITY_CLASSES
+        }
+        self.class_limits.update(class_limits or {})
+
+        self.in_flight = 0
+        self.class_in_flight = collections.Counter()
+        # Waiters of each class as (virtual tag, future), in arrival order.
+        self._queues = {
+            priority_class: collections.deque()
+            for priority_class in PRIORITY_CLASSES
+        }
+        self._last_tags = collections.Counter()
+        self._virtual_time = 0.0
+
+    def _can_run(self, priority_class: str) -> bool:
+        return (self.in_flight < self.capacity
+                and self.class_in_flight[priority_class]
+                < self.class_limits[priority_class])
+
+    def _start(self, priority_class: str) -> None:
+        self.in_flight += 1
+        self.class_in_flight[priority_class] += 1
+
+    def _dispatch(self) -> None:
+        """Start queued calls while there is capacity, lowest tag first."""
+        while self.in_flight < self.capacity:
+            candidates = [
+                (queue[0][0], priority_class)
+                for priority_class, queue in self._queues.items()
+                if queue and self._can_run(priority_class)
+            ]
+            if not candidates:
+                return
+            tag, priority_class = min(candidates)
+            _, future = self._queues[priority_class].popleft()
+            if future.done():
+                continue
+            self._virtual_time = tag
+            self._start(priority_class)
+            future.set_result(priority_class)
+
+    def _enqueue(self, priority_class: str, future: asyncio.Future) -> None:
+        # Start time fair queuing: a class's calls are spaced 1 / weight
+        # apart in virtual time, so heavier classes are served more often.
+        tag = max(self._virtual_time, self._last_tags[priority_class]) + (
+            1 / self.weights[priority_class])
+        self._last_tags[priority_class] = tag
+        self._queues[priority_class].append((tag, future))
+
+    def promote(self, future: asyncio.Future, priority_class: str) -> None:
+        """Move a queued call to a higher priority class.
+
+        Args:
+            future: Future of the queued call.
+            priority_class: Class to queue it in.
+        """
+        for queue in self._queues.values():
+            for entry in queue:
+                if entry[1] is future:
+                    queue.remove(entry)
+                    self._enqueue(priority_class, future)
+                    self._dispatch()
+                    return
+
+    async def acquire(
+        self,
+        priority_class: Optional[str] = None
+    ) -> Tuple[float, str]:
+        """Wait for a slot.
+
+        Args:
+            priority_class: Class of call, defaults to the current one.
+
+        Returns:
+            Seconds queued, and the class the slot was granted to, which
+            is higher than priority_class when shared work was joined.
+        """
+        priority_class = priority_class or current_priority()
+        queued = any(self._queues.values())
+        if not queued and self._can_run(priority_class):
+            self._start(priority_class)
+            return 0.0, priority_class
+
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(priority_class, future)
+        self._dispatch()
+        # Counted in the class queued in, even when promoted.
+        metrics.SCHEDULER_QUEUED.labels(
+            backend=self.name, priority=priority_class).inc()
+        shared = _shared.get()
+        if shared is not None:
+            shared.queued.append((self, future))
+
+        start = time.perf_counter()
+        try:
+            granted = await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted as it was cancelled, pass the slot on.
+                self.release(future.result())
+            raise
+        finally:
+            metrics.SCHEDULER_QUEUED.labels(
+                backend=self.name, priority=priority_class).dec()
+            if shared is not None:
+                shared.queued.remove((self, future))
+        return time.perf_counter() - start, granted
+
+    def release(self, priority_class: Optional[str] = None) -> None:
+        """Free a slot and start queued calls.
+
+        Args:
+            priority_class: Class the slot was acquired with.
+        """
+        priority_class = priority_class or current_priority()
+        self.in_flight -= 1
+        self.class_in_flight[priority_class] -= 1
+        self._dispatch()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, stage: Optional[str] = None):
+        """Hold a slot for a call.
+
+        Args:
+            stage: Pipeline stage name, adds a "<stage>_queue"
+                Server-Timing entry when the call waited.
+        """
+        waited, priority_class = await self.acquire()
+        metrics.record_scheduler_wait(
+            self.name, priority_class, stage, waited)
+        try:
+            yield
+        finally:
+            self.release(priority_class)
+
+
+def get_scheduler(name: str) -> Scheduler:
+    """Scheduler shared by all calls to a backend in this process.
+
+    Capacity, weights and class limits are read from
+    scheduler_<backend>_capacity, scheduler_weight_<class> and
+    scheduler_share_<class> (share of capacity) env variables.
+
+    Args:
+        name: Backend name, e.g. gemini or vertex_search.
+    """
+    if name not in _schedulers:
+        capacity = int(os.getenv(
+            f"scheduler_{name}_capacity", str(DEFAULT_CAPACITY.get(name, 32))))
+        weights = {}
+        class_limits = {}
+        for priority_class in PRIORITY_CLASSES:
+            weights[priority_class] = float(os.getenv(
+                f"scheduler_weight_{priority_class}",
+                str(DEFAULT_WEIGHTS[priority_class])))
+            class_share = float(os.getenv(
+                f"scheduler_share_{priority_class}",
+                str(DEFAULT_CLASS_SHARES[priority_class])))
+            class_limits[priority_class] = max(1, int(capacity * class_share))
+        _schedulers[name] = Scheduler(
+            name=name,
+            capacity=capacity,
+            weights=weights,
+            class_limits=class_limits
+        )
+    return _schedulers[name]
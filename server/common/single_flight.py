@@ -0,0 +1,186 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""Single Flight Functions.
+
+Concurrent identical calls share one underlying request: the first
+caller runs it and later callers with the same key wait for its result
+instead of sending their own. Every caller gets its own copy of the
+result, since callers update results in place.
+
+Shared calls run in a copy of the first caller's context, but not under
+its deadline, priority class and retry budget alone: the deadline is
+extended as callers with more time left join, the priority class is
+raised to the highest class of the callers, and the call has a retry
+budget of its own. A shared call is cancelled when every
+caller waiting for it is.
+"""
+
+import contextvars
+import copy
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+import asyncio
+
+from server.common import deadline
+from server.common import metrics
+from server.common import rate_limit
+from server.common import scheduler
+
+
+class SingleFlight:
+    """Deduplicates concurrent async calls by key."""
+    def __init__(self, name: str):
+        """Init single flight group.
+
+        Args:
+            name: Name used in metrics.
+        """
+        self.name = name
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+        # Deadlines of in flight calls, extended by joining callers.
+        self._deadlines: Dict[asyncio.Task, Optional[deadline.Deadline]] = {}
+        # Priority classes of in flight calls, raised by joining callers.
+        self._priorities: Dict[asyncio.Task, scheduler.SharedPriority] = {}
+        # Callers waiting for each in flight call.
+        self._waiters: Dict[asyncio.Task, int] = {}
+
+    async def do(
+        self,
+        key: Hashable,
+        func: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """Run func, or join an in flight call with the same key.
+
+        The shared call runs as its own task, so a caller cancelled, e.g.
+        by its deadline, does not cancel it for the other callers. The
+        call is cancelled when its last caller is. Callers joining with a
+        later deadline extend the call's deadline, callers of a higher
+        priority class raise its class.
+
+        Args:
+            key: Identity of the call.
+            func: Function returning the awaitable to run.
+
+        Returns:
+            Copy of the call's result.
+        """
+        task = self._in_flight.get(key)
+        if task is None:
+            context = contextvars.copy_context()
+            shared_deadline = context.run(deadline.share)
+            shared_priority = context.run(scheduler.share)
+            task = context.run(asyncio.ensure_future, self._run(func))
+            self._in_flight[key] = task
+            self._deadlines[task] = shared_deadline
+            self._priorities[task] = shared_priority
+            task.add_done_callback(lambda t: self._finish(key, t))
+            metrics.SINGLE_FLIGHT_CALLS.labels(
+                call=self.name, result="leader").inc()
+        else:
+            deadline.extend(self._deadlines.get(task))
+            scheduler.join(self._priorities.get(task))
+            metrics.SINGLE_FLIGHT_CALLS.labels(
+                call=self.name, result="coalesced").inc()
+
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            result = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[task] == 1 and not task.done():
+                # Nobody is left to use the result. Later callers start
+                # a new call rather than join the cancelled one.
+                if self._in_flight.get(key) is task:
+                    del self._in_flight[key]
+                task.cancel()
+            raise
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+        return copy.deepcopy(result)
+
+    async def _run(self, func: Callable[[], Awaitable[Any]]) -> Any:
+        # Retries are not charged to the first caller's budget.
+        with rate_limit.retry_budget():
+            return await func()
+
+    def _finish(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        self._deadlines.pop(task, None)
+        self._priorities.pop(task, None)
+        # Mark the error retrieved in case every caller was cancelled.
+        if not task.cancelled():
+            task.exception()
+
+
+class ThreadSingleFlight:
+    """Deduplicates concurrent blocking calls by key across threads."""
+    def __init__(self, name: str):
+        """Init single flight group.
+
+        Args:
+            name: Name used in metrics.
+        """
+        self.name = name
+        self._lock = threading.Lock()
+        self._in_flight: Dict[Hashable, Dict[str, Any]] = {}
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        """Run func, or wait for an in flight call with the same key.
+
+        Args:
+            key: Identity of the call.
+            func: Blocking function to run.
+
+        Returns:
+            Copy of the call's result.
+        """
+        with self._lock:
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = {"done": threading.Event()}
+                self._in_flight[key] = call
+        metrics.SINGLE_FLIGHT_CALLS.labels(
+            call=self.name, result="leader" if leader else "coalesced").inc()
+
+        if leader:
+            try:
+                call["result"] = func()
+            except Exception as e:
+                call["error"] = e
+            finally:
+                with self._lock:
+                    self._in_flight.pop(key, None)
+                call["done"].set()
+        else:
+            call["done"].wait()
+
+        if "error" in call:
+            raise call["error"]
+        return copy.deepcopy(call["result"])
+
+
+# Single flight groups of this process by name.
+_groups: Dict[str, Any] = {}
+_groups_lock = threading.Lock()
+
+
+def get_group(name: str, threaded: bool = False):
+    """Get or create a named single flight group.
+
+    Args:
+        name: Name of group, e.g. the deduplicated call.
+        threaded: Whether calls are blocking and made from threads.
+
+    Returns:
+        Shared SingleFlight, or ThreadSingleFlight if threaded.
+    """
+    with _groups_lock:
+        if name not in _groups:
+            _groups[name] = (
+                ThreadSingleFlight(name) if threaded else SingleFlight(name))
+        return _groups[name]
@@ -0,0 +1,54 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""Partial Result Streaming.
+
+Pipeline stages emit partial results of the current turn as they are
+ready, e.g. the intent, or a product category once its search completes.
+Streaming transports (the WebSocket chat route) listen with listen(),
+without a listener emit() does nothing. The listener is a context
+variable, so it follows the turn into its fan-out tasks and not into
+work of other requests.
+"""
+
+import contextlib
+import contextvars
+from typing import Any, Callable, Iterator, Optional
+
+from server.config.logging import logger
+
+
+_listener: contextvars.ContextVar[
+    Optional[Callable[[str, Any], None]]
+] = contextvars.ContextVar("stream_listener", default=None)
+
+
+@contextlib.contextmanager
+def listen(callback: Callable[[str, Any], None]) -> Iterator[None]:
+    """Receive partial results emitted within.
+
+    Args:
+        callback: Non-blocking function called with the event name and
+            its data.
+    """
+    token = _listener.set(callback)
+    try:
+        yield
+    finally:
+        _listener.reset(token)
+
+
+def emit(event: str, data: Any) -> None:
+    """Emit a partial result of the current turn.
+
+    Args:
+        event: Event name, e.g. intent, products or recipe.
+        data: JSON serializable partial result.
+    """
+    callback = _listener.get()
+    if callback is None:
+        return
+    try:
+        callback(event, data)
+    except Exception as e:
+        logger.error(f"Error streaming {event}: {e}")
@@ -0,0 +1,150 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""Token Budget Functions.
+
+Learns how many output tokens each JSON generating stage uses, so calls
+ask for a tight max_output_tokens (a high percentile plus headroom)
+instead of the caller's ceiling, e.g. 8192 for recipe metadata. A
+response cut off by the limit (finish reason MAX_TOKENS) is invalid
+JSON, so only that call is retried with a doubled budget, up to the
+ceiling.
+"""
+
+import collections
+import math
+import os
+import threading
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from server.common import metrics
+from server.config.logging import logger
+
+
+class TokenBudget:
+    """Per stage output token limits learned from recent responses."""
+    def __init__(
+        self,
+        window: int = 200,
+        min_samples: int = 20,
+        percentile: float = 0.99,
+        headroom: float = 1.3,
+        floor: int = 256
+    ):
+        """Init token budget.
+
+        Args:
+            window: Recent output lengths kept per stage.
+            min_samples: Lengths needed before limiting a stage.
+            percentile: Percentile of lengths the limit covers.
+            headroom: Multiplier of the percentile.
+            floor: Min limit.
+        """
+        self.window = window
+        self.min_samples = min_samples
+        self.percentile = percentile
+        self.headroom = headroom
+        self.floor = floor
+        self._lengths: Dict[str, collections.deque] = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, tokens: int) -> None:
+        """Record output tokens of a complete response.
+
+        Args:
+            stage: Pipeline stage name.
+            tokens: Output tokens of response.
+        """
+        with self._lock:
+            if stage not in self._lengths:
+                self._lengths[stage] = collections.deque(maxlen=self.window)
+            self._lengths[stage].append(tokens)
+
+    def limit(self, stage: str, ceiling: int) -> int:
+        """Max output tokens of the next call of a stage.
+
+        Args:
+            stage: Pipeline stage name.
+            ceiling: Max output tokens set by the caller or model config.
+
+        Returns:
+            Learned limit, or the ceiling until enough responses are seen.
+        """
+        with self._lock:
+            lengths = self._lengths.get(stage)
+            if not lengths or len(lengths) < self.min_samples:
+                return ceiling
+            ordered = sorted(lengths)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile))
+        limit = max(self.floor, math.ceil(ordered[index] * self.headroom))
+        return min(ceiling, limit)
+
+
+def output_tokens(response: Any) -> int:
+    """Output tokens of a Gemini response."""
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, "candidates_token_count", 0) or 0
+
+
+def is_truncated(response: Any) -> bool:
+    """Whether a Gemini response stopped at max_output_tokens."""
+    try:
+        reason = response.candidates[0].finish_reason
+    except (AttributeError, IndexError, TypeError):
+        return False
+    return getattr(reason, "name", reason) == "MAX_TOKENS"
+
+
+async def generate_within_budget(
+    stage: str,
+    ceiling: Optional[int],
+    generate: Callable[[int], Awaitable[Any]]
+) -> Any:
+    """Generate with a learned token limit, retrying truncated responses.
+
+    Args:
+        stage: Pipeline stage name.
+        ceiling: Max output tokens set by the caller or model config.
+        generate: Function calling the model with a max_output_tokens
+            and returning the response.
+
+    Returns:
+        Last response, truncated only if the ceiling was reached.
+    """
+    ceiling = ceiling or 8192
+    budget = get_token_budget()
+    max_tokens = budget.limit(stage, ceiling)
+    while True:
+        response = await generate(max_tokens)
+        if not is_truncated(response):
+            budget.record(stage, output_tokens(response))
+            return response
+        if max_tokens >= ceiling:
+            logger.error(f"{stage} response truncated at {max_tokens} tokens")
+            metrics.TOKEN_BUDGET_RETRIES.labels(
+                stage=stage, outcome="exhausted").inc()
+            return response
+        metrics.TOKEN_BUDGET_RETRIES.labels(
+            stage=stage, outcome="truncated").inc()
+        logger.info(f"{stage} response truncated at {max_tokens} tokens")
+        max_tokens = min(ceiling, max_tokens * 2)
+
+
+_token_budget = None
+_token_budget_lock = threading.Lock()
+
+
+def get_token_budget() -> TokenBudget:
+    """Token budget shared by this process."""
+    global _token_budget
+    with _token_budget_lock:
+        if _token_budget is None:
+            _token_budget = TokenBudget(
+                window=int(os.getenv("token_budget_window", "200")),
+                min_samples=int(os.getenv("token_budget_min_samples", "20")),
+                percentile=float(
+                    os.getenv("token_budget_percentile", "0.99")),
+                headroom=float(os.getenv("token_budget_headroom", "1.3")),
+                floor=int(os.getenv("token_budget_floor", "256"))
+            )
+        return _token_budget
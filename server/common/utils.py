@@ -3,9 +3,9 @@
 # agreement with Google.
 """Utility Functions."""
 
-import multiprocessing
+import hashlib
 import os
-from typing import Any, List
+from typing import Any, List, Optional
 import yaml
 
 import asyncio
@@ -37,6 +37,40 @@ def load_config_to_env(config_file: str) -> None:
         )
 
 
+def make_etag(body: bytes) -> str:
+    """Create a strong ETag from a response body.
+
+    Args:
+        body: Serialized response body.
+
+    Returns:
+        Quoted ETag header value.
+    """
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header against an ETag.
+
+    Args:
+        if_none_match: Value of If-None-Match request header.
+        etag: Current ETag of resource.
+
+    Returns:
+        Boolean of whether client copy is still current.
+    """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        # Weak comparison as defined for If-None-Match.
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate in ("*", etag):
+            return True
+    return False
+
+
 async def make_parallel_calls(
     items,
     async_processing_func,
@@ -45,56 +79,23 @@ async def make_parallel_calls(
 ) -> List[Any]:
     """Helper function for parallel calls.
 
+    Runs the calls concurrently on the current event loop so
+    caches, metrics and request context are shared with the caller.
+
     Args:
         items: Items to send in paralle.
         async_processing_func: Function to call in parallel.
-        num_processes (Optional): The number of processes to use.
+        num_processes (Optional): Max number of concurrent calls.
         extra_args: If processing func requires additional args for each item.
     """
-    results_queue = multiprocessing.Queue()
-    processes = []
-    for item in items:
-        args = (item, results_queue, async_processing_func)
-        if extra_args:
-            args += extra_args
-
-        p = multiprocessing.Process(
-            target=process_item,
-            args=args
-        )
-        processes.append(p)
-        p.start()
-
-    # Get results from Queue.
-    results = []
-    for _ in range(len(items)):
-        results.append(await asyncio.to_thread(results_queue.get))
-
-    for p in processes:
-        p.join()
-    return results
+    items = list(items)
+    # Without a limit every item runs at once.
+    semaphore = asyncio.Semaphore(num_processes or max(len(items), 1))
 
+    async def process_item(item):
+        args = (item,) + tuple(extra_args or ())
+        async with semaphore:
+            return await async_processing_func(*args)
 
-def process_item(
-    item,
-    results_queue,
-    async_processing_function,
-    extra_args=None
-) -> None:
-    """Process item for parallelization.
-
-    Args:
-        item: Current item to process.
-        results_queue: Multiprocessing queue to store processes to run.
-        async_processing_function: Function to add to queue.
-    """
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    if extra_args:
-        result = loop.run_until_complete(
-            async_processing_function(item, extra_args)
-        )
-    else:
-        result = loop.run_until_complete(async_processing_function(item))
-    results_queue.put(result)
-    loop.close()
+    results = await asyncio.gather(*[process_item(item) for item in items])
+    return list(results)
@@ -0,0 +1,16 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""Local fake backends.
+
+Deterministic stand-ins for Gemini, Vertex Search, Vector Search and
+Datastore, selected with `backend_mode: fake` in config.yaml, so the app
+can run and be load tested without GCP services.
+"""
+
+import os
+
+
+def enabled() -> bool:
+    """Whether fake backends are configured."""
+    return os.getenv("backend_mode", "live").lower() == "fake"
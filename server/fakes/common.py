@@ -0,0 +1,86 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""Latency and error injection shared by fake backends."""
+
+import hashlib
+import os
+import random
+import time
+
+import asyncio
+from google.api_core import exceptions
+
+
+# Default injected latency per backend in milliseconds.
+DEFAULT_LATENCY_MS = {
+    "gemini": 400,
+    "vertex_search": 150,
+    "vector_search": 60,
+    "datastore": 20,
+}
+
+# Error raised per backend, matching what the live client raises.
+ERRORS = {
+    "gemini": exceptions.ResourceExhausted,
+    "vertex_search": exceptions.ServiceUnavailable,
+    "vector_search": exceptions.ServiceUnavailable,
+    "datastore": exceptions.ServiceUnavailable,
+}
+
+# Random source for latency jitter and errors.
+_random = random.Random(int(os.getenv("fake_seed", "0")))
+
+
+def seeded_random(*parts: str) -> random.Random:
+    """Random generator seeded by request contents.
+
+    Identical requests get identical fake responses.
+
+    Args:
+        parts: Strings identifying the request.
+    """
+    digest = hashlib.sha256("\x1f".join(parts).encode("utf-8")).digest()
+    return random.Random(int.from_bytes(digest[:8], "big"))
+
+
+def _latency_seconds(backend: str, scale: float) -> float:
+    """Injected latency for a backend call.
+
+    Configured with fake_<backend>_latency_ms and fake_latency_jitter,
+    the +/- fraction of latency applied at random.
+    """
+    latency_ms = float(os.getenv(
+        f"fake_{backend}_latency_ms", str(DEFAULT_LATENCY_MS[backend])))
+    jitter = float(os.getenv("fake_latency_jitter", "0.25"))
+    latency_ms *= scale * (1 + _random.uniform(-jitter, jitter))
+    return max(latency_ms, 0.0) / 1000
+
+
+def _maybe_raise(backend: str) -> None:
+    """Raise a backend error at the configured error rate.
+
+    Configured with fake_<backend>_error_rate, falling back to
+    fake_error_rate.
+    """
+    error_rate = float(os.getenv(
+        f"fake_{backend}_error_rate", os.getenv("fake_error_rate", "0")))
+    if error_rate and _random.random() < error_rate:
+        raise ERRORS[backend](f"Injected fake {backend} error.")
+
+
+async def inject_async(backend: str, scale: float = 1.0) -> None:
+    """Sleep for the injected latency, then maybe raise an error.
+
+    Args:
+        backend: Backend name.
+        scale: Multiplier of configured latency.
+    """
+    await asyncio.sleep(_latency_seconds(backend, scale))
+    _maybe_raise(backend)
+
+
+def inject_sync(backend: str, scale: float = 1.0) -> None:
+    """Blocking version of inject_async for sync clients."""
+    time.sleep(_latency_seconds(backend, scale))
+    _maybe_raise(backend)
@@ -0,0 +1,71 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""Fake DataStore Module."""
+
+import datetime
+import threading
+from typing import Any, Dict, List, Union
+
+from server.common import metrics
+from server.fakes import common
+
+
+# Entities by datastore id and kind, shared across managers in a worker.
+_entities: Dict[str, Dict[str, Dict[Any, Dict[str, Any]]]] = {}
+_lock = threading.Lock()
+
+
+class FakeDataStoreManager:
+    """Fake of DataStoreManager keeping entities in memory."""
+    def __init__(
+        self,
+        project_id: str,
+        datastore_id: str,
+    ):
+        del project_id
+        self.datastore_id = datastore_id
+
+    def _kind(self, kind: str) -> Dict[Any, Dict[str, Any]]:
+        """Entities of a kind."""
+        return _entities.setdefault(
+            str(self.datastore_id), {}).setdefault(kind, {})
+
+    def get_saved_elements(self, kind: str) -> List[Dict[str, Any]]:
+        """Get saved entities ordered by saved date."""
+        with metrics.track_stage("datastore_get"):
+            common.inject_sync("datastore")
+        with _lock:
+            results = sorted(
+                self._kind(kind).values(), key=lambda e: e["created"])
+            return [
+                dict(result, created=result["created"].isoformat())
+                for result in results
+            ]
+
+    def save_element(
+        self,
+        element_id: Union[str, int],
+        kind: str,
+        elem_key: str,
+        element: Dict[str, Any],
+    ) -> None:
+        """Save an element."""
+        with metrics.track_stage("datastore_put"):
+            common.inject_sync("datastore")
+        with _lock:
+            self._kind(kind)[element_id] = {
+                "created": datetime.datetime.now(tz=datetime.timezone.utc),
+                elem_key: element,
+            }
+
+    def delete_element(
+        self,
+        element_id: Union[str, int],
+        kind: str,
+    ):
+        """Delete an element."""
+        with metrics.track_stage("datastore_delete"):
+            common.inject_sync("datastore")
+        with _lock:
+            self._kind(kind).pop(element_id, None)
@@ -0,0 +1,206 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""Fake Gemini Model Functions."""
+
+import json
+import os
+import random
+import re
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from server.common import metrics
+from server.fakes import common
+from server.fakes import recording
+
+
+# Vocabulary of canned responses.
+GROCERY_ITEMS = [
+    "Apples", "Bananas", "Baby spinach", "Broccoli", "Carrots",
+    "Cheddar cheese", "Chicken breast", "Ground beef", "Salmon fillet",
+    "Eggs", "Whole milk", "Greek yogurt", "Butter", "Olive oil", "Garlic",
+    "Yellow onion", "Tomatoes", "Bell peppers", "Avocados", "Lemons",
+    "Pasta", "Brown rice", "Black beans", "Tortillas", "Sourdough bread",
+    "Parmesan cheese", "Fresh basil", "Mushrooms", "Potatoes", "Honey",
+]
+RECIPE_NAMES = [
+    "Lemon Garlic Salmon", "Chicken Stir Fry", "Vegetable Lasagna",
+    "Black Bean Tacos", "Mushroom Risotto", "Greek Chicken Bowls",
+    "Spinach Omelette", "Beef Chili", "Pasta Primavera",
+    "Honey Glazed Carrots", "Avocado Toast", "Stuffed Bell Peppers",
+]
+
+# Patterns locating the user query or recipe name in prompt templates.
+QUERY_PATTERNS = [
+    re.compile(r"<RECIPE_NAME>\s*(.*?)\s*</RECIPE_NAME>", re.DOTALL),
+    re.compile(r"<USER_QUERY>\s*(.*?)\s*</?USER_QUERY>", re.DOTALL),
+    re.compile(r"current_user_query:\s*(.+)"),
+    re.compile(r"user_query:\s*(.+)"),
+]
+
+
+class FakeGenerativeModel:
+    """Fake of GenerativeModel returning canned or replayed responses.
+
+    Only the model call is faked, so the live GeminiModelManager runs
+    unchanged: stage routing, coalescing, rate limits and retries, token
+    budgets and metrics.
+    """
+    def __init__(
+        self,
+        model_name: str,
+        system_prompt: Optional[str] = None
+    ):
+        """Init fake Gemini model.
+
+        Args:
+            model_name: Gemini model name.
+            system_prompt: System prompt of model.
+        """
+        self.model_name = model_name
+        self.system_prompt = system_prompt
+
+    async def generate_content_async(
+        self,
+        contents,
+        generation_config: Optional[Dict[str, Any]] = None
+    ) -> SimpleNamespace:
+        """Generate a fake response.
+
+        Responses are replayed from fake_replay_file when recorded,
+        otherwise generated deterministically from the prompt and the
+        stage being tracked.
+
+        Args:
+            contents: Prompt or list of prompt parts.
+            generation_config: GenerationConfig init args.
+        """
+        stage = metrics.current_stage() or "gemini"
+        key = recording.request_key(stage, self.system_prompt, contents)
+
+        text = None
+        replay_file = os.getenv("fake_replay_file")
+        if replay_file:
+            text = recording.load_recording(replay_file).get(key)
+        if text is None:
+            text = canned_response(stage, contents, common.seeded_random(key))
+
+        # Responses over the limit are cut off as in the live backend.
+        max_tokens = (generation_config or {}).get("max_output_tokens")
+        full_tokens = len(text) // 4 + 1
+        response_tokens = min(full_tokens, max_tokens or 8192)
+        truncated = response_tokens < full_tokens
+        if truncated:
+            text = text[:response_tokens * 4]
+
+        # Longer responses take longer to generate.
+        await common.inject_async("gemini", scale=1 + response_tokens / 500)
+
+        return SimpleNamespace(
+            candidates=[SimpleNamespace(
+                content=SimpleNamespace(parts=[SimpleNamespace(text=text)]),
+                finish_reason="MAX_TOKENS" if truncated else "STOP"
+            )],
+            usage_metadata=SimpleNamespace(
+                prompt_token_count=len(prompt_text(contents)) // 4 + 1,
+                candidates_token_count=response_tokens
+            )
+        )
+
+
+def prompt_text(contents: Any) -> str:
+    """Text parts of a prompt joined together."""
+    if not isinstance(contents, list):
+        contents = [contents]
+    return "\n".join(part for part in contents if isinstance(part, str))
+
+
+def extract_query(contents: Any) -> str:
+    """Find the user query or recipe name in a prompt."""
+    text = prompt_text(contents)
+    for pattern in QUERY_PATTERNS:
+        matches = pattern.findall(text)
+        if matches:
+            return matches[-1].strip()
+    return text.strip()
+
+
+def classify_intent(query: str) -> str:
+    """Keyword based intent, mirroring the intent prompt examples."""
+    query = query.lower()
+    if re.search(r"recipe|meal|dinner|lunch|breakfast|cook|bake", query):
+        return "recipes"
+    if re.search(r"pair|ideas|recommend|should i|party|go well|for a", query):
+        return "product_recommendations"
+    return "generic_product_search"
+
+
+def canned_response(stage: str, contents: Any, rng: random.Random) -> str:
+    """Deterministic response text for a stage.
+
+    Args:
+        stage: Pipeline stage name.
+        contents: Prompt or list of prompt parts.
+        rng: Random generator seeded by the request.
+
+    Returns:
+        Response text as Gemini would return it.
+    """
+    query = extract_query(contents)
+    if stage == "follow_up":
+        return "False"
+    if stage == "follow_up_rewrite":
+        return query
+    if stage == "intent":
+        return classify_intent(query)
+    if stage == "product_title":
+        return " ".join(query.split()[:3]).title()
+    if stage == "product_types":
+        return json.dumps(rng.sample(GROCERY_ITEMS, 4))
+    if stage in ("recipe_recommendations", "diy_recommendations"):
+        return json.dumps({
+            "diy_ideas": rng.sample(RECIPE_NAMES, 3),
+            "product_list": rng.sample(GROCERY_ITEMS, 6)
+        })
+    if stage in ("recipe_metadata", "diy_metadata"):
+        return json.dumps(recipe_metadata(rng))
+    if stage == "summarize":
+        return f"Here are some options I found for {query}."
+    if stage == "image_classify":
+        return rng.choice(["grocery_list", "meal"])
+    if stage == "image_extract":
+        return json.dumps(rng.sample(GROCERY_ITEMS, 5))
+    if stage == "image_classify_extract":
+        return json.dumps({
+            "image_type": "grocery_list",
+            "items": rng.sample(GROCERY_ITEMS, 5)
+        })
+    return query
+
+
+def recipe_metadata(rng: random.Random) -> Dict[str, Any]:
+    """Fake recipe metadata following the recipe data prompt schema."""
+    ingredients: List[str] = [
+        f"{rng.randint(1, 3)} cups {item.lower()}"
+        for item in rng.sample(GROCERY_ITEMS, 5)
+    ]
+    return {
+        "ingredients": ingredients,
+        "instructions": [
+            "Prep the ingredients.",
+            "Cook over medium heat for 20 minutes.",
+            "Season to taste and serve.",
+        ],
+        "serving_size": str(rng.randint(2, 6)),
+        "calories": str(rng.randint(250, 800)),
+        "protein": f"{rng.randint(5, 45)}g",
+        "fat": f"{rng.randint(5, 35)}g",
+        "carbs": f"{rng.randint(10, 90)}g",
+        "cholesterol": f"{rng.randint(0, 150)}mg",
+        "sodium": f"{rng.randint(100, 900)}mg",
+        "potassium": f"{rng.randint(100, 900)}mg",
+        "recipe_type": rng.choice(["breakfast", "lunch", "dinner"]),
+        "prep_time": str(rng.randint(5, 30)),
+        "cook_time": str(rng.randint(10, 60)),
+    }
@@ -0,0 +1,81 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""Record / replay of Gemini responses.
+
+Live Gemini responses are appended to gemini_record_file as JSON lines
+of {"key", "stage", "text"}. The fake Gemini backend replays them from
+fake_replay_file, keyed by stage, system prompt and text contents.
+"""
+
+import functools
+import hashlib
+import json
+import threading
+from typing import Any, Dict, Optional
+
+from server.config.logging import logger
+
+
+_write_lock = threading.Lock()
+
+
+def request_key(stage: str, system_prompt: Optional[str], contents: Any) -> str:
+    """Stable key of a Gemini request.
+
+    Non text parts (e.g. images) are keyed by type only.
+
+    Args:
+        stage: Pipeline stage name.
+        system_prompt: System prompt of model.
+        contents: Prompt or list of prompt parts.
+    """
+    if not isinstance(contents, list):
+        contents = [contents]
+    parts = [
+        part if isinstance(part, str) else type(part).__name__
+        for part in contents
+    ]
+    payload = json.dumps([stage, system_prompt or "", parts])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def record_response(
+    path: str,
+    key: str,
+    stage: str,
+    text: Optional[str]
+) -> None:
+    """Append a Gemini response to a recording file.
+
+    Args:
+        path: JSON lines file to append to.
+        key: Request key.
+        stage: Pipeline stage name.
+        text: Raw response text.
+    """
+    line = json.dumps({"key": key, "stage": stage, "text": text})
+    try:
+        with _write_lock, open(path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+    except OSError as e:
+        logger.error(f"Error recording Gemini response to {path}: {e}")
+
+
+@functools.lru_cache(maxsize=None)
+def load_recording(path: str) -> Dict[str, str]:
+    """Load recorded responses by request key.
+
+    Args:
+        path: JSON lines file of recorded responses.
+    """
+    recording = {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    recording[entry["key"]] = entry["text"]
+    except FileNotFoundError:
+        logger.error(f"Replay file '{path}' not found.")
+    return recording
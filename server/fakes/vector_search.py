@@ -0,0 +1,98 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""Fake Vector Search Module."""
+
+import hashlib
+import math
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+from server.common import cache
+from server.common import metrics
+from server.common import single_flight
+from server.fakes import common
+
+
+# Queries matching this are treated as similar to malicious queries.
+MALICIOUS_PATTERN = re.compile(
+    r"ignore (all |the )?previous|system prompt|jailbreak", re.IGNORECASE)
+
+
+class FakeVectorSearchManager:
+    """Fake of VectorSearchManager with local hashed embeddings."""
+    def __init__(
+        self,
+        index_endpoint_id: Optional[str] = None,
+        index_endpoint_name: Optional[str] = None
+    ):
+        del index_endpoint_id, index_endpoint_name
+
+    def query(
+        self,
+        query: str,
+        top_n_neighbors: Optional[int] = 10,
+        stage: str = "vector_search"
+    ) -> List[Dict[str, Any]]:
+        """Get fake nearest malicious queries.
+
+        Distance is high only for queries matching MALICIOUS_PATTERN.
+        """
+        with metrics.track_stage(stage):
+            common.inject_sync("vector_search")
+        distance = 0.9 if MALICIOUS_PATTERN.search(query) else 0.05
+        return [
+            {"id": neighbor_id, "distance": distance / (neighbor_id + 1)}
+            for neighbor_id in range(top_n_neighbors)
+        ]
+
+    def embed_text(
+        self,
+        query: str,
+        task: str = "SEMANTIC_SIMILARITY",
+        model_name: str = "text-embedding-004",
+        dimensionality: Optional[int] = 256,
+    ) -> List[List[Any]]:
+        """Embed text as a normalized bag of hashed words.
+
+        Queries sharing words get similar embeddings, which is enough
+        to exercise similarity based code paths offline.
+        """
+        # Embeddings are cached, the guardrail and the semantic turn
+        # cache embed the same query.
+        key = (query, task, model_name, dimensionality)
+        embedding_cache = cache.get_cache(
+            name="embedding",
+            max_entries=int(os.getenv("embedding_cache_entries", "10000"))
+        )
+        embeddings = embedding_cache.get(key)
+        if embeddings is None:
+            # Identical concurrent embeddings share one request.
+            embeddings = single_flight.get_group(
+                "embed_text", threaded=True
+            ).do(
+                key,
+                lambda: self._embed_text(
+                    query, task, model_name, dimensionality)
+            )
+            embedding_cache.set(key, embeddings)
+        return embeddings
+
+    def _embed_text(
+        self,
+        query: str,
+        task: str,
+        model_name: str,
+        dimensionality: Optional[int]
+    ) -> List[List[Any]]:
+        """Embed text, see embed_text."""
+        del task, model_name
+        common.inject_sync("vector_search", scale=0.5)
+        dimensionality = dimensionality or 256
+        vector = [0.0] * dimensionality
+        for word in re.findall(r"[a-z0-9]+", query.lower()):
+            digest = hashlib.md5(word.encode("utf-8")).digest()
+            vector[int.from_bytes(digest[:4], "big") % dimensionality] += 1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [[value / norm for value in vector]]
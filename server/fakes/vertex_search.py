@@ -0,0 +1,74 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""Fake Vertex Search Module."""
+
+from types import SimpleNamespace
+from typing import Any, Dict, Optional
+
+from server.common import metrics
+from server.common import scheduler
+from server.fakes import common
+
+
+# Product variants appended to a query to build fake catalog titles.
+VARIANTS = [
+    "Organic", "Signature Select", "Family Size", "Fresh", "Value Pack",
+    "Low Sodium", "Gluten Free", "Premium", "Original", "Lightly Salted",
+]
+
+
+class FakeVertexSearchManager:
+    """Fake of VertexSearchManager returning deterministic products."""
+    def __init__(
+        self,
+        project_number: Optional[str] = None,
+        location: Optional[str] = "global",
+        data_store_id: Optional[str] = None,
+        serving_config_id: Optional[str] = None
+    ):
+        del project_number, location, data_store_id, serving_config_id
+
+    async def search(
+        self,
+        query: str,
+        page_size: int = 10,
+        stage: str = "vertex_search"
+    ):
+        """Perform a fake Vertex Search.
+
+        Returns an object shaped like a SearchResponse, with the
+        website datastore fields parse_es_result reads.
+        """
+        async with scheduler.get_scheduler("vertex_search").slot(stage):
+            with metrics.track_stage(stage):
+                await common.inject_async("vertex_search")
+
+        rng = common.seeded_random("vertex_search", query.lower())
+        results = []
+        for variant in rng.sample(VARIANTS, min(page_size, len(VARIANTS))):
+            sku = rng.randint(100000000, 999999999)
+            results.append(SimpleNamespace(
+                document=SimpleNamespace(
+                    derived_struct_data=product_document(
+                        f"{variant} {query.title()}", sku)
+                )
+            ))
+        return SimpleNamespace(results=results)
+
+
+def product_document(title: str, sku: int) -> Dict[str, Any]:
+    """Website datastore document of a product."""
+    url = f"https://www.albertsons.com/shop/product-details.{sku}.html"
+    return {
+        "title": title,
+        "pagemap": {
+            "metatags": [{
+                "og:title": f"{title} - albertsons",
+                "og:url": url,
+            }],
+            "cse_image": [{
+                "src": f"https://images.albertsons-media.com/is/image/ABS/{sku}"
+            }],
+        },
+    }
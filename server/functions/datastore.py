@@ -4,13 +4,37 @@
 """DataStore Module."""
 
 import datetime
-from typing import Any, Dict, List, Union
-
-from google.cloud import datastore
+import threading
+from typing import Any, Dict, List, Tuple, Union
 
+from server import fakes
+from server.common import metrics
 from server.config.logging import logger
 
 
+# Datastore clients by project and database.
+_clients: Dict[Tuple[str, str], Any] = {}
+_clients_lock = threading.Lock()
+
+
+def get_datastore_client(project_id: str, datastore_id: str) -> Any:
+    """Datastore client of a database, created on first use.
+
+    Args:
+        project_id: Project ID of datastore DB.
+        datastore_id: ID of datastore DB.
+    """
+    key = (project_id, datastore_id)
+    with _clients_lock:
+        if key not in _clients:
+            from google.cloud import datastore  # pylint: disable=import-outside-toplevel
+            _clients[key] = datastore.Client(
+                project=project_id,
+                database=datastore_id
+            )
+        return _clients[key]
+
+
 class DataStoreManager:
     """Saved element to Datastore."""
     def __init__(
@@ -24,10 +48,8 @@ class DataStoreManager:
             project_id: Project ID of datastore DB.
             datastore_id: ID of datastore DB.
         """
-        self.datastore_client = datastore.Client(
-            project=project_id,
-            database=datastore_id
-        )
+        self.datastore_client = get_datastore_client(
+            project_id, datastore_id)
 
     def get_saved_elements(self, kind: str) -> List[Dict[str, Any]]:
         """Get saved entities from datastore.
@@ -45,7 +67,8 @@ class DataStoreManager:
         # Order by saved date.
         query.order = ["created"]
 
-        results = list(query.fetch())
+        with metrics.track_stage("datastore_get"):
+            results = list(query.fetch())
 
         # For FastAPI serialization.
         for result in results:
@@ -68,6 +91,7 @@ class DataStoreManager:
             elem_key: Key of element to save as (e.g product, recipe, etc.).
             element: Element to upload to datastore.
         """
+        from google.cloud import datastore  # pylint: disable=import-outside-toplevel
         try:
             # Create key for element to upload.
             key = self.datastore_client.key(kind, element_id)
@@ -79,7 +103,8 @@ class DataStoreManager:
                     elem_key: element,
                 }
             )
-            self.datastore_client.put(task)
+            with metrics.track_stage("datastore_put"):
+                self.datastore_client.put(task)
         except Exception as e:
             logger.error(f"Error saving recipe: {e}")
             raise e
@@ -92,6 +117,21 @@ class DataStoreManager:
         """Delete element from datastore."""
         try:
             key = self.datastore_client.key(kind, element_id)
-            self.datastore_client.delete(key)
+            with metrics.track_stage("datastore_delete"):
+                self.datastore_client.delete(key)
         except Exception as e:
             logger.error(f"Error deleting recipe: {e}")
+
+
+def create_datastore_manager(**kwargs) -> DataStoreManager:
+    """Create a Datastore manager.
+
+    Returns the fake Datastore backend when backend_mode is fake.
+
+    Args:
+        kwargs: DataStoreManager init args.
+    """
+    if fakes.enabled():
+        from server.fakes import datastore as fake_datastore  # pylint: disable=import-outside-toplevel
+        return fake_datastore.FakeDataStoreManager(**kwargs)
+    return DataStoreManager(**kwargs)
@@ -8,6 +8,7 @@ from typing import Any, Dict, List
 from server.common import gemini
 from server.common import prompts
 from server.config.logging import logger
+from server.turns import history as chat_history
 
 
 class FollowUpClassifier:
@@ -26,7 +27,7 @@ class FollowUpClassifier:
         self.query = query
         self.history = history
 
-        self.model = gemini.GeminiModelManager()
+        self.model = gemini.create_model_manager()
 
     async def classify_follow_up(self) -> str:
         """Classify if query is follow_up
@@ -38,13 +39,14 @@ class FollowUpClassifier:
             if self.history:
                 # We only care about the last response and message.
                 prompt = prompts.follow_up_classifier_prompt.format(
-                    history=self.history[-1],
+                    history=chat_history.last_digest(self.history),
                     query=self.query
                 )
                 is_follow_up = await self.model.generate_response(
                     contents=prompt,
                     max_output_tokens=100,
-                    temperature=0.0
+                    temperature=0.0,
+                    stage="follow_up"
                 )
                 # TODO (pnallamotu): clean this up.
                 return is_follow_up.lower() == "true"
@@ -67,12 +69,13 @@ class FollowUpClassifier:
             last query and response.
         """
         prompt = prompts.multi_turn_query_system_prompt.format(
-            history=self.history[-1],
+            history=chat_history.last_digest(self.history),
             query=self.query
         )
         transformed_query = await self.model.generate_response(
             contents=prompt,
             max_output_tokens=500,
-            temperature=0.0
+            temperature=0.0,
+            stage="follow_up_rewrite"
         )
         return transformed_query
@@ -5,8 +5,13 @@
 
 from typing import Optional
 
+from google.api_core import exceptions
+
+from server.common import circuit_breaker
 from server.common import gemini
+from server.common import metrics
 from server.config.logging import logger
+from server.functions import local_guardrail
 from server.functions import vector_search
 
 
@@ -27,13 +32,14 @@ class IntentClassifier:
         self.system_context = system_context
         self.use_vector_db = use_vector_db
 
-        self.model = gemini.GeminiModelManager(
+        self.model = gemini.create_model_manager(
             system_prompt=system_context
         )
 
         # Set up vector search manager.
         if self.use_vector_db:
-            self.vector_search_client = vector_search.VectorSearchManager()
+            self.vector_search_client = (
+                vector_search.create_vector_search_manager())
 
     async def classify_intent(self, query: str) -> str:
         """Classify intent of query.
@@ -48,7 +54,8 @@ class IntentClassifier:
             intent = await self.model.generate_response(
                 contents=query,
                 max_output_tokens=100,
-                temperature=0.5
+                temperature=0.5,
+                stage="intent"
             )
             return intent
         except Exception as e:
@@ -65,6 +72,8 @@ class IntentClassifier:
 
         Performs search against vector search db
         for similarity against malicious queries.
+        Falls back to the local pattern guardrail when
+        vector search is unavailable, other errors are raised.
 
         Args:
             query: user query.
@@ -77,8 +86,11 @@ class IntentClassifier:
             # If a vector search endpoint was set up
             # search against index for malicious similarity.
             if self.use_vector_db:
-                nearest_neighbors = self.vector_search_client.query(
-                    query=query)
+                with circuit_breaker.get_breaker("vector_search").guard():
+                    nearest_neighbors = self.vector_search_client.query(
+                        query=query,
+                        stage="guardrail"
+                    )
 
                 # Get closest match to query.
                 most_similar_match = nearest_neighbors[0]
@@ -87,8 +99,13 @@ class IntentClassifier:
                 if most_similar_match.get("distance") >= threshold:
                     return True
             return False
-        except Exception as e:
+        except (circuit_breaker.CircuitOpenError,
+                exceptions.GoogleAPIError) as e:
+            # Only an unavailable backend falls back, other errors (e.g.
+            # of parsing the response) fail the turn.
             logger.error(
-                f"Error checking whether user query: {query} is malicious: {e}")
-            # Defaulting True for gaurdrail
-            return True
+                f"Error checking whether user query: {query} is malicious, "
+                f"using local guardrail: {e}"
+            )
+            metrics.FALLBACKS.labels(fallback="local_guardrail").inc()
+            return local_guardrail.is_malicious(query)
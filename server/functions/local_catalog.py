@@ -0,0 +1,120 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""Local Catalog Module.
+
+In memory keyword index of products, used as a fallback when Vertex
+Search is unavailable. Products are learned from live search results
+and optionally preloaded from a JSONL file of parsed products
+(local_catalog_path env variable), e.g. a product export.
+"""
+
+import collections
+import json
+import os
+import re
+from typing import Any, Dict, List, Optional, Set
+
+from server.config.logging import logger
+
+
+_catalog = None
+
+
+def tokenize(text: str) -> Set[str]:
+    """Lowercase words of text, with plural s removed."""
+    return {
+        word[:-1] if len(word) > 3 and word.endswith("s") else word
+        for word in re.findall(r"[a-z0-9]+", text.lower())
+    }
+
+
+class LocalCatalog:
+    """Keyword index of recently seen products."""
+    def __init__(self, max_products: int = 20000):
+        """Init local catalog.
+
+        Args:
+            max_products: Max products kept, least recently seen evicted.
+        """
+        self.max_products = max_products
+        self.products = collections.OrderedDict()
+        self.index = collections.defaultdict(set)
+
+    def add(self, products: List[Dict[str, Any]]) -> None:
+        """Add or refresh products.
+
+        Args:
+            products: Parsed products with at least a title.
+        """
+        for product in products:
+            if not product or not product.get("title"):
+                continue
+            key = product.get("url") or product["title"]
+            if key in self.products:
+                self.products.move_to_end(key)
+            else:
+                for token in tokenize(product["title"]):
+                    self.index[token].add(key)
+            self.products[key] = product
+
+        while len(self.products) > self.max_products:
+            key, product = self.products.popitem(last=False)
+            for token in tokenize(product["title"]):
+                self.index[token].discard(key)
+                if not self.index[token]:
+                    del self.index[token]
+
+    def search(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Find products matching most query words.
+
+        Args:
+            query: Search query.
+            limit: Max products returned.
+
+        Returns:
+            Products ordered by matched words, then most recently seen.
+        """
+        scores = collections.Counter()
+        for token in tokenize(query):
+            for key in self.index.get(token, ()):
+                scores[key] += 1
+        if not scores:
+            return []
+        recency = {key: i for i, key in enumerate(self.products)}
+        ranked = sorted(
+            scores, key=lambda key: (scores[key], recency[key]), reverse=True)
+        return [self.products[key] for key in ranked[:limit]]
+
+    def load(self, path: str) -> None:
+        """Add products of a JSONL file.
+
+        Args:
+            path: JSONL file of parsed products.
+        """
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.add([json.loads(line) for line in f if line.strip()])
+            logger.info(f"Loaded {len(self.products)} products from {path}")
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"Error loading local catalog {path}: {e}")
+
+    def __len__(self) -> int:
+        return len(self.products)
+
+
+def get_catalog(path: Optional[str] = None) -> LocalCatalog:
+    """Local catalog shared by this process.
+
+    Args:
+        path: JSONL file to preload. Defaults to local_catalog_path
+            env variable.
+    """
+    global _catalog
+    if _catalog is None:
+        _catalog = LocalCatalog(
+            max_products=int(os.getenv("local_catalog_max_products", "20000")))
+        path = path or os.getenv("local_catalog_path")
+        if path:
+            _catalog.load(path)
+    return _catalog
@@ -0,0 +1,40 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""Local Guardrail Module.
+
+Pattern based check for malicious queries, used when the Vector Search
+guardrail is unavailable instead of blocking every query. It only
+catches common prompt injection phrasing, the vector index remains the
+main guardrail.
+"""
+
+import re
+
+
+# Common prompt injection and jailbreak phrasing.
+MALICIOUS_PATTERNS = [
+    r"ignore (all |any |the )?(previous|prior|above) (instructions|prompts?|rules)",  # pylint: disable=line-too-long
+    r"disregard (all |any |the )?(previous|prior|above)",
+    r"(reveal|show|print|repeat|what is) (me )?(your|the) (system )?(prompt|instructions)",  # pylint: disable=line-too-long
+    r"system prompt",
+    r"jailbreak",
+    r"\bdan mode\b|do anything now",
+    r"you are no longer",
+    r"pretend (you are|to be) (not )?(an? )?(ai|assistant|unrestricted)",
+    r"developer mode",
+    r"<\s*/?\s*(system|instructions?)\s*>",
+]
+MALICIOUS_PATTERN = re.compile("|".join(MALICIOUS_PATTERNS), re.IGNORECASE)
+
+
+def is_malicious(query: str) -> bool:
+    """Check a query against known malicious patterns.
+
+    Args:
+        query: User query.
+
+    Returns:
+        Boolean of whether query looks malicious.
+    """
+    return bool(MALICIOUS_PATTERN.search(query or ""))
@@ -4,13 +4,50 @@
 """Vector Search Module."""
 
 import os
+import threading
 from typing import Any, Dict, List, Optional
 
-from google.cloud import aiplatform
-from vertexai.preview.language_models import (
-   TextEmbeddingInput,
-   TextEmbeddingModel
-)
+from server import fakes
+from server.common import cache
+from server.common import metrics
+from server.common import single_flight
+
+
+# Model of query embeddings.
+EMBEDDING_MODEL = "text-embedding-004"
+
+# Index endpoints and embedding models by name, created on first use.
+_endpoints: Dict[str, Any] = {}
+_embedding_models: Dict[str, Any] = {}
+_lock = threading.Lock()
+
+
+def get_index_endpoint(endpoint_id: str) -> Any:
+    """Vector Search index endpoint of this process.
+
+    Args:
+        endpoint_id: Vector Search endpoint id.
+    """
+    with _lock:
+        if endpoint_id not in _endpoints:
+            from google.cloud import aiplatform  # pylint: disable=import-outside-toplevel
+            _endpoints[endpoint_id] = aiplatform.MatchingEngineIndexEndpoint(
+                endpoint_id)
+        return _endpoints[endpoint_id]
+
+
+def get_embedding_model(model_name: str) -> Any:
+    """Text embedding model of this process.
+
+    Args:
+        model_name: Pre-trained text embedding model name.
+    """
+    with _lock:
+        if model_name not in _embedding_models:
+            from vertexai.preview.language_models import TextEmbeddingModel  # pylint: disable=import-outside-toplevel
+            _embedding_models[model_name] = (
+                TextEmbeddingModel.from_pretrained(model_name))
+        return _embedding_models[model_name]
 
 
 class VectorSearchManager:
@@ -29,8 +66,7 @@ class VectorSearchManager:
 
         # Vector search endpoint.
         endpoint_id = index_endpoint_id or os.getenv("vector_search_id")
-        self.index_endpoint = aiplatform.MatchingEngineIndexEndpoint(
-            endpoint_id)
+        self.index_endpoint = get_index_endpoint(endpoint_id)
 
         # Endpoint version / name.
         self.index_endpoint_name = index_endpoint_name or os.getenv(
@@ -39,32 +75,35 @@ class VectorSearchManager:
     def query(
         self,
         query: str,
-        top_n_neighbors: Optional[int] = 10
+        top_n_neighbors: Optional[int] = 10,
+        stage: str = "vector_search"
     ) -> List[Dict[str, Any]]:
         """Get top N similar matches from query.
 
         Args:
             query: User query to search against.
             top_n_neighbors: Number of neighbors to search for.
+            stage: Pipeline stage name used in metrics.
 
         Returns:
             List of documents with id and distance.
         """
-        # Embed query.
-        embedded_query = self.embed_text(query)
-
-        # Get nearest neighbors.
-        similar_matches = self.find_neighbors(
-            embedded_query,
-            top_n_neighbors
-        )
+        with metrics.track_stage(stage):
+            # Embed query.
+            embedded_query = self.embed_text(query)
+
+            # Get nearest neighbors.
+            similar_matches = self.find_neighbors(
+                embedded_query,
+                top_n_neighbors
+            )
         return similar_matches
 
     def embed_text(
         self,
         query: str,
         task: str = "SEMANTIC_SIMILARITY",
-        model_name: str = "text-embedding-004",
+        model_name: str = EMBEDDING_MODEL,
         dimensionality: Optional[int] = 256,
     ) -> List[List[Any]]:
         """Embeds a list of texts.
@@ -80,7 +119,36 @@ class VectorSearchManager:
             A list of lists, where each inner list
                 represents the emebddings of a text.
         """
-        model = TextEmbeddingModel.from_pretrained(model_name)
+        # Embeddings are cached, the guardrail and the semantic turn
+        # cache embed the same query.
+        key = (query, task, model_name, dimensionality)
+        embedding_cache = cache.get_cache(
+            name="embedding",
+            max_entries=int(os.getenv("embedding_cache_entries", "10000"))
+        )
+        embeddings = embedding_cache.get(key)
+        if embeddings is None:
+            # Identical concurrent embeddings share one request.
+            embeddings = single_flight.get_group(
+                "embed_text", threaded=True
+            ).do(
+                key,
+                lambda: self._embed_text(
+                    query, task, model_name, dimensionality)
+            )
+            embedding_cache.set(key, embeddings)
+        return embeddings
+
+    def _embed_text(
+        self,
+        query: str,
+        task: str,
+        model_name: str,
+        dimensionality: Optional[int]
+    ) -> List[List[Any]]:
+        """Embed text, see embed_text."""
+        from vertexai.preview.language_models import TextEmbeddingInput  # pylint: disable=import-outside-toplevel
+        model = get_embedding_model(model_name)
         inputs = [TextEmbeddingInput(query, task)]
         kwargs = dict(
             output_dimensionality=dimensionality
@@ -116,3 +184,17 @@ class VectorSearchManager:
                 "distance": neighbor.distance
             })
         return similar_matches
+
+
+def create_vector_search_manager(**kwargs) -> VectorSearchManager:
+    """Create a Vector Search manager.
+
+    Returns the fake Vector Search backend when backend_mode is fake.
+
+    Args:
+        kwargs: VectorSearchManager init args.
+    """
+    if fakes.enabled():
+        from server.fakes import vector_search as fake_vector_search  # pylint: disable=import-outside-toplevel
+        return fake_vector_search.FakeVectorSearchManager(**kwargs)
+    return VectorSearchManager(**kwargs)
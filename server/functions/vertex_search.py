@@ -4,9 +4,29 @@
 """Vertex Search Module."""
 
 import os
-from typing import Optional
+import threading
+from typing import Any, Optional
 
-from google.cloud import discoveryengine_v1 as discoveryengine
+import asyncio
+
+from server import fakes
+from server.common import metrics
+from server.common import scheduler
+
+
+# Search client shared by managers, it holds a gRPC channel.
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_search_client() -> Any:
+    """Vertex Search client of this process, created on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            from google.cloud import discoveryengine_v1 as discoveryengine  # pylint: disable=import-outside-toplevel
+            _client = discoveryengine.SearchServiceClient()
+        return _client
 
 
 class VertexSearchManager:
@@ -30,7 +50,7 @@ class VertexSearchManager:
         self.serving_config = self._init_search_client()
 
         # Vertex search client.
-        self.client = discoveryengine.SearchServiceClient()
+        self.client = get_search_client()
 
     def _init_search_client(self) -> str:
         """Initialize a Vertex Search config."""
@@ -39,16 +59,24 @@ class VertexSearchManager:
             f"servingConfigs/{self.serving_config_id}"
         return serving_config
 
-    def search(self, query: str, page_size: int = 10):
+    async def search(
+        self,
+        query: str,
+        page_size: int = 10,
+        stage: str = "vertex_search"
+    ):
         """Perform a Vertex Search.
 
         Args:
             query: Search query.
             page_size: Number of max results.
+            stage: Pipeline stage name used in metrics.
 
         Returns:
             Vertex search matched documents.
         """
+        from google.cloud import discoveryengine_v1 as discoveryengine  # pylint: disable=import-outside-toplevel
+
         # Create request object.
         request = discoveryengine.SearchRequest(
             serving_config=self.serving_config,
@@ -56,5 +84,24 @@ class VertexSearchManager:
             page_size=page_size,
         )
 
-        response = self.client.search(request)
+        # Blocking client, run in a thread to keep the event loop free.
+        # Queued by priority class with other Vertex Search calls.
+        async with scheduler.get_scheduler("vertex_search").slot(stage):
+            with metrics.track_stage(stage):
+                response = await asyncio.to_thread(
+                    self.client.search, request)
         return response
+
+
+def create_search_manager(**kwargs) -> VertexSearchManager:
+    """Create a Vertex Search manager.
+
+    Returns the fake Vertex Search backend when backend_mode is fake.
+
+    Args:
+        kwargs: VertexSearchManager init args.
+    """
+    if fakes.enabled():
+        from server.fakes import vertex_search as fake_vertex_search  # pylint: disable=import-outside-toplevel
+        return fake_vertex_search.FakeVertexSearchManager(**kwargs)
+    return VertexSearchManager(**kwargs)
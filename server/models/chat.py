@@ -3,6 +3,8 @@
 # agreement with Google.
 """Data models for Chat."""
 
+from typing import Optional
+
 from pydantic import BaseModel
 
 
@@ -11,5 +13,7 @@ class ChatModel(BaseModel):
 
     Properties:
         user_query: Query for a request. 
+        session_id: Optional client session id to keep history per session.
     """
     user_query: str
+    session_id: Optional[str] = None
@@ -0,0 +1,121 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""API Routes for batch jobs."""
+
+import os
+import time
+import uuid
+
+import asyncio
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+
+from server.batch import runner
+from server.config.logging import logger
+
+router = APIRouter()
+
+# Batch jobs of this server process by job id, in start order.
+jobs = {}
+
+
+def prune_jobs() -> None:
+    """Forget finished jobs after batch_job_ttl or beyond batch_max_jobs."""
+    ttl = float(os.getenv("batch_job_ttl", "3600"))
+    max_jobs = int(os.getenv("batch_max_jobs", "100"))
+    finished = [
+        job_id for job_id, job in jobs.items() if job["task"].done()]
+    now = time.time()
+    for index, job_id in enumerate(finished):
+        finished_at = jobs[job_id]["runner"].finished_at or now
+        if now - finished_at > ttl or len(finished) - index > max_jobs:
+            del jobs[job_id]
+
+
+def resolve_batch_path(file_name: str) -> str:
+    """Path of a batch file inside the batch_dir directory.
+
+    Raises:
+        ValueError: If the path escapes batch_dir.
+    """
+    batch_dir = os.path.abspath(os.getenv("batch_dir", "batch"))
+    path = os.path.abspath(os.path.join(batch_dir, file_name))
+    if os.path.commonpath([batch_dir, path]) != batch_dir:
+        raise ValueError(f"Batch file must be inside {batch_dir}.")
+    return path
+
+
+def job_limits(data: dict) -> dict:
+    """Concurrency and rate of a job request, at most the configured ones.
+
+    Raises:
+        ValueError: If a limit is not a number.
+    """
+    max_concurrency = int(os.getenv("batch_concurrency", "4"))
+    concurrency = int(data.get("concurrency") or max_concurrency)
+    rate = float(data.get("rps") or 0)
+    return {
+        "concurrency": max(1, min(concurrency, max_concurrency)),
+        # Jobs share the batch_rate_limit, a job may only go slower.
+        "rate": rate if rate > 0 else None,
+    }
+
+
+@router.post("/batch-jobs")
+async def start_batch_job(request: Request):
+    try:
+        data = await request.json()
+        input_path = resolve_batch_path(data["input"])
+        output_path = resolve_batch_path(
+            data.get("output") or f"{data['input']}.results.jsonl")
+        if not os.path.exists(input_path):
+            return JSONResponse(
+                {"msg": f"Input {data['input']} not found."},
+                status_code=404
+            )
+
+        prune_jobs()
+        # Jobs appending to the same output and checkpoint corrupt both.
+        for job in jobs.values():
+            if (not job["task"].done()
+                    and job["runner"].output_path == output_path):
+                return JSONResponse(
+                    {"msg": "Output is used by a running job."},
+                    status_code=409
+                )
+
+        job_id = uuid.uuid4().hex
+        batch = runner.BatchRunner(
+            input_path=input_path,
+            output_path=output_path,
+            **job_limits(data)
+        )
+        jobs[job_id] = {
+            "runner": batch,
+            "task": asyncio.create_task(batch.run())
+        }
+        logger.info(f"Started batch job {job_id} for {input_path}")
+        return JSONResponse({"job_id": job_id, **batch.status()})
+    except (KeyError, TypeError, ValueError) as e:
+        logger.error(f"Invalid batch job request: {e}")
+        return JSONResponse({"msg": f"Invalid request: {e}"}, status_code=400)
+    except Exception as e:
+        logger.error(f"Error starting batch job: {e}")
+        return JSONResponse({"msg": "Error"})
+
+
+@router.get("/batch-jobs/{job_id}")
+async def get_batch_job(job_id: str):
+    if job_id not in jobs:
+        return JSONResponse({"msg": "Job not found."}, status_code=404)
+    return JSONResponse({"job_id": job_id, **jobs[job_id]["runner"].status()})
+
+
+@router.delete("/batch-jobs/{job_id}")
+async def cancel_batch_job(job_id: str):
+    if job_id not in jobs:
+        return JSONResponse({"msg": "Job not found."}, status_code=404)
+    jobs[job_id]["runner"].cancel()
+    logger.info(f"Cancelling batch job {job_id}")
+    return JSONResponse({"job_id": job_id, **jobs[job_id]["runner"].status()})
@@ -3,39 +3,55 @@
 # agreement with Google.
 """API Routes for chat."""
 
-import base64
+import os
+from typing import Any, Dict, List, Optional
 
-from fastapi import APIRouter, File, Request, UploadFile
+import asyncio
+from fastapi import (
+    APIRouter, BackgroundTasks, File, Form, Request, UploadFile
+)
 from fastapi.responses import JSONResponse
-from vertexai.generative_models import Part
 
+from server.common import deadline
 from server.config.logging import logger
 from server.models import chat
-from server.state import message_history
+from server import state
 from server.turns import multi_turn
+from server.services import prefetch
+from server.services.image import preprocess
 from server.services.image import sme_images
 
 router = APIRouter()
 
 
 @router.post("/send-message")
-async def send_message(request: Request):
+async def send_message(
+    request: Request,
+    background_tasks: BackgroundTasks
+):
     try:
         logger.info("Sending chat message")
         data = await request.json()
 
         # Set user query.
-        user_query = chat.ChatModel(**data).user_query
+        chat_model = chat.ChatModel(**data)
+        user_query = chat_model.user_query
+        message_history = state.get_history(chat_model.session_id)
 
-        result = await multi_turn.MultiTurn(
-            query=user_query,
-            history=message_history
-        ).process()
+        with deadline.deadline_scope():
+            result = await multi_turn.MultiTurn(
+                query=user_query,
+                history=message_history
+            ).process()
 
-        message_history.append({
+        history_entry = {
             "user_query": user_query,
             "response": result
-        })
+        }
+        state.append_turn(message_history, history_entry)
+
+        # Prefetch for the likely next request after responding.
+        background_tasks.add_task(prefetch.after_turn, history_entry)
 
         return JSONResponse(result)
     except Exception as e:
@@ -44,36 +60,134 @@ async def send_message(request: Request):
 
 
 @router.post("/send-message/image")
-async def send_image(image: UploadFile = File(...)):
+async def send_image(
+    background_tasks: BackgroundTasks,
+    image: UploadFile = File(...),
+    session_id: Optional[str] = Form(None)
+):
     try:
         logger.info("Image input to chat")
+        message_history = state.get_history(session_id)
         if not image:
             raise Exception
 
-        contents = await image.read()
-
-        # Convert image to gemini part.
-        encoded_image = base64.b64encode(contents).decode("utf-8")
-        image_content = Part.from_data(
-            data=base64.b64decode(encoded_image),
-            mime_type=image.content_type
-        )
+        # Read with a size limit, downsize and re-encode.
+        processed_image = await preprocess.preprocess_upload(image)
 
         # Convert image to query matching intents.
-        user_query = await sme_images.SMEImages(
-            image_contents=image_content).process_image()
+        image_contents = await extract_image_contents(processed_image)
+        user_query = sme_images.build_query(image_contents)
+
+        with deadline.deadline_scope():
+            result = await multi_turn.MultiTurn(
+                query=user_query,
+                history=message_history
+            ).process()
+
+        history_entry = {
+            "user_query": user_query,
+            "response": result
+        }
+        state.append_turn(message_history, history_entry)
+
+        # Prefetch for the likely next request after responding.
+        background_tasks.add_task(prefetch.after_turn, history_entry)
+
+        return JSONResponse(result)
+    except preprocess.ImageTooLargeError as e:
+        logger.error(f"Image upload rejected: {e}")
+        return JSONResponse({"msg": str(e)}, status_code=413)
+    except Exception as e:
+        logger.error(f"Error making request: {e}")
+        return JSONResponse({"msg": "Error"})
 
-        result = await multi_turn.MultiTurn(
-            query=user_query,
-            history=message_history
-        ).process()
 
-        message_history.append({
+@router.post("/send-message/images")
+async def send_images(
+    background_tasks: BackgroundTasks,
+    images: List[UploadFile] = File(...),
+    session_id: Optional[str] = Form(None)
+):
+    try:
+        logger.info(f"{len(images)} image input to chat")
+        message_history = state.get_history(session_id)
+        max_images = int(os.getenv("image_batch_max_images", "5"))
+        if len(images) > max_images:
+            return JSONResponse(
+                {"msg": f"Send at most {max_images} images."},
+                status_code=400
+            )
+
+        # Preprocess every upload first so size limits fail fast.
+        processed_images = [
+            await preprocess.preprocess_upload(image) for image in images
+        ]
+
+        # Extract all images concurrently, skipping any that fail.
+        results = await asyncio.gather(
+            *[extract_image_contents(image) for image in processed_images],
+            return_exceptions=True
+        )
+        image_contents_list = []
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error(f"Error extracting image contents: {result}")
+                continue
+            image_contents_list.append(result)
+
+        # One deduplicated query, processed as a single turn.
+        merged_contents = sme_images.merge_image_contents(image_contents_list)
+        user_query = sme_images.build_merged_query(merged_contents)
+        if user_query is None:
+            return JSONResponse(
+                {"msg": "Could not read any image."},
+                status_code=422
+            )
+
+        with deadline.deadline_scope():
+            result = await multi_turn.MultiTurn(
+                query=user_query,
+                history=message_history
+            ).process()
+
+        history_entry = {
             "user_query": user_query,
             "response": result
-        })
+        }
+        state.append_turn(message_history, history_entry)
+
+        # Prefetch for the likely next request after responding.
+        background_tasks.add_task(prefetch.after_turn, history_entry)
 
         return JSONResponse(result)
+    except preprocess.ImageTooLargeError as e:
+        logger.error(f"Image upload rejected: {e}")
+        return JSONResponse({"msg": str(e)}, status_code=413)
     except Exception as e:
         logger.error(f"Error making request: {e}")
         return JSONResponse({"msg": "Error"})
+
+
+async def extract_image_contents(
+    processed_image: preprocess.PreprocessedImage
+) -> Optional[Dict[str, Any]]:
+    """Classify and extract a preprocessed image.
+
+    Args:
+        processed_image: Preprocessed upload.
+
+    Returns:
+        Image type and extracted items, or None if unclassified.
+    """
+    from vertexai.generative_models import Part  # pylint: disable=import-outside-toplevel
+
+    # Convert image to gemini part.
+    image_content = Part.from_data(
+        data=processed_image.data,
+        mime_type=processed_image.mime_type
+    )
+    return await sme_images.SMEImages(
+        image_contents=image_content,
+        content_hash=processed_image.content_hash,
+        perceptual_hash=processed_image.perceptual_hash
+    ).extract_contents()
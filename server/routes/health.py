@@ -0,0 +1,26 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""API Routes for health checks."""
+
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from server import startup
+
+router = APIRouter()
+
+
+@router.get("/healthz")
+async def healthz():
+    # Liveness, the process serves requests.
+    return {"status": "ok"}
+
+
+@router.get("/readyz")
+async def readyz():
+    # Readiness, clients are initialized and caches warmed.
+    return JSONResponse(
+        startup.status(),
+        status_code=200 if startup.is_ready() else 503
+    )
@@ -0,0 +1,33 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""API Routes for metrics."""
+
+import os
+
+from fastapi import APIRouter
+from fastapi.responses import Response
+from prometheus_client import (
+    CollectorRegistry,
+    CONTENT_TYPE_LATEST,
+    generate_latest,
+    multiprocess,
+    REGISTRY,
+)
+
+router = APIRouter()
+
+
+@router.get("/metrics")
+async def get_metrics():
+    # With several gunicorn workers, aggregate the metrics
+    # every worker writes to PROMETHEUS_MULTIPROC_DIR.
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(
+        generate_latest(registry),
+        media_type=CONTENT_TYPE_LATEST
+    )
@@ -4,8 +4,9 @@
 """API Routes for saved recipes."""
 
 from fastapi import APIRouter, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 
+from server.common import utils
 from server.config.logging import logger
 from server.services.recipes import saved_recipes
 
@@ -13,11 +14,23 @@ router = APIRouter()
 
 
 @router.get("/saved-recipes")
-async def get_saved_recipes():
+async def get_saved_recipes(request: Request):
     try:
         logger.info("Getting saved recipes")
-        result = saved_recipes.SavedRecipes().get_saved_recipes()
-        return JSONResponse(result)
+        result = await saved_recipes.SavedRecipes().get_cached_saved_recipes()
+
+        # Clients revalidate with the ETag, unchanged lists return 304.
+        headers = {"ETag": result["etag"], "Cache-Control": "no-cache"}
+        if utils.etag_matches(
+            request.headers.get("if-none-match"), result["etag"]
+        ):
+            return Response(status_code=304, headers=headers)
+
+        return Response(
+            content=result["body"],
+            media_type="application/json",
+            headers=headers
+        )
     except Exception as e:
         logger.error(f"Error getting saved recipes: {e}")
         return JSONResponse({"msg": "Error"})
@@ -27,7 +40,7 @@ async def get_saved_recipes():
 async def delete_saved_recipe(recipe_id: int):
     try:
         logger.info("Deleted saved recipe")
-        saved_recipes.SavedRecipes().unsave_recipe(recipe_id=recipe_id)
+        await saved_recipes.SavedRecipes().unsave_recipe(recipe_id=recipe_id)
         return JSONResponse({"msg": "Recipe unsaved."})
     except Exception as e:
         logger.error(f"Error deleting recipe: {e}")
@@ -0,0 +1,238 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""WebSocket route for chat.
+
+A connection is a chat session: its history, with the digests used by
+follow up prompts, and its last result are kept for the life of the
+connection instead of being resolved again every turn.
+
+Client messages:
+    Text: {"type": "message", "user_query": "easy pasta recipes", "id": 1}
+    Text: {"type": "cancel"}
+    Binary: Image bytes (JPEG, PNG or WebP), processed as an image turn.
+
+Server messages are events of a turn, {"type": ..., "turn": 1, "data": ...}
+with the client's id when given:
+    accepted: Turn started.
+    query: Query after follow up rewriting.
+    intent: Classified intent.
+    names: Generated product types and recipe names.
+    products: A product category, once its search completes.
+    recipe: A recipe, once its metadata is generated.
+    result: Final result, the payload of /send-message.
+    cancelled: Turn cancelled by the client or by a newer message.
+    error: {"msg": ...}, with retry_after when overloaded.
+
+A connection runs one turn at a time, a new message cancels the turn in
+flight along with its outstanding backend calls.
+"""
+
+import json
+from typing import Any, Dict, List, Optional
+
+import asyncio
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+
+from server import state
+from server.common import admission
+from server.common import deadline
+from server.common import metrics
+from server.common import rate_limit
+from server.common import stream
+from server.config.logging import logger
+from server.routes import chat
+from server.services import prefetch
+from server.services.image import preprocess
+from server.services.image import sme_images
+from server.turns import multi_turn
+
+router = APIRouter()
+
+
+class ChatSession:
+    """Chat session of a WebSocket connection."""
+    def __init__(
+        self,
+        websocket: WebSocket,
+        history: List[Dict[str, Any]]
+    ):
+        """Init chat session.
+
+        Args:
+            websocket: Accepted WebSocket connection.
+            history: Chat history of session, appended to after turns.
+        """
+        self.websocket = websocket
+        self.history = history
+        self.last_result = None
+
+        self._turns = 0
+        self._turn_task = None
+        self._turn_id = None
+        # Events are sent in order by a single sender.
+        self._outbox = asyncio.Queue()
+
+    def send(
+        self,
+        turn: int,
+        event: str,
+        data: Any = None,
+        message_id: Any = None
+    ) -> None:
+        """Queue an event of a turn for the client."""
+        message = {"type": event, "turn": turn, "data": data}
+        if message_id is not None:
+            message["id"] = message_id
+        # Serialized now, later changes of data are not sent.
+        self._outbox.put_nowait(json.dumps(message))
+
+    async def _send_events(self) -> None:
+        while True:
+            text = await self._outbox.get()
+            await self.websocket.send_text(text)
+
+    async def serve(self) -> None:
+        """Receive messages until the client disconnects."""
+        sender = asyncio.create_task(self._send_events())
+        try:
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    return
+                if message.get("bytes") is not None:
+                    self.start_turn(image=message["bytes"])
+                elif message.get("text") is not None:
+                    self.handle_text(message["text"])
+        finally:
+            self.cancel_turn()
+            sender.cancel()
+
+    def handle_text(self, text: str) -> None:
+        """Handle a JSON message of the client."""
+        try:
+            data = json.loads(text)
+            message_type = data.get("type", "message")
+            if message_type == "cancel":
+                self.cancel_turn()
+            elif message_type == "message" and data.get("user_query"):
+                self.start_turn(
+                    user_query=str(data["user_query"]),
+                    message_id=data.get("id")
+                )
+            else:
+                raise ValueError(f"Invalid message type {message_type}.")
+        except Exception as e:
+            logger.error(f"Invalid WebSocket message: {e}")
+            self.send(self._turns, "error", {"msg": "Invalid message."})
+
+    def start_turn(
+        self,
+        user_query: Optional[str] = None,
+        image: Optional[bytes] = None,
+        message_id: Any = None
+    ) -> None:
+        """Start a turn, cancelling the turn in flight."""
+        self.cancel_turn()
+        self._turns += 1
+        self._turn_id = message_id
+        # Sent here, a turn cancelled before its task starts never runs.
+        self.send(self._turns, "accepted", message_id=message_id)
+        self._turn_task = asyncio.create_task(
+            self.run_turn(self._turns, user_query, image, message_id))
+
+    def cancel_turn(self) -> None:
+        """Cancel the turn in flight and its backend calls."""
+        if self._turn_task is None or self._turn_task.done():
+            return
+        self._turn_task.cancel()
+        self._turn_task = None
+        metrics.WEBSOCKET_TURNS.labels(outcome="cancelled").inc()
+        self.send(self._turns, "cancelled", message_id=self._turn_id)
+
+    async def run_turn(
+        self,
+        turn: int,
+        user_query: Optional[str],
+        image: Optional[bytes],
+        message_id: Any = None
+    ) -> None:
+        """Run a turn, streaming its partial results."""
+        def send(event: str, data: Any = None) -> None:
+            self.send(turn, event, data, message_id)
+
+        try:
+            with prefetch.foreground():
+                async with admission.admitted("websocket chat"):
+                    with rate_limit.retry_budget(), \
+                            deadline.deadline_scope(), \
+                            stream.listen(send):
+                        if image is not None:
+                            user_query = await image_query(image)
+                        if user_query is None:
+                            metrics.WEBSOCKET_TURNS.labels(
+                                outcome="error").inc()
+                            send("error", {"msg": "Could not read the image."})
+                            return
+                        result = await multi_turn.MultiTurn(
+                            query=user_query,
+                            history=self.history
+                        ).process()
+        except admission.AdmissionRejected as e:
+            metrics.WEBSOCKET_TURNS.labels(outcome="rejected").inc()
+            send("error", {
+                "msg": "Server busy, please retry.",
+                "retry_after": e.retry_after
+            })
+            return
+        except preprocess.ImageTooLargeError as e:
+            logger.error(f"Image message rejected: {e}")
+            metrics.WEBSOCKET_TURNS.labels(outcome="error").inc()
+            send("error", {"msg": str(e)})
+            return
+        except Exception as e:
+            logger.error(f"Error processing WebSocket turn: {e}")
+            metrics.WEBSOCKET_TURNS.labels(outcome="error").inc()
+            send("error", {"msg": "Error"})
+            return
+        metrics.WEBSOCKET_TURNS.labels(outcome="ok").inc()
+
+        history_entry = {
+            "user_query": user_query,
+            "response": result
+        }
+        state.append_turn(self.history, history_entry)
+        self.last_result = result
+        send("result", result)
+
+        # Prefetch for the likely next message.
+        await prefetch.after_turn(history_entry)
+
+
+async def image_query(data: bytes) -> Optional[str]:
+    """Query of an image message, as for /send-message/image.
+
+    Args:
+        data: Image bytes.
+
+    Returns:
+        Query matching an SME intent, or None if image was unclassified.
+    """
+    processed_image = await preprocess.preprocess_image(data)
+    image_contents = await chat.extract_image_contents(processed_image)
+    return sme_images.build_query(image_contents)
+
+
+@router.websocket("/ws/chat")
+async def chat_socket(websocket: WebSocket, session_id: Optional[str] = None):
+    # With a session id, history is shared with the HTTP chat routes.
+    await websocket.accept()
+    history = state.get_history(session_id) if session_id else []
+    session = ChatSession(websocket, history)
+    metrics.WEBSOCKET_CONNECTIONS.inc()
+    try:
+        await session.serve()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        metrics.WEBSOCKET_CONNECTIONS.dec()
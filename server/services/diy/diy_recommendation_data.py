@@ -6,7 +6,9 @@
 from typing import Any, Dict
 import uuid
 
+from server.common import deadline
 from server.common import gemini
+from server.config.logging import logger
 
 
 class DIYRecommendation:
@@ -19,17 +21,20 @@ class DIYRecommendation:
     def __init__(
         self,
         diy_idea: str,
-        prompt: str
+        prompt: str,
+        stage: str = "diy_metadata"
     ):
         """Init DIY Recommendation metadata generation.
 
         Args:
             diy_idea: string of idea name (recipe name, etc.)
             prompt: Prompt of context of metadata to generate.
+            stage: Pipeline stage name used in metrics.
         """
         self.diy_idea = diy_idea
+        self.stage = stage
 
-        self.model = gemini.GeminiModelManager()
+        self.model = gemini.create_model_manager()
         self.prompt = prompt
 
     async def generate_metadata(self) -> Dict[str, Any]:
@@ -37,15 +42,29 @@ class DIYRecommendation:
 
         Returns dictionary of original idea name
         and additional metadata specified by prompt.
+        Without time left for the metadata, returns the
+        idea without it.
         """
         # Generate DIY
-        result = await self.model.generate_response(
-            contents=self.prompt,
-            temperature=0.3,
-            max_output_tokens=8192,
-            response_mime_type="application/json"
+        result = await deadline.run_with_budget(
+            self.model.generate_response(
+                contents=self.prompt,
+                temperature=0.3,
+                max_output_tokens=8192,
+                response_mime_type="application/json",
+                stage=self.stage
+            ),
+            fallback={},
+            stage=self.stage,
+            reserve=deadline.SUMMARY_RESERVE_SECONDS
         )
 
+        # Response was not valid JSON, e.g. truncated at the token ceiling.
+        if not isinstance(result, dict):
+            logger.error(f"Invalid {self.stage} response for {self.diy_idea}")
+            deadline.mark_degraded(self.stage)
+            result = {}
+
         # Generate unique id for idea.
         result_id = generate_id()
 
@@ -34,8 +34,9 @@ class DIYProductList:
         # For each product needed
         # make product search query to catalog.
         products = await utils.make_parallel_calls(
-            items=self.product_list,
+            items=self.product_list or [],
             async_processing_func=product_search.get_individual_product_type
         )
 
-        return products
+        # Skip products that failed or ran out of time.
+        return [product for product in products if product]
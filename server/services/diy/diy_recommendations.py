@@ -4,6 +4,7 @@
 """DIY Recommendations Module."""
 
 from server.common import gemini
+from server.config.logging import logger
 
 
 class DIYRecommendations:
@@ -16,16 +17,20 @@ class DIYRecommendations:
     def __init__(
         self,
         query: str = None,
-        prompt: str = None
+        prompt: str = None,
+        stage: str = "diy_recommendations"
     ):
         """Init DIY Agent.
 
         Args:
             query: User query to generate DIY ideas / product list for.
+            prompt: Prompt to generate DIY ideas / product list with.
+            stage: Pipeline stage name used in metrics.
         """
         self.query = query
+        self.stage = stage
 
-        self.model = gemini.GeminiModelManager()
+        self.model = gemini.create_model_manager()
         self.prompt = prompt
 
 
@@ -43,6 +48,12 @@ class DIYRecommendations:
             contents=self.prompt,
             temperature=0.5,
             max_output_tokens=8192,
-            response_mime_type="application/json"
+            response_mime_type="application/json",
+            stage=self.stage
         )
+
+        # Response was not valid JSON, e.g. truncated at the token ceiling.
+        if not isinstance(result, dict):
+            logger.error(f"Invalid {self.stage} response for {self.query}")
+            return {}
         return result
@@ -0,0 +1,163 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""Image Query Cache Module."""
+
+import collections
+import os
+import threading
+from typing import Any, Dict, Optional
+
+from PIL import Image
+
+from server.common import metrics
+
+
+# Width and height of the grid compared by the difference hash.
+HASH_SIZE = 8
+
+
+def difference_hash(image: Image.Image) -> int:
+    """Compute a 64 bit perceptual difference hash (dHash) of an image.
+
+    Each bit records whether a pixel is brighter than its right neighbour
+    in a 9x8 grayscale thumbnail, so re-encoded, resized or slightly
+    cropped copies of an image hash to nearby values.
+
+    Args:
+        image: Decoded image.
+
+    Returns:
+        Perceptual hash as an integer.
+    """
+    thumbnail = image.convert("L").resize(
+        (HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS)
+    pixels = list(thumbnail.getdata())
+    image_hash = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + col]
+            right = pixels[row * (HASH_SIZE + 1) + col + 1]
+            image_hash = (image_hash << 1) | int(left > right)
+    return image_hash
+
+
+class ImageQueryCache:
+    """Bounded cache of image extraction results.
+
+    Looks up an image by exact content hash first, then by the
+    closest perceptual hash within a Hamming distance threshold.
+    """
+    def __init__(
+        self,
+        max_entries: int = 512,
+        max_distance: int = 6
+    ):
+        """Init image query cache.
+
+        Args:
+            max_entries: Max images cached before least recently used
+                are evicted.
+            max_distance: Max Hamming distance between perceptual hashes
+                for two images to be considered the same.
+        """
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+
+        # Content hash -> (perceptual hash, extracted contents).
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._exact_hits = 0
+        self._perceptual_hits = 0
+        self._misses = 0
+
+    def get(
+        self,
+        content_hash: str,
+        perceptual_hash: Optional[int] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Get cached contents for an image.
+
+        Args:
+            content_hash: SHA-256 of image bytes.
+            perceptual_hash: Difference hash of image.
+
+        Returns:
+            Cached extracted contents or None.
+        """
+        with self._lock:
+            entry = self._entries.get(content_hash)
+            if entry is not None:
+                self._entries.move_to_end(content_hash)
+                self._exact_hits += 1
+                metrics.CACHE_REQUESTS.labels(
+                    cache="image_query", result="exact_hit").inc()
+                return entry[1]
+
+            if perceptual_hash is not None:
+                best_key, best_distance = None, self.max_distance + 1
+                for key, (other_hash, _) in self._entries.items():
+                    if other_hash is None:
+                        continue
+                    distance = (perceptual_hash ^ other_hash).bit_count()
+                    if distance < best_distance:
+                        best_key, best_distance = key, distance
+                if best_key is not None:
+                    self._entries.move_to_end(best_key)
+                    self._perceptual_hits += 1
+                    metrics.CACHE_REQUESTS.labels(
+                        cache="image_query", result="perceptual_hit").inc()
+                    return self._entries[best_key][1]
+
+            self._misses += 1
+            metrics.CACHE_REQUESTS.labels(
+                cache="image_query", result="miss").inc()
+            return None
+
+    def set(
+        self,
+        content_hash: str,
+        perceptual_hash: Optional[int],
+        contents: Dict[str, Any]
+    ) -> None:
+        """Cache extracted contents for an image.
+
+        Args:
+            content_hash: SHA-256 of image bytes.
+            perceptual_hash: Difference hash of image.
+            contents: Extracted image contents.
+        """
+        with self._lock:
+            self._entries[content_hash] = (perceptual_hash, contents)
+            self._entries.move_to_end(content_hash)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        """Get hit / miss counts of cache."""
+        with self._lock:
+            lookups = self._exact_hits + self._perceptual_hits + self._misses
+            hits = self._exact_hits + self._perceptual_hits
+            return {
+                "entries": len(self._entries),
+                "exact_hits": self._exact_hits,
+                "perceptual_hits": self._perceptual_hits,
+                "misses": self._misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+            }
+
+
+_image_query_cache = None
+_image_query_cache_lock = threading.Lock()
+
+
+def get_image_query_cache() -> ImageQueryCache:
+    """Get the image query cache shared across requests."""
+    global _image_query_cache
+    with _image_query_cache_lock:
+        if _image_query_cache is None:
+            _image_query_cache = ImageQueryCache(
+                max_entries=int(os.getenv("image_cache_max_entries", "512")),
+                max_distance=int(os.getenv("image_cache_max_distance", "6"))
+            )
+        return _image_query_cache
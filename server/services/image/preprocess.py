@@ -0,0 +1,272 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""Image Preprocessing Module."""
+
+import asyncio
+import dataclasses
+import hashlib
+import io
+import os
+import time
+from typing import Optional, Tuple
+
+from fastapi import Request, UploadFile
+from fastapi.responses import JSONResponse
+from PIL import Image, ImageOps
+
+from server.common import metrics
+from server.config.logging import logger
+from server.services.image import image_cache
+
+
+# Size of chunks read from an upload.
+READ_CHUNK_SIZE = 64 * 1024
+
+# Bytes of multipart framing and form fields allowed per upload request.
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+# Upload routes, by max images per request.
+UPLOAD_ROUTES = {
+    "/api/send-message/image": lambda: 1,
+    "/api/send-message/images": lambda: int(
+        os.getenv("image_batch_max_images", "5")),
+}
+
+# Mime types Gemini accepts for images as is.
+SUPPORTED_MIME_TYPES = ("image/jpeg", "image/png", "image/webp")
+
+
+class ImageTooLargeError(Exception):
+    """Upload exceeded the max upload size."""
+
+
+@dataclasses.dataclass
+class PreprocessedImage:
+    """Image ready to send to Gemini.
+
+    Properties:
+        data: Image bytes.
+        mime_type: Mime type of image bytes.
+        original_bytes: Size of uploaded image.
+        original_size: Width and height of uploaded image.
+        size: Width and height of processed image.
+        elapsed_ms: Time spent preprocessing.
+        content_hash: SHA-256 of uploaded image bytes.
+        perceptual_hash: Difference hash of image, None if undecodable.
+    """
+    data: bytes
+    mime_type: str
+    original_bytes: int
+    original_size: Optional[Tuple[int, int]] = None
+    size: Optional[Tuple[int, int]] = None
+    elapsed_ms: float = 0.0
+    content_hash: Optional[str] = None
+    perceptual_hash: Optional[int] = None
+
+    @property
+    def bytes_saved(self) -> int:
+        """Bytes no longer sent per Gemini call."""
+        return self.original_bytes - len(self.data)
+
+
+async def read_upload(upload: UploadFile, max_bytes: int) -> bytes:
+    """Read an upload in chunks, enforcing a size limit.
+
+    Starlette has already received and spooled the upload, so this only
+    bounds what is decoded. Request bodies are limited before parsing by
+    upload_size_middleware.
+
+    Args:
+        upload: Uploaded file.
+        max_bytes: Max bytes to accept.
+
+    Returns:
+        Uploaded bytes.
+
+    Raises:
+        ImageTooLargeError if the upload exceeds max_bytes.
+    """
+    # Reject early when the size is already known.
+    if upload.size is not None and upload.size > max_bytes:
+        raise ImageTooLargeError(
+            f"Image is {upload.size} bytes, max is {max_bytes} bytes.")
+
+    buffer = bytearray()
+    while True:
+        chunk = await upload.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        buffer.extend(chunk)
+        if len(buffer) > max_bytes:
+            raise ImageTooLargeError(
+                f"Image exceeds max size of {max_bytes} bytes.")
+    return bytes(buffer)
+
+
+def downscale_image(
+    data: bytes,
+    mime_type: Optional[str],
+    max_dimension: int,
+    quality: int
+) -> PreprocessedImage:
+    """Downsize and re-encode an image.
+
+    Images larger than max_dimension on their longest side are resized
+    and re-encoded as JPEG. Smaller images are re-encoded only if that
+    makes them smaller. Images that cannot be decoded are passed through.
+
+    Args:
+        data: Image bytes.
+        mime_type: Mime type of upload.
+        max_dimension: Max width or height in pixels.
+        quality: JPEG quality (1-95).
+
+    Returns:
+        Preprocessed image.
+    """
+    start = time.perf_counter()
+    content_hash = hashlib.sha256(data).hexdigest()
+    try:
+        image = Image.open(io.BytesIO(data))
+        original_size = image.size
+
+        # Phone photos store rotation in EXIF, apply it before resizing.
+        image = ImageOps.exif_transpose(image)
+
+        resized = max(image.size) > max_dimension
+        if resized:
+            image.thumbnail(
+                (max_dimension, max_dimension), Image.Resampling.LANCZOS)
+
+        # Hash the decoded image for the image query cache.
+        perceptual_hash = image_cache.difference_hash(image)
+
+        # JPEG has no alpha, flatten transparent screenshots onto white.
+        if image.mode in ("RGBA", "LA", "P"):
+            image = image.convert("RGBA")
+            background = Image.new("RGB", image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel("A"))
+            image = background
+        elif image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+
+        output = io.BytesIO()
+        image.save(output, format="JPEG", quality=quality, optimize=True)
+        encoded = output.getvalue()
+
+        # Keep the original if re-encoding did not help.
+        if (not resized and len(encoded) >= len(data)
+                and mime_type in SUPPORTED_MIME_TYPES):
+            encoded, out_mime_type = data, mime_type
+        else:
+            out_mime_type = "image/jpeg"
+
+        return PreprocessedImage(
+            data=encoded,
+            mime_type=out_mime_type,
+            original_bytes=len(data),
+            original_size=original_size,
+            size=image.size,
+            elapsed_ms=(time.perf_counter() - start) * 1000,
+            content_hash=content_hash,
+            perceptual_hash=perceptual_hash
+        )
+    except Exception as e:
+        logger.warning(f"Could not preprocess image, sending original: {e}")
+        return PreprocessedImage(
+            data=data,
+            mime_type=mime_type,
+            original_bytes=len(data),
+            elapsed_ms=(time.perf_counter() - start) * 1000,
+            content_hash=content_hash
+        )
+
+
+async def preprocess_upload(upload: UploadFile) -> PreprocessedImage:
+    """Read and preprocess an uploaded image.
+
+    Args:
+        upload: Uploaded image.
+
+    Returns:
+        Preprocessed image.
+    """
+    data = await read_upload(upload, max_bytes=max_upload_bytes())
+    return await preprocess_image(data, upload.content_type)
+
+
+def max_upload_bytes() -> int:
+    """Max bytes of an uploaded image."""
+    return int(os.getenv("image_max_upload_bytes", str(10 * 1024**2)))
+
+
+async def preprocess_image(
+    data: bytes,
+    mime_type: Optional[str] = None
+) -> PreprocessedImage:
+    """Preprocess image bytes, e.g. of a WebSocket message.
+
+    Args:
+        data: Image bytes.
+        mime_type: Mime type of image if known, images of other types
+            are re-encoded as JPEG.
+
+    Returns:
+        Preprocessed image.
+
+    Raises:
+        ImageTooLargeError if the image exceeds the max upload size.
+    """
+    max_bytes = max_upload_bytes()
+    if len(data) > max_bytes:
+        raise ImageTooLargeError(
+            f"Image is {len(data)} bytes, max is {max_bytes} bytes.")
+    max_dimension = int(os.getenv("image_max_dimension", "1024"))
+    quality = int(os.getenv("image_jpeg_quality", "85"))
+
+    # Decoding and resizing is CPU bound, keep it off the event loop.
+    with metrics.track_stage("image_preprocess"):
+        processed = await asyncio.to_thread(
+            downscale_image,
+            data,
+            mime_type,
+            max_dimension,
+            quality
+        )
+    metrics.IMAGE_BYTES.labels(kind="original").observe(
+        processed.original_bytes)
+    metrics.IMAGE_BYTES.labels(kind="processed").observe(len(processed.data))
+
+    logger.info(
+        f"Preprocessed image {processed.original_size} -> {processed.size}: "
+        f"{processed.original_bytes} -> {len(processed.data)} bytes "
+        f"({processed.bytes_saved} bytes saved per Gemini call) "
+        f"in {processed.elapsed_ms:.1f} ms"
+    )
+    return processed
+
+
+async def upload_size_middleware(request: Request, call_next):
+    """Reject image uploads over the size limit before they are received.
+
+    Uses the declared Content-Length, so the multipart body is neither
+    read nor spooled. Bodies without a Content-Length (chunked) are
+    still limited per image by read_upload once parsed.
+    """
+    max_images = UPLOAD_ROUTES.get(request.url.path)
+    content_length = request.headers.get("content-length")
+    if max_images is None or not content_length:
+        return await call_next(request)
+
+    max_bytes = (
+        max_upload_bytes() * max_images() + MULTIPART_OVERHEAD_BYTES)
+    if content_length.isdigit() and int(content_length) > max_bytes:
+        logger.error(
+            f"Upload rejected: {content_length} bytes, max is {max_bytes}")
+        return JSONResponse(
+            {"msg": f"Upload is {content_length} bytes, "
+                    f"max is {max_bytes} bytes."},
+            status_code=413
+        )
+    return await call_next(request)
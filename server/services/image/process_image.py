@@ -3,7 +3,7 @@
 # agreement with Google.
 """Process Image Module"""
 
-from typing import Any, Dict, Union
+from typing import Any, Dict, Optional, Union
 
 from server.common import gemini
 
@@ -19,7 +19,7 @@ class ImageProcessor:
         # Image as part.
         self.image_contents = image_contents
 
-        self.model = gemini.GeminiModelManager()
+        self.model = gemini.create_model_manager()
 
     async def classify_image(self, prompt: str) -> str:
         """Classify an image.
@@ -29,6 +29,7 @@ class ImageProcessor:
         """
         result = await self.model.generate_response(
             contents=[self.image_contents, prompt],
+            stage="image_classify"
         )
         return result
 
@@ -45,6 +46,26 @@ class ImageProcessor:
         """
         result = await self.model.generate_response(
             contents=[self.image_contents, prompt],
-            response_mime_type=response_mime_type
+            response_mime_type=response_mime_type,
+            stage="image_extract"
+        )
+        return result
+
+    async def classify_and_extract(
+            self,
+            prompt: str,
+            response_schema: Optional[Dict[str, Any]] = None
+        ) -> Optional[Dict[str, Any]]:
+        """Classify and extract image contents in a single call.
+
+        Args:
+            prompt: Combined classification and extraction prompt.
+            response_schema: JSON schema constraining the response.
+        """
+        result = await self.model.generate_response(
+            contents=[self.image_contents, prompt],
+            response_mime_type="application/json",
+            response_schema=response_schema,
+            stage="image_classify_extract"
         )
         return result
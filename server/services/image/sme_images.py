@@ -3,19 +3,67 @@
 # agreement with Google.
 """SME Images Module"""
 
+import os
+from typing import Any, Dict, List, Optional
+
 from server.common import prompts
+from server.config.logging import logger
+from server.services.image import image_cache
 from server.services.image import process_image
 
 
+# Image types that map to an SME intent.
+IMAGE_TYPES = ("grocery_list", "meal")
+
+# Schema of the single call classification & extraction response.
+IMAGE_CONTENTS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "image_type": {
+            "type": "string",
+            "enum": list(IMAGE_TYPES)
+        },
+        "items": {
+            "type": "array",
+            "items": {"type": "string"}
+        }
+    },
+    "required": ["image_type", "items"]
+}
+
+
 class SMEImages:
     """Process an image for SME."""
     def __init__(
             self,
-            image_contents
+            image_contents,
+            single_call: Optional[bool] = None,
+            content_hash: Optional[str] = None,
+            perceptual_hash: Optional[int] = None
     ):
+        """Init SME image processing.
+
+        Args:
+            image_contents: Image as a Gemini part.
+            single_call: Whether to classify and extract the image in one
+                Gemini call. Falls back to separate calls if the single
+                call fails. Defaults to the image_single_call env variable.
+            content_hash: SHA-256 of image bytes. Enables the image
+                query cache when set.
+            perceptual_hash: Difference hash of image, used to match
+                near duplicate uploads in the image query cache.
+        """
         self.image_processor = process_image.ImageProcessor(
             image_contents=image_contents)
 
+        if single_call is None:
+            single_call = os.getenv(
+                "image_single_call", "true").lower() == "true"
+        self.single_call = single_call
+
+        self.content_hash = content_hash
+        self.perceptual_hash = perceptual_hash
+
     async def process_image(self):
         """Process image.
 
@@ -24,32 +72,184 @@ class SMEImages:
         """
         # TODO (pnallamotu): Handle case if query is none
         # in API route.
-        query = None
+        image_contents = await self.extract_contents()
+        return build_query(image_contents)
+
+    async def extract_contents(self) -> Optional[Dict[str, Any]]:
+        """Classify image and extract its items.
 
+        Returns:
+            Dictionary of image type and extracted items, or None
+            if the image could not be classified.
+                E.g. {
+                        "image_type": "grocery_list",
+                        "items": ["Milk", "Eggs"]
+                    }
+        """
+        if not self.content_hash:
+            return await self._extract_contents()
+
+        # Re-uploads of the same image skip the Gemini calls.
+        cache = image_cache.get_image_query_cache()
+        image_contents = cache.get(self.content_hash, self.perceptual_hash)
+        if image_contents is not None:
+            logger.info(f"Image query cache hit: {cache.stats()}")
+            return image_contents
+
+        image_contents = await self._extract_contents()
+        if image_contents is not None:
+            cache.set(self.content_hash, self.perceptual_hash, image_contents)
+        return image_contents
+
+    async def _extract_contents(self) -> Optional[Dict[str, Any]]:
+        """Extract image contents with Gemini."""
+        if self.single_call:
+            try:
+                image_contents = await self.classify_and_extract()
+                if image_contents:
+                    return image_contents
+                logger.warning(
+                    "Invalid single call image extraction, "
+                    "falling back to classify then extract."
+                )
+            except Exception as e:
+                logger.warning(
+                    f"Error in single call image extraction, "
+                    f"falling back to classify then extract: {e}"
+                )
+        return await self.classify_then_extract()
+
+    async def classify_and_extract(self) -> Optional[Dict[str, Any]]:
+        """Classify and extract image in one schema constrained call."""
+        result = await self.image_processor.classify_and_extract(
+            prompt=prompts.image_classify_and_extract_prompt,
+            response_schema=IMAGE_CONTENTS_SCHEMA
+        )
+        return validate_image_contents(result)
+
+    async def classify_then_extract(self) -> Optional[Dict[str, Any]]:
+        """Classify image, then extract it with a type specific prompt."""
         # First classify image.
         image_type = await self.classify_image_type()
         if image_type == "grocery_list":
             # Prompt to extract image grocery list.
             prompt = prompts.image_grocery_list_prompt
-            grocery_list = await self.image_processor.extract_image_contents(
-                prompt)
-
-            # Convert extracted contents to query.
-            # Static query to fit to product recommendations intent.
-            query = f"I want recommendations for: {', '.join(grocery_list)}"
         elif image_type == "meal":
             # Prompt to extract image recipe name.
             prompt = prompts.image_recipe_prompt
-            recipe_name = await self.image_processor.extract_image_contents(
-                prompt)
+        else:
+            return None
 
-            # Convert extracted contents to query.
-            # Static query to fit to recipe recommendations intent.
-            query = f"I want these recipes:  {', '.join(recipe_name)}"
-
-        return query
+        items = await self.image_processor.extract_image_contents(prompt)
+        # Validated like single call results, so items are strings.
+        return validate_image_contents({
+            "image_type": image_type,
+            "items": items
+        })
 
     async def classify_image_type(self):
         """Classify whether image is recipe or grocery list."""
         prompt = prompts.image_classification_prompt
         return await self.image_processor.classify_image(prompt)
+
+
+def validate_image_contents(result: Any) -> Optional[Dict[str, Any]]:
+    """Validate an extraction result.
+
+    Args:
+        result: Parsed JSON response of extraction.
+
+    Returns:
+        Image type and items, or None if the result is invalid.
+    """
+    if not isinstance(result, dict):
+        return None
+    image_type = result.get("image_type")
+    items = result.get("items")
+    if image_type not in IMAGE_TYPES or not isinstance(items, list):
+        return None
+    return {
+        "image_type": image_type,
+        "items": [str(item) for item in items]
+    }
+
+
+def build_query(image_contents: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Convert extracted image contents to a query.
+
+    Args:
+        image_contents: Image type and extracted items.
+
+    Returns:
+        Query matching an SME intent, or None if image was unclassified.
+    """
+    if not image_contents:
+        return None
+
+    items: List[str] = image_contents.get("items") or []
+    if image_contents.get("image_type") == "grocery_list":
+        # Static query to fit to product recommendations intent.
+        return f"I want recommendations for: {', '.join(items)}"
+    elif image_contents.get("image_type") == "meal":
+        # Static query to fit to recipe recommendations intent.
+        return f"I want these recipes:  {', '.join(items)}"
+    return None
+
+
+def merge_image_contents(
+    image_contents_list: List[Optional[Dict[str, Any]]]
+) -> Dict[str, List[str]]:
+    """Merge extracted contents of several images.
+
+    Items are deduplicated case-insensitively, keeping the
+    first spelling seen.
+
+    Args:
+        image_contents_list: Extracted contents of each image. Images
+            that could not be classified are None.
+
+    Returns:
+        Dictionary of deduplicated items per image type.
+            E.g. {
+                    "grocery_list": ["Milk", "Eggs", "Bread"],
+                    "meal": ["Lasagna"]
+                }
+    """
+    merged = {image_type: [] for image_type in IMAGE_TYPES}
+    seen = {image_type: set() for image_type in IMAGE_TYPES}
+    for image_contents in image_contents_list:
+        if not image_contents:
+            continue
+        image_type = image_contents.get("image_type")
+        for item in image_contents.get("items") or []:
+            key = " ".join(item.split()).casefold()
+            if key and key not in seen[image_type]:
+                seen[image_type].add(key)
+                merged[image_type].append(item.strip())
+    return merged
+
+
+def build_merged_query(merged_contents: Dict[str, List[str]]) -> Optional[str]:
+    """Convert merged contents of several images to a single query.
+
+    Args:
+        merged_contents: Deduplicated items per image type.
+
+    Returns:
+        Query matching an SME intent, or None if no image was classified.
+    """
+    grocery_list = merged_contents.get("grocery_list")
+    recipe_names = merged_contents.get("meal")
+    if recipe_names and grocery_list:
+        # Static query to fit to recipe recommendations intent,
+        # grounded on the grocery items in the other images.
+        return (
+            f"I want these recipes:  {', '.join(recipe_names)}. "
+            f"I have these ingredients: {', '.join(grocery_list)}"
+        )
+    elif recipe_names:
+        return build_query({"image_type": "meal", "items": recipe_names})
+    elif grocery_list:
+        return build_query(
+            {"image_type": "grocery_list", "items": grocery_list})
+    return None
@@ -0,0 +1,208 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""Prefetch Module.
+
+Speculative work after a turn is answered, for the likely next request:
+    - The compact history digest used by follow up prompts.
+    - Product searches of each recipe's ingredients, which saving a
+      recipe runs again (SavedRecipes.add_saved_recipe).
+
+Prefetching is optional (prefetch_enabled env variable) and bounded by a
+global budget: a few concurrent searches, a cap on queued work that is
+dropped beyond it, and waiting while foreground requests are in flight
+so it never competes with them for backend quota.
+"""
+
+import contextlib
+import contextvars
+import os
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+import asyncio
+from fastapi import Request
+
+from server.common import deadline
+from server.common import metrics
+from server.common import rate_limit
+from server.common import scheduler
+from server.config.logging import logger
+from server.services.products import product_search
+from server.turns import history as chat_history
+
+
+# Foreground requests in flight, counted by foreground_middleware.
+_foreground_requests = 0
+
+
+class Prefetcher:
+    """Runs prefetch work in the background under a global budget."""
+    def __init__(
+        self,
+        concurrency: int = 2,
+        max_pending: int = 100,
+        max_foreground: int = 2,
+        item_deadline: float = 10.0
+    ):
+        """Init prefetcher.
+
+        Args:
+            concurrency: Max prefetch searches at a time.
+            max_pending: Max queued searches, more are dropped.
+            max_foreground: Searches wait while more foreground requests
+                than this are in flight.
+            item_deadline: Seconds a search may wait for foreground
+                requests, then seconds it may run.
+        """
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.max_foreground = max_foreground
+        self.item_deadline = item_deadline
+        self._semaphore = None
+        self._pending = 0
+        self._tasks = set()
+
+    def after_turn(self, entry: Dict[str, Any]) -> None:
+        """Schedule prefetching for a turn just answered.
+
+        Args:
+            entry: History turn with user_query and response.
+        """
+        chat_history.get_digest(entry)
+
+        response = entry.get("response") or {}
+        ingredients = []
+        for recipe in response.get("recipes") or []:
+            if recipe:
+                ingredients.extend(recipe.get("ingredients") or [])
+        self.warm_product_searches(ingredients)
+
+    def warm_product_searches(self, queries: List[str]) -> int:
+        """Schedule product searches to fill the search caches.
+
+        Args:
+            queries: Product search queries, e.g. recipe ingredients.
+
+        Returns:
+            Number of searches scheduled, the rest were over budget.
+        """
+        scheduled = 0
+        for query in dict.fromkeys(q for q in queries if q):
+            if self._pending >= self.max_pending:
+                metrics.PREFETCH_ITEMS.labels(
+                    kind="product_search", outcome="dropped").inc()
+                continue
+            self._pending += 1
+            self._spawn(self._warm(query))
+            scheduled += 1
+        return scheduled
+
+    def _spawn(self, coro) -> None:
+        # Run outside the request context, so prefetching neither uses
+        # nor degrades the deadline and retry budget of the request.
+        task = contextvars.Context().run(asyncio.ensure_future, coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _warm(self, query: str) -> None:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        outcome = "error"
+        try:
+            async with self._semaphore:
+                if not await self._wait_for_idle(self.item_deadline):
+                    outcome = "skipped"
+                    return
+                with deadline.deadline_scope(self.item_deadline), \
+                        rate_limit.retry_budget(), \
+                        scheduler.priority(scheduler.PREFETCH):
+                    result = await product_search.get_individual_product_type(
+                        query)
+                outcome = "ok" if result else "error"
+        except Exception as e:
+            logger.error(f"Error prefetching product search {query}: {e}")
+        finally:
+            self._pending -= 1
+            metrics.PREFETCH_ITEMS.labels(
+                kind="product_search", outcome=outcome).inc()
+
+    async def _wait_for_idle(self, max_wait: float) -> bool:
+        """Wait until foreground load is low, False after max_wait."""
+        start = time.monotonic()
+        while _foreground_requests > self.max_foreground:
+            if time.monotonic() - start >= max_wait:
+                return False
+            await asyncio.sleep(0.05)
+        return True
+
+    async def drain(self, timeout: Optional[float] = None) -> None:
+        """Wait for scheduled prefetching, e.g. before shutdown.
+
+        Args:
+            timeout: Max seconds to wait.
+        """
+        start = time.monotonic()
+        while self._tasks:
+            if timeout is not None and time.monotonic() - start >= timeout:
+                return
+            await asyncio.wait(set(self._tasks), timeout=0.1)
+
+
+_prefetcher = None
+
+
+def get_prefetcher() -> Optional[Prefetcher]:
+    """Prefetcher of this process.
+
+    Returns:
+        Prefetcher, or None unless prefetch_enabled is true.
+    """
+    global _prefetcher
+    if os.getenv("prefetch_enabled", "false").lower() != "true":
+        return None
+    if _prefetcher is None:
+        _prefetcher = Prefetcher(
+            concurrency=int(os.getenv("prefetch_concurrency", "2")),
+            max_pending=int(os.getenv("prefetch_max_pending", "100")),
+            max_foreground=int(os.getenv("prefetch_max_foreground", "2")),
+            item_deadline=float(os.getenv("prefetch_deadline", "10"))
+        )
+    return _prefetcher
+
+
+async def after_turn(entry: Dict[str, Any]) -> None:
+    """Prefetch for a turn just answered, if prefetching is enabled.
+
+    Added as a background task of chat routes, so it runs after the
+    response is sent.
+
+    Args:
+        entry: History turn with user_query and response.
+    """
+    prefetcher = get_prefetcher()
+    if prefetcher is None:
+        return
+    try:
+        prefetcher.after_turn(entry)
+    except Exception as e:
+        logger.error(f"Error scheduling prefetch: {e}")
+
+
+@contextlib.contextmanager
+def foreground() -> Iterator[None]:
+    """Count foreground work in flight, prefetching waits on it."""
+    global _foreground_requests
+    _foreground_requests += 1
+    try:
+        yield
+    finally:
+        _foreground_requests -= 1
+
+
+async def foreground_middleware(request: Request, call_next):
+    """Count API requests in flight, prefetching waits on them."""
+    if not request.url.path.startswith("/api/"):
+        return await call_next(request)
+    with foreground():
+        return await call_next(request)
@@ -3,7 +3,7 @@
 # agreement with Google.
 """Product Recommendations Module."""
 
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, List, Optional
 
 from server.common import gemini
 from server.common import prompts
@@ -13,16 +13,24 @@ from server.services.products import product_search
 
 class ProductRecommendations:
     """Generate product recommendations."""
-    def __init__(self, query):
+    def __init__(
+        self,
+        query,
+        on_names: Optional[Callable[[List[str], List[str]], None]] = None
+    ):
         """Init products recommendations agent
 
         Args:
             query: User query to get product recs for.
+            on_names: Called with the product types and no recipe names
+                once generated, before the product searches, e.g. to
+                start summarizing early.
         """
         self.query = query
+        self.on_names = on_names
 
         # Init product model with system context.
-        self.model = gemini.GeminiModelManager(
+        self.model = gemini.create_model_manager(
             system_prompt=prompts.product_recommendations_system_context
         )
 
@@ -38,14 +46,20 @@ class ProductRecommendations:
         # List of categories or product types to search for
         # based on user query.
         product_recs_generated = await self.get_product_types_from_query()
+        if self.on_names and product_recs_generated:
+            self.on_names(product_recs_generated, [])
 
         # For each product type recommended
         # make product search query to catalog.
         product_recommendations = await utils.make_parallel_calls(
-            items=product_recs_generated,
+            items=product_recs_generated or [],
             async_processing_func=product_search.get_individual_product_type
         )
-        return product_recommendations
+
+        # Skip product types that failed or ran out of time.
+        return [
+            products for products in product_recommendations if products
+        ]
 
     async def get_product_types_from_query(self) -> List[str]:
         """Generate list of product types from query.
@@ -67,7 +81,8 @@ class ProductRecommendations:
             contents=prompt,
             max_output_tokens=1000,
             temperature=0.2,
-            response_mime_type="application/json"
+            response_mime_type="application/json",
+            stage="product_types"
         )
 
         return product_types
@@ -3,15 +3,29 @@
 # agreement with Google.
 """Product Search Module."""
 
+import copy
+import os
 import re
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
+from server.common import admission
+from server.common import cache
+from server.common import circuit_breaker
+from server.common import deadline
 from server.common import gemini
+from server.common import metrics
 from server.common import prompts
+from server.common import single_flight
+from server.common import stream
 from server.config.logging import logger
+from server.functions import local_catalog
 from server.functions import vertex_search
 
 
+# Products per search.
+PAGE_SIZE = 10
+
+
 class ProductSearch:
     """Module for product search."""
     def __init__(self, query: str):
@@ -23,10 +37,27 @@ class ProductSearch:
         self.query = query
 
         # Vertex search manager to search datastore.
-        self.vertex_search_client = vertex_search.VertexSearchManager()
+        self.vertex_search_client = vertex_search.create_search_manager()
 
         # Gemini instance to generate category / title.
-        self.model = gemini.GeminiModelManager()
+        self.model = gemini.create_model_manager()
+
+        # Generated titles by query, reused for repeated searches and
+        # served when Gemini is unavailable.
+        self.title_cache = cache.get_cache(
+            name="product_title",
+            max_entries=int(os.getenv("product_title_cache_entries", "4096")),
+            ttl=float(os.getenv("product_title_cache_ttl", "86400"))
+        )
+
+        # Vertex Search results by normalized query, e.g. warmed by the
+        # prefetcher for ingredients of recipes that may be saved.
+        self.search_cache = cache.get_cache(
+            name="product_search",
+            max_entries=int(
+                os.getenv("product_search_cache_entries", "4096")),
+            ttl=float(os.getenv("product_search_cache_ttl", "900"))
+        )
 
     async def get_products(
         self,
@@ -44,19 +75,32 @@ class ProductSearch:
         """
         try:
             # Get products from catalog.
-            product_recommendations = self.search_product_catalog(self.query)
-
-            # Generate title for products.
-            title = await self.generate_products_title(
-                products=product_recommendations)
-            return {
+            product_recommendations = await self.search_product_catalog(
+                self.query)
+
+            # Generate title for products, defaulting to a cached
+            # title or the query. Leave time for summarizing the result.
+            cached_title = await self.title_cache.aget(self.query.lower())
+            title = cached_title or self.query.title()
+            if product_recommendations and not cached_title:
+                title = await deadline.run_with_budget(
+                    self.generate_products_title(
+                        products=product_recommendations),
+                    fallback=title,
+                    stage="product_title",
+                    fraction=0.5,
+                    reserve=deadline.SUMMARY_RESERVE_SECONDS
+                )
+            result = {
                 "title": title,
                 "product_names": product_recommendations
             }
+            stream.emit("products", result)
+            return result
         except Exception as e:
             logger.error(f"Error searching for products: {e}")
 
-    def search_product_catalog(
+    async def search_product_catalog(
         self,
         query: str
     ) -> List[Dict[str, Any]]:
@@ -68,10 +112,57 @@ class ProductSearch:
         # TODO: update this function if want to use
         # another database to query products from.
         # This currently uses vertex search with a website datastore.
-        matched_products = self.vertex_search_client.search(query)
+        key = " ".join(query.lower().split())
+        cached = await self.search_cache.aget(key)
+        if cached is not None:
+            return copy.deepcopy(cached)
+
+        # Overloaded, ask for fewer products.
+        page_size = admission.product_page_size(PAGE_SIZE)
+        if page_size < PAGE_SIZE:
+            deadline.mark_degraded("product_page_size")
+        try:
+            # Identical concurrent searches share one request.
+            return await single_flight.get_group("product_search").do(
+                (key, page_size),
+                lambda: self.search_vertex(query, page_size)
+            )
+        except Exception as e:
+            # Fail over to products seen in earlier searches.
+            products = local_catalog.get_catalog().search(query)
+            if not products:
+                raise
+            logger.warning(
+                f"Vertex Search unavailable, {len(products)} local "
+                f"catalog products for {query}: {e}"
+            )
+            metrics.FALLBACKS.labels(fallback="local_catalog").inc()
+            deadline.mark_degraded("vertex_search")
+            return products
+
+    async def search_vertex(
+        self,
+        query: str,
+        page_size: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """Search Vertex Search through its circuit breaker.
+
+        Args:
+            query: Query to search against datastore.
+            page_size: Max products, defaults to PAGE_SIZE. Only full
+                pages are cached.
+        """
+        page_size = page_size or PAGE_SIZE
+        with circuit_breaker.get_breaker("vertex_search").guard():
+            matched_products = await self.vertex_search_client.search(
+                query, page_size=page_size)
 
         # TODO: Update for a new customer.
         products = parse_es_result(response=matched_products)
+        local_catalog.get_catalog().add(products)
+        if products and page_size == PAGE_SIZE:
+            await self.search_cache.aset(
+                " ".join(query.lower().split()), copy.deepcopy(products))
         return products
 
     async def generate_products_title(
@@ -101,8 +192,11 @@ class ProductSearch:
         title = await self.model.generate_response(
             contents=prompt,
             temperature=0.2,
-            max_output_tokens=30
+            max_output_tokens=30,
+            stage="product_title"
         )
+        if title:
+            await self.title_cache.aset(self.query.lower(), title)
         return title
 
 
@@ -110,12 +204,18 @@ async def get_individual_product_type(product_type) -> Dict[str, Any]:
     """Used for parallelization.
 
     Product search for a product type / category.
+    Returns None when out of time, callers skip it.
 
     Args:
         product_type: Query to send to Vertex search.
     """
     search = ProductSearch(query=product_type)
-    return await search.get_products()
+    return await deadline.run_with_budget(
+        search.get_products(),
+        fallback=None,
+        stage="product_search",
+        reserve=deadline.SUMMARY_RESERVE_SECONDS
+    )
 
 
 def parse_es_result(response) -> List[Dict[str, Any]]:
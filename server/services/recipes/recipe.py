@@ -3,9 +3,16 @@
 # agreement with Google.
 """Recipe Module."""
 
+import copy
+import hashlib
+import os
 from typing import Any, Dict, List
 
+from server.common import admission
+from server.common import cache
+from server.common import deadline
 from server.common import prompts
+from server.common import stream
 from server.services.diy import diy_recommendation_data
 
 
@@ -32,15 +39,72 @@ class Recipe:
         self.recipe = recipe
         self.product_list = product_list
 
+        # Metadata by recipe name and the grocery list it is grounded on.
+        self.cache = cache.get_cache(
+            name="recipe_metadata",
+            max_entries=int(
+                os.getenv("recipe_metadata_cache_entries", "2048")),
+            ttl=float(os.getenv("recipe_metadata_cache_ttl", "86400"))
+        )
+
     async def get_recipe_data(self) -> Dict[str, Any]:
         """Get metadata for recipe."""
-        prompt = prompts.recipe_data_prompt.format(
+        # Overloaded, skip generating nutritional information.
+        lite = admission.is_shed(admission.RECIPE_NUTRITION)
+        prompt_template = prompts.recipe_data_prompt
+        if lite:
+            prompt_template = prompts.recipe_data_lite_prompt
+            deadline.mark_degraded("recipe_nutrition")
+
+        key = cache_key(self.recipe, self.product_list, lite)
+        cached = await self.cache.aget(key)
+        if cached is not None:
+            # Each recipe result has its own id.
+            recipe_data = copy.deepcopy(cached)
+            recipe_data.update({
+                "name": self.recipe,
+                "id": diy_recommendation_data.generate_id()
+            })
+            stream.emit("recipe", recipe_data)
+            return recipe_data
+
+        prompt = prompt_template.format(
             recipe=self.recipe,
             product_list=self.product_list
         )
         diy_rec_data_generator = diy_recommendation_data.DIYRecommendation(
             diy_idea=self.recipe,
-            prompt=prompt
+            prompt=prompt,
+            stage="recipe_metadata"
         )
         recipe_data = await diy_rec_data_generator.generate_metadata()
+
+        # Results without metadata, e.g. out of time, are not cached.
+        if recipe_data.get("ingredients"):
+            await self.cache.aset(key, copy.deepcopy(recipe_data))
+        stream.emit("recipe", recipe_data)
         return recipe_data
+
+
+def cache_key(
+    recipe: str,
+    product_list: List[str],
+    lite: bool = False
+) -> str:
+    """Recipe metadata cache key of a recipe name and its product list.
+
+    Ingredients are grounded on the product list, metadata generated for
+    another list may name products that are not in it.
+
+    Args:
+        recipe: Recipe name.
+        product_list: Product list the ingredients are grounded on.
+        lite: Metadata without nutritional information.
+    """
+    name = " ".join(recipe.lower().split())
+    products = sorted({
+        " ".join(str(product).lower().split()) for product in product_list})
+    digest = hashlib.sha256(
+        "\x1f".join(products).encode("utf-8")).hexdigest()[:16]
+    key = f"{name}|{digest}"
+    return f"{key}|lite" if lite else key
@@ -3,11 +3,11 @@
 # agreement with Google.
 """Recipe Recommendations Module."""
 
-from concurrent.futures import ThreadPoolExecutor
-from typing import Any, List, Dict, Tuple
+from typing import Any, Callable, List, Dict, Optional, Tuple
 
 import asyncio
 
+from server.common import deadline
 from server.common import prompts
 from server.services.diy import diy_recommendations
 from server.services.diy import diy_recommendation_product_list
@@ -18,14 +18,19 @@ class RecipeRecommendations:
     """Generate Recipes."""
     def __init__(
         self,
-        query: str = None
+        query: str = None,
+        on_names: Optional[Callable[[List[str], List[str]], None]] = None
     ):
         """Init Recipe Recommendation agent.
 
         Args:
             query: User query to generate recipes/meal plans for.
+            on_names: Called with the grocery list and recipe names once
+                generated, before the recipe metadata and product
+                searches, e.g. to start summarizing early.
         """
         self.query = query
+        self.on_names = on_names
 
     async def get_recommendations(self):
         """Get recipe recommendations.
@@ -37,36 +42,22 @@ class RecipeRecommendations:
         """
         # Get recommended recipes & grocery list.
         recipe_names, product_list =  await self.get_recipe_recommendations()
+        if self.on_names and recipe_names:
+            self.on_names(product_list or [], recipe_names)
         recipes, products = await self.run_in_parallel(
             recipe_names, product_list)
         return recipes, products
 
     async def run_in_parallel(self, recipe_names, product_list):
         """Run Recipe & Product in parallel."""
-        with ThreadPoolExecutor(max_workers=4) as executor:
-            loop = asyncio.get_running_loop()
-
-            def get_recipes_data_sync():
-                return asyncio.run_coroutine_threadsafe(
-                    self.get_recipes_data(
-                        recipe_names=recipe_names,
-                        product_list=product_list
-                    ),
-                    loop
-                ).result()
-
-            def get_products_sync():
-                return asyncio.run_coroutine_threadsafe(
-                    diy_recommendation_product_list.DIYProductList(
-                        product_list=product_list).get_products(),
-                    loop
-                ).result()
-
-            recipes_task = loop.run_in_executor(executor, get_recipes_data_sync)
-            products_task = loop.run_in_executor(executor, get_products_sync)
-
-            recipes, products = await asyncio.gather(
-                recipes_task, products_task)
+        recipes, products = await asyncio.gather(
+            self.get_recipes_data(
+                recipe_names=recipe_names,
+                product_list=product_list
+            ),
+            diy_recommendation_product_list.DIYProductList(
+                product_list=product_list).get_products()
+        )
         return recipes, products
 
     async def get_recipes_data(
@@ -87,36 +78,14 @@ class RecipeRecommendations:
         Returns:
             List of recipe dictionaries with metadata.
         """
-        recipes = []
-        with ThreadPoolExecutor(max_workers=4) as executor:
-            def run_async_get_recipe_data(recipe_name, product_list):
-                async def _get_recipe_data():
-                    recipe_data = recipe.Recipe(
-                        recipe=recipe_name,
-                        product_list=product_list
-                    )
-                    return await recipe_data.get_recipe_data()
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                result = loop.run_until_complete(_get_recipe_data())
-                loop.close()
-                return result
-
-            loop = asyncio.get_running_loop()
-            tasks = [
-                loop.run_in_executor(
-                    executor,
-                    run_async_get_recipe_data,
-                    recipe_name,
-                    product_list
-                )
-                for recipe_name in recipe_names
-            ]
-
-            results = await asyncio.gather(*tasks)
-            recipes.extend(results)
-
-        return recipes
+        recipes = await asyncio.gather(*[
+            recipe.Recipe(
+                recipe=recipe_name,
+                product_list=product_list
+            ).get_recipe_data()
+            for recipe_name in recipe_names
+        ])
+        return list(recipes)
 
     async def get_recipe_recommendations(self) -> Tuple[List[str], List[str]]:
         """Get recipe and grocery list recommendation.
@@ -132,11 +101,19 @@ class RecipeRecommendations:
         # Agent to generate recipes or meal plan.
         diy_agent = diy_recommendations.DIYRecommendations(
             query=self.query,
-            prompt=prompt
+            prompt=prompt,
+            stage="recipe_recommendations"
+        )
+        # Out of time, no recipes, leaving time for the summary.
+        result = await deadline.run_with_budget(
+            diy_agent.get_recommendations(),
+            fallback={},
+            stage="recipe_recommendations",
+            fraction=0.6,
+            reserve=deadline.SUMMARY_RESERVE_SECONDS
         )
-        result = await diy_agent.get_recommendations()
 
-        recipe_names = result.get("diy_ideas")
-        grocery_list = result.get("product_list")
+        recipe_names = result.get("diy_ideas") or []
+        grocery_list = result.get("product_list") or []
 
         return (recipe_names, grocery_list)
@@ -3,9 +3,12 @@
 # agreement with Google.
 """Save recipes Module."""
 
+import json
 import os
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 
+from server.common import cache
+from server.common import scheduler
 from server.common import utils
 from server.functions import datastore
 from server.services.products import product_search
@@ -28,14 +31,71 @@ class SavedRecipes:
         self.recipes_datastore_id = recipes_datastore_id or os.getenv(
             "recipes_datastore_id")
 
-        self.datastore_manager = datastore.DataStoreManager(
-            project_id=self.project_id, datastore_id=self.recipes_datastore_id)
+        # Created on first datastore call so cached reads
+        # do not pay for client initialization.
+        self._datastore_manager = None
 
-    def get_saved_recipes(self):
-        """Get saved recipes."""
-        return self.datastore_manager.get_saved_elements(
-            kind="Recipe"
+        # Saved recipes change rarely relative to reads, so the
+        # serialized list is cached and invalidated on every write.
+        self.cache = cache.get_cache(
+            name="saved_recipes",
+            max_entries=16,
+            ttl=float(os.getenv("saved_recipes_cache_ttl", "300"))
         )
+        self.cache_key = f"{self.project_id}/{self.recipes_datastore_id}"
+
+    @property
+    def datastore_manager(self) -> datastore.DataStoreManager:
+        """Datastore manager of saved recipes DB."""
+        if self._datastore_manager is None:
+            self._datastore_manager = datastore.create_datastore_manager(
+                project_id=self.project_id,
+                datastore_id=self.recipes_datastore_id
+            )
+        return self._datastore_manager
+
+    async def get_saved_recipes(self) -> List[Dict[str, Any]]:
+        """Get saved recipes."""
+        return (await self.get_cached_saved_recipes())["recipes"]
+
+    async def get_cached_saved_recipes(self) -> Dict[str, Any]:
+        """Get saved recipes through the read-through cache.
+
+        Returns:
+            Dictionary of saved recipes, the serialized JSON body
+            and its ETag.
+                E.g. {
+                        "recipes": [{recipe_1_entity}],
+                        "body": b'[...]',
+                        "etag": '"3f2a..."'
+                    }
+        """
+        cached = await self.cache.aget(self.cache_key)
+        if cached is None:
+            recipes = self.datastore_manager.get_saved_elements(
+                kind="Recipe"
+            )
+
+            # Serialize once, the same way JSONResponse renders content.
+            body = json.dumps(
+                recipes,
+                ensure_ascii=False,
+                allow_nan=False,
+                indent=None,
+                separators=(",", ":"),
+            ).encode("utf-8")
+
+            cached = {
+                "recipes": recipes,
+                "body": body,
+                "etag": utils.make_etag(body)
+            }
+            await self.cache.aset(self.cache_key, cached)
+        return cached
+
+    async def invalidate_cache(self) -> None:
+        """Invalidate cached saved recipes after a write."""
+        await self.cache.adelete(self.cache_key)
 
     async def add_saved_recipe(self, recipe: Dict[str, Any]):
         """Save a recipe."""
@@ -43,10 +103,12 @@ class SavedRecipes:
         # from it's ingredients.
         ingredients = recipe.get("ingredients")
 
-        recipe_products = await utils.make_parallel_calls(
-            items=ingredients,
-            async_processing_func=product_search.get_individual_product_type
-        )
+        # Enrichment of a saved recipe yields to live chat turns.
+        with scheduler.priority(scheduler.BACKGROUND):
+            recipe_products = await utils.make_parallel_calls(
+                items=ingredients,
+                async_processing_func=product_search.get_individual_product_type  # pylint: disable=line-too-long
+            )
 
         # Update recipe with grocery list.
         recipe.update({
@@ -60,10 +122,12 @@ class SavedRecipes:
             elem_key="recipe",
             element=recipe
         )
+        await self.invalidate_cache()
 
-    def unsave_recipe(self, recipe_id: int):
+    async def unsave_recipe(self, recipe_id: int):
         """Unsave a recipe."""
         self.datastore_manager.delete_element(
             element_id=recipe_id,
             kind="Recipe"
         )
+        await self.invalidate_cache()
@@ -0,0 +1,272 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""Semantic Turn Cache Module.
+
+Caches turn results by intent and query embedding, so near-duplicate
+queries (e.g. "easy pasta recipes" and "simple pasta recipe ideas")
+reuse a recent result instead of running the whole pipeline.
+
+Only intents where a near-duplicate answer is acceptable are cached, by
+default recipe ideas. Product searches are not: "red apples" and "green
+apples" embed close together but want different products.
+"""
+
+import copy
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import asyncio
+import numpy as np
+
+from server.common import metrics
+from server.config.logging import logger
+from server.services.diy import diy_recommendation_data
+
+
+class SemanticCache:
+    """Bounded cache of turn results looked up by cosine similarity.
+
+    Each intent keeps a ring buffer of normalized query embeddings, so a
+    lookup is a single matrix-vector product over recent entries.
+    """
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        threshold: float = 0.92,
+        ttl: float = 600.0,
+        intents: Iterable[str] = ("recipes",),
+        thresholds: Optional[Dict[str, float]] = None
+    ):
+        """Init semantic cache.
+
+        Args:
+            max_entries: Max results kept per intent, oldest replaced.
+            threshold: Min cosine similarity of a hit.
+            ttl: Seconds a result is valid for.
+            intents: Intents whose results are cached.
+            thresholds: Min cosine similarity of a hit by intent,
+                defaults to threshold.
+        """
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl = ttl
+        self.intents = frozenset(intents)
+        self.thresholds = thresholds or {}
+
+        # Intent -> ring buffer of embeddings, expiry times and entries.
+        self._intents: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._seconds_saved = 0.0
+
+    def _buffer(self, intent: str, dim: int) -> Dict[str, Any]:
+        buffer = self._intents.get(intent)
+        if buffer is None or buffer["embeddings"].shape[1] != dim:
+            buffer = {
+                "embeddings": np.zeros(
+                    (self.max_entries, dim), dtype=np.float32),
+                "expires_at": np.zeros(self.max_entries),
+                "entries": [None] * self.max_entries,
+                "next": 0,
+            }
+            self._intents[intent] = buffer
+        return buffer
+
+    def caches(self, intent: Optional[str]) -> bool:
+        """Whether results of an intent are cached."""
+        return intent in self.intents
+
+    def get(
+        self,
+        intent: str,
+        embedding: List[float]
+    ) -> Optional[Dict[str, Any]]:
+        """Get the most similar recent result of an intent.
+
+        Args:
+            intent: Intent of query.
+            embedding: Query embedding.
+
+        Returns:
+            Cached entry with result, query, similarity and the seconds
+            the original turn took, or None.
+        """
+        vector = normalize(embedding)
+        with self._lock:
+            buffer = self._intents.get(intent)
+            if buffer is not None and buffer["embeddings"].shape[1] == len(
+                    vector):
+                similarities = buffer["embeddings"] @ vector
+                # Expired and empty slots never match.
+                similarities[buffer["expires_at"] <= time.time()] = -1.0
+                best = int(np.argmax(similarities))
+                similarity = float(similarities[best])
+                if similarity >= self.thresholds.get(intent, self.threshold):
+                    entry = buffer["entries"][best]
+                    self._hits += 1
+                    self._seconds_saved += entry["elapsed"]
+                    metrics.CACHE_REQUESTS.labels(
+                        cache="semantic_turn", result="hit").inc()
+                    metrics.SEMANTIC_CACHE_SECONDS_SAVED.inc(entry["elapsed"])
+                    return {**entry, "similarity": similarity}
+            self._misses += 1
+            metrics.CACHE_REQUESTS.labels(
+                cache="semantic_turn", result="miss").inc()
+            return None
+
+    def set(
+        self,
+        intent: str,
+        query: str,
+        embedding: List[float],
+        result: Dict[str, Any],
+        elapsed: float
+    ) -> None:
+        """Cache a turn result.
+
+        Args:
+            intent: Intent of query.
+            query: User query.
+            embedding: Query embedding.
+            result: Turn result.
+            elapsed: Seconds the turn took.
+        """
+        vector = normalize(embedding)
+        with self._lock:
+            buffer = self._buffer(intent, len(vector))
+            slot = buffer["next"]
+            buffer["embeddings"][slot] = vector
+            buffer["expires_at"][slot] = time.time() + self.ttl
+            buffer["entries"][slot] = {
+                "query": query,
+                "result": copy.deepcopy(result),
+                "elapsed": elapsed,
+            }
+            buffer["next"] = (slot + 1) % self.max_entries
+
+    def stats(self) -> Dict[str, Any]:
+        """Get hit rate and latency saved."""
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "seconds_saved": self._seconds_saved,
+            }
+
+
+def normalize(embedding: List[float]) -> np.ndarray:
+    """Unit length float32 vector of an embedding."""
+    vector = np.asarray(embedding, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+def refresh_ids(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy of a cached result with new recipe ids.
+
+    Recipe ids identify saved recipes, so every response gets its own.
+    """
+    result = copy.deepcopy(result)
+    for recipe in result.get("recipes") or []:
+        if isinstance(recipe, dict):
+            recipe["id"] = diy_recommendation_data.generate_id()
+    return result
+
+
+async def cached_turn(
+    query: str,
+    intent: str,
+    process: Callable[[], Any],
+    embed_text: Optional[Callable[[str], List[List[float]]]]
+) -> Dict[str, Any]:
+    """Serve a turn from the semantic cache or run and cache it.
+
+    Partial results, which fell back to meet a deadline, are not cached.
+
+    Args:
+        query: User query.
+        intent: Intent of query.
+        process: Function returning the awaitable running the turn.
+        embed_text: Blocking function embedding a query, e.g.
+            VectorSearchManager.embed_text. Without one the cache is
+            skipped.
+
+    Returns:
+        Turn result.
+    """
+    cache = get_semantic_cache()
+    if cache is None or embed_text is None or not cache.caches(intent):
+        return await process()
+
+    embedding = None
+    try:
+        embedding = (await asyncio.to_thread(embed_text, query))[0]
+        entry = cache.get(intent, embedding)
+        if entry is not None:
+            logger.info(
+                f"Semantic cache hit for {query}: {entry['query']} "
+                f"({entry['similarity']:.3f})"
+            )
+            return refresh_ids(entry["result"])
+    except Exception as e:
+        logger.error(f"Error looking up semantic cache for {query}: {e}")
+
+    start = time.perf_counter()
+    result = await process()
+    if (embedding is not None and result and not result.get("partial")
+            and (result.get("products") or result.get("recipes"))):
+        cache.set(
+            intent=intent,
+            query=query,
+            embedding=embedding,
+            result=result,
+            elapsed=time.perf_counter() - start
+        )
+    return result
+
+
+_semantic_cache = None
+_semantic_cache_lock = threading.Lock()
+
+
+def get_semantic_cache() -> Optional[SemanticCache]:
+    """Get the semantic cache shared across requests.
+
+    Configured with semantic_cache_intents, a comma separated list of
+    cached intents, and semantic_cache_threshold_<intent> overriding
+    semantic_cache_threshold per intent.
+
+    Returns:
+        SemanticCache, or None unless enabled with semantic_cache_enabled.
+    """
+    global _semantic_cache
+    if os.getenv("semantic_cache_enabled", "false").lower() != "true":
+        return None
+    with _semantic_cache_lock:
+        if _semantic_cache is None:
+            intents = [
+                intent.strip() for intent in os.getenv(
+                    "semantic_cache_intents", "recipes").split(",")
+                if intent.strip()
+            ]
+            thresholds = {
+                intent: float(os.getenv(f"semantic_cache_threshold_{intent}"))
+                for intent in intents
+                if os.getenv(f"semantic_cache_threshold_{intent}")
+            }
+            _semantic_cache = SemanticCache(
+                max_entries=int(
+                    os.getenv("semantic_cache_max_entries", "1000")),
+                threshold=float(
+                    os.getenv("semantic_cache_threshold", "0.92")),
+                ttl=float(os.getenv("semantic_cache_ttl", "600")),
+                intents=intents,
+                thresholds=thresholds
+            )
+        return _semantic_cache
@@ -5,11 +5,13 @@
 
 from typing import Any, Dict, List
 
+from server.common import deadline
 from server.common import gemini
-from server.common import prompts
+from server.common import stream
 from server.config.logging import logger
 from server.services.products import product_recommendations
 from server.services.products import product_search
+from server.services import summary
 from server.services.recipes import recipe_recommendations
 
 
@@ -32,7 +34,7 @@ class SmeRunner:
         self.intent = intent
 
         # Gemini instance to summarize results.
-        self.model = gemini.GeminiModelManager()
+        self.model = gemini.create_model_manager()
 
     async def process(self):
         """Process query."""
@@ -45,30 +47,52 @@ class SmeRunner:
         msg = None
         intent = self.intent
 
-        # TODO: Update if need to change intent names.
-        # or want to add more intents.
-        if self.intent == "generic_product_search":
-            logger.info("In product search intent.")
-            product_search_result = await product_search.ProductSearch(
-                query=self.query
-            ).get_products()
-
-            # Products should be an array of product categories.
-            # For specific search it will just be one category, but payload
-            # should be a list of product categories.
-            products = [product_search_result]
-        elif self.intent == "product_recommendations":
-            logger.info("In product recs intent.")
-            products = await product_recommendations.ProductRecommendations(
-                query=self.query
-            ).get_recommendations()
-
-        elif self.intent == "recipes":
-            logger.info("In recipes intent.")
-            recipes, products = await recipe_recommendations.RecipeRecommendations( # pylint: disable=line-too-long
-                query=self.query
-            ).get_recommendations()
+        # Summarizer started early from generated names when configured.
+        summarizer = summary.Summarizer(
+            query=self.query,
+            intent=self.intent,
+            model=self.model
+        )
 
+        def on_names(product_names: List[str], recipe_names: List[str]):
+            stream.emit("names", {
+                "product_types": product_names,
+                "recipe_names": recipe_names
+            })
+            summarizer.start_early(product_names, recipe_names)
+
+        try:
+            # TODO: Update if need to change intent names.
+            # or want to add more intents.
+            if self.intent == "generic_product_search":
+                logger.info("In product search intent.")
+                product_search_result = await product_search.ProductSearch(
+                    query=self.query
+                ).get_products()
+
+                # Products should be an array of product categories.
+                # For specific search it will just be one category, but
+                # payload should be a list of product categories.
+                if product_search_result:
+                    products = [product_search_result]
+            elif self.intent == "product_recommendations":
+                logger.info("In product recs intent.")
+                products = await product_recommendations.ProductRecommendations(  # pylint: disable=line-too-long
+                    query=self.query,
+                    on_names=on_names
+                ).get_recommendations()
+
+            elif self.intent == "recipes":
+                logger.info("In recipes intent.")
+                recipes, products = await recipe_recommendations.RecipeRecommendations( # pylint: disable=line-too-long
+                    query=self.query,
+                    on_names=on_names
+                ).get_recommendations()
+        except BaseException:
+            # Turn cancelled, e.g. by a WebSocket client, or failed. The
+            # early summary is not used.
+            summarizer.cancel()
+            raise
 
         result = {
             "products": products,
@@ -76,47 +100,20 @@ class SmeRunner:
         }
 
         # Summarize result for message to display.
-        msg = await self.summarize_result(result=result)
+        msg = await summarizer.summarize(result)
 
         # Update payload with msg and intent.
+        # Partial results had stages fall back to meet the deadline.
+        degraded = deadline.degraded()
         result.update({
             "msg": msg,
-            "intent": intent
+            "intent": intent,
+            "partial": bool(degraded),
+            "degraded": degraded
         })
 
         return result
 
-    async def summarize_result(self, result):
-        """Summarize result for a message."""
-        logger.info("Summarizing result.")
-        products =  result.get("products")
-        recipes = result.get("recipes")
-        result_for_prompt = {}
-
-        # Extract just product names.
-        if products:
-            product_names = self.get_product_names(products=products)
-            result_for_prompt["products"] = product_names
-
-        if recipes:
-            recipe_names = self.get_recipe_names(recipes=recipes)
-            result_for_prompt["recipes"] = recipe_names
-
-        # Format prompt with result.
-        # If products or recipes is empty list,
-        # the prompt will insert an empty list to summarize.
-        prompt = prompts.summarize_result_prompt.format(
-            query=self.query,
-            result=result_for_prompt
-        )
-
-        msg = await self.model.generate_response(
-            prompt,
-            max_output_tokens=200,
-            temperature=0.2
-        )
-        return msg
-
     def get_product_names(self, products: List[Dict[str, Any]]) -> List[str]:
         """Get product names from list of product results.
 
@@ -128,14 +125,7 @@ class SmeRunner:
                 Each dictionary is a product category with multiple
                 product names.
         """
-        product_names = []
-        for category in products:
-            products_in_category = [
-                product["title"]
-                for product in category.get("product_names")
-            ]
-            product_names.extend(products_in_category)
-        return product_names
+        return summary.get_product_names(products)
 
 
     def get_recipe_names(self, recipes: List[Dict[str, Any]]) -> List[str]:
@@ -149,7 +139,4 @@ class SmeRunner:
                 Each dictionary is a product category with multiple
                 product names.
         """
-        recipe_names = []
-        for recipe in recipes:
-            recipe_names.append(recipe.get("name"))
-        return recipe_names
+        return summary.get_recipe_names(recipes)
@@ -0,0 +1,219 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""Result Summary Module.
+
+Chooses how the chat message of a turn is written, per intent
+(summary_mode_<intent> env variable):
+    template: Formulaic message from the result, no LLM call.
+    llm: Gemini summary of the final result names.
+    early: Gemini summary started from the recipe / product type names
+        as soon as they are generated, concurrently with the product
+        searches and recipe metadata, so it adds no round trip at the end.
+Empty results, and every result while admission control sheds
+summaries, use a template.
+"""
+
+import os
+from typing import Any, Dict, List, Optional
+
+import asyncio
+
+from server.common import admission
+from server.common import deadline
+from server.common import prompts
+from server.config.logging import logger
+
+
+TEMPLATE = "template"
+LLM = "llm"
+EARLY = "early"
+
+DEFAULT_SUMMARY_MODES = {
+    "generic_product_search": TEMPLATE,
+    "product_recommendations": EARLY,
+    "recipes": EARLY,
+}
+
+
+def summary_mode(intent: Optional[str]) -> str:
+    """Summary mode of an intent."""
+    mode = os.getenv(
+        f"summary_mode_{intent}", DEFAULT_SUMMARY_MODES.get(intent, LLM))
+    if mode not in (TEMPLATE, LLM, EARLY):
+        logger.error(f"Unknown summary mode {mode} for {intent}, using llm.")
+        return LLM
+    return mode
+
+
+def get_product_names(products: List[Dict[str, Any]]) -> List[str]:
+    """Product names of a list of product categories."""
+    product_names = []
+    for category in products:
+        if not category:
+            continue
+        product_names.extend(
+            product["title"] for product in category.get("product_names"))
+    return product_names
+
+
+def get_recipe_names(recipes: List[Dict[str, Any]]) -> List[str]:
+    """Recipe names of a list of recipes."""
+    return [recipe.get("name") for recipe in recipes if recipe]
+
+
+def join_names(names: List[str], limit: int = 3) -> str:
+    """Join the first names as "a, b and c"."""
+    names = [name for name in names if name][:limit]
+    if len(names) < 2:
+        return "".join(names)
+    return f"{', '.join(names[:-1])} and {names[-1]}"
+
+
+def template_summary(
+    query: str,
+    intent: Optional[str],
+    result: Dict[str, Any]
+) -> str:
+    """Summary message without an LLM call.
+
+    Args:
+        query: User query.
+        intent: Intent of query.
+        result: Products and recipes of the turn.
+    """
+    products = [category for category in result.get("products") or []
+                if category]
+    recipe_names = get_recipe_names(result.get("recipes") or [])
+    titles = [category.get("title") for category in products]
+
+    if recipe_names:
+        return (
+            f"Here are {len(recipe_names)} recipes for \"{query}\", "
+            f"including {join_names(recipe_names)}. I also put together "
+            "a grocery list of the ingredients you will need."
+        )
+    if intent == "generic_product_search" and len(products) == 1:
+        count = len(products[0].get("product_names") or [])
+        if count:
+            return (
+                f"Here are {count} {products[0].get('title') or query} "
+                "options I found for you."
+            )
+    if any(titles):
+        return (
+            f"Here are some products for \"{query}\", including "
+            f"{join_names(titles)}."
+        )
+    return (
+        f"Sorry, I could not find results for \"{query}\". "
+        "Please try re-phrasing your query."
+    )
+
+
+class Summarizer:
+    """Write the message of a turn with the intent's summary mode."""
+    def __init__(self, query: str, intent: Optional[str], model: Any):
+        """Init summarizer.
+
+        Args:
+            query: User query.
+            intent: Intent of query.
+            model: Gemini model manager for LLM summaries.
+        """
+        self.query = query
+        self.intent = intent
+        self.model = model
+        self.mode = summary_mode(intent)
+        self._early_summary = None
+
+    def start_early(
+        self,
+        product_names: List[str],
+        recipe_names: List[str]
+    ) -> None:
+        """Start summarizing from names, before results are complete.
+
+        Used as the on_names callback of recommendation services,
+        ignored unless the mode is early.
+
+        Args:
+            product_names: Product types of the result.
+            recipe_names: Recipe names of the result.
+        """
+        if self.mode != EARLY or self._early_summary is not None:
+            return
+        if admission.is_shed(admission.SUMMARIZE):
+            return
+        if not product_names and not recipe_names:
+            return
+        self._early_summary = asyncio.ensure_future(
+            self.generate(product_names, recipe_names))
+
+    async def generate(
+        self,
+        product_names: List[str],
+        recipe_names: List[str]
+    ) -> Optional[str]:
+        """Gemini summary of result names."""
+        result_for_prompt = {}
+        if product_names:
+            result_for_prompt["products"] = product_names
+        if recipe_names:
+            result_for_prompt["recipes"] = recipe_names
+
+        # Format prompt with result.
+        # If products or recipes is empty list,
+        # the prompt will insert an empty list to summarize.
+        prompt = prompts.summarize_result_prompt.format(
+            query=self.query,
+            result=result_for_prompt
+        )
+        return await self.model.generate_response(
+            prompt,
+            max_output_tokens=200,
+            temperature=0.2,
+            stage="summarize"
+        )
+
+    async def summarize(self, result: Dict[str, Any]) -> str:
+        """Message of the final result.
+
+        Falls back to the template when out of time or on errors.
+
+        Args:
+            result: Products and recipes of the turn.
+        """
+        fallback = template_summary(self.query, self.intent, result)
+        products = [category for category in result.get("products") or []
+                    if category]
+        recipes = result.get("recipes") or []
+        if not products and not recipes:
+            self.cancel()
+            return fallback
+
+        # Overloaded, skip the LLM call.
+        if admission.is_shed(admission.SUMMARIZE):
+            self.cancel()
+            deadline.mark_degraded("summarize")
+            return fallback
+
+        if self._early_summary is not None:
+            summary = self._early_summary
+        elif self.mode == TEMPLATE:
+            return fallback
+        else:
+            summary = self.generate(
+                get_product_names(products), get_recipe_names(recipes))
+
+        msg = await deadline.run_with_budget(
+            summary,
+            fallback=fallback,
+            stage="summarize"
+        )
+        return msg or fallback
+
+    def cancel(self) -> None:
+        """Cancel an early summary that is no longer needed."""
+        if self._early_summary is not None:
+            self._early_summary.cancel()
@@ -0,0 +1,115 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""App startup and readiness.
+
+At startup, shared backend clients and Gemini models are created in
+parallel threads, then caches are warmed (server.warmup). The instance
+is ready once both are done, see the /readyz route. Clients that fail to
+initialize are created again on first use.
+"""
+
+import os
+import time
+from typing import Any, Callable, Dict
+
+import asyncio
+
+from server import fakes
+from server.common import cache_backends
+from server.common import gemini
+from server.common import prompts
+from server.config.logging import logger
+from server.functions import datastore
+from server.functions import vector_search
+from server.functions import vertex_search
+from server.warmup import warmer
+
+
+# Startup progress of this process.
+_status = {"state": "starting", "clients": {}}
+
+
+def _init_gemini() -> None:
+    # Models of the default and system prompted model managers.
+    gemini.create_model_manager()
+    gemini.create_model_manager(
+        system_prompt=prompts.intent_classifer_system_prompt)
+    gemini.create_model_manager(
+        system_prompt=prompts.product_recommendations_system_context)
+
+
+def _init_vector_search() -> None:
+    vector_search.create_vector_search_manager()
+    if not fakes.enabled():
+        vector_search.get_embedding_model(vector_search.EMBEDDING_MODEL)
+
+
+def _init_datastore() -> None:
+    datastore.create_datastore_manager(
+        project_id=os.getenv("project_id"),
+        datastore_id=os.getenv("recipes_datastore_id")
+    )
+
+
+# Blocking client initializers by name.
+CLIENTS: Dict[str, Callable[[], Any]] = {
+    "gemini": _init_gemini,
+    "vertex_search": vertex_search.create_search_manager,
+    "vector_search": _init_vector_search,
+    "datastore": _init_datastore,
+    "cache_backend": cache_backends.get_backend,
+}
+
+
+async def init_clients() -> Dict[str, str]:
+    """Create shared clients in parallel threads.
+
+    Returns:
+        Outcome of each client, ok or error.
+    """
+    async def init(name, func):
+        started = time.perf_counter()
+        try:
+            await asyncio.to_thread(func)
+            outcome = "ok"
+        except Exception as e:
+            logger.error(f"Error initializing {name} client: {e}")
+            outcome = "error"
+        logger.info(
+            f"Initialized {name} client in "
+            f"{time.perf_counter() - started:.2f}s: {outcome}")
+        return name, outcome
+
+    return dict(await asyncio.gather(*[
+        init(name, func) for name, func in CLIENTS.items()
+    ]))
+
+
+async def start() -> Dict[str, Any]:
+    """Initialize clients, then warm caches.
+
+    Returns:
+        Startup status.
+    """
+    start_time = time.perf_counter()
+    _status.update({"state": "initializing", "clients": {}})
+    _status["clients"] = await init_clients()
+    _status["state"] = "warming"
+    await warmer.warm_from_log()
+    _status.update({
+        "state": "ready",
+        "elapsed_s": time.perf_counter() - start_time
+    })
+    logger.info(f"Ready in {_status['elapsed_s']:.2f}s.")
+    return status()
+
+
+def is_ready() -> bool:
+    """Whether startup completed."""
+    return _status["state"] == "ready"
+
+
+def status() -> Dict[str, Any]:
+    """Startup progress, with client outcomes and cache warm-up."""
+    return {**_status, "warmup": warmer.status()}
@@ -3,6 +3,55 @@
 # agreement with Google.
 """Local Chat history."""
 
+import collections
+import os
+from typing import Any, Dict, List, Optional
+
 # TODO: Edit to use Memorystore or Redis in production instead.
 # Currently used for multi-turn for POC.
 message_history = []
+
+# Chat history of clients that send a session id, least recent first.
+session_histories = collections.OrderedDict()
+
+
+def get_history(session_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Get chat history of a session.
+
+    Args:
+        session_id: Client session id. Requests without one share
+            the global message history.
+
+    Returns:
+        Chat history list, appended to after each turn.
+    """
+    if not session_id:
+        return message_history
+
+    history = session_histories.setdefault(session_id, [])
+    session_histories.move_to_end(session_id)
+
+    # Bound memory by dropping least recently active sessions.
+    max_sessions = int(os.getenv("max_sessions", "10000"))
+    while len(session_histories) > max_sessions:
+        session_histories.popitem(last=False)
+    return history
+
+
+def append_turn(
+    history: List[Dict[str, Any]],
+    entry: Dict[str, Any]
+) -> None:
+    """Append a turn to a chat history, dropping the oldest turns.
+
+    Follow up handling only reads the latest turns, so at most
+    max_session_turns are kept per session.
+
+    Args:
+        history: Chat history list.
+        entry: Turn with user_query and response.
+    """
+    history.append(entry)
+    max_turns = int(os.getenv("max_session_turns", "20"))
+    if len(history) > max_turns:
+        del history[:len(history) - max_turns]
@@ -0,0 +1,76 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""Chat History Digest.
+
+Compact form of a history turn for follow up prompts. A full turn holds
+every product with its url, sku and image and every recipe with its
+instructions, while follow up classification and rewriting only need
+what the user was shown at a glance.
+"""
+
+from typing import Any, Dict, List, Optional
+
+
+# Product titles kept per category in a digest.
+DIGEST_PRODUCTS_PER_CATEGORY = 3
+
+
+def digest(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Compact digest of a history turn.
+
+    Args:
+        entry: History turn with user_query and response.
+
+    Returns:
+        Dictionary of query, intent, message, recipe names and product
+        categories with their first products.
+            E.g. {
+                    "user_query": "easy pasta dinners",
+                    "intent": "recipes",
+                    "msg": "Here are 3 recipes...",
+                    "recipes": ["Pasta Primavera", ...],
+                    "products": [{"title": "Pasta", "products": [...]}]
+                }
+    """
+    response = entry.get("response") or {}
+    categories = []
+    for category in response.get("products") or []:
+        if not category:
+            continue
+        products = category.get("product_names") or []
+        categories.append({
+            "title": category.get("title"),
+            "products": [
+                product.get("title")
+                for product in products[:DIGEST_PRODUCTS_PER_CATEGORY]
+            ]
+        })
+    return {
+        "user_query": entry.get("user_query"),
+        "intent": response.get("intent"),
+        "msg": response.get("msg"),
+        "recipes": [
+            recipe.get("name") for recipe in response.get("recipes") or []
+            if recipe
+        ],
+        "products": categories,
+    }
+
+
+def get_digest(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Digest of a history turn, computed once and kept on the turn.
+
+    Args:
+        entry: History turn with user_query and response.
+    """
+    if "digest" not in entry:
+        entry["digest"] = digest(entry)
+    return entry["digest"]
+
+
+def last_digest(history: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Digest of the last turn of a chat history, None if empty."""
+    if not history:
+        return None
+    return get_digest(history[-1])
@@ -3,9 +3,13 @@
 # agreement with Google.
 """Multi Turn."""
 
+import time
 import traceback
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 
+from server.common import deadline
+from server.common import metrics
+from server.common import stream
 from server.config.logging import logger
 from server.functions import detect_follow_up
 from server.turns import turn
@@ -22,15 +26,18 @@ class MultiTurn:
     def __init__(
         self,
         query: str,
-        history: Dict[str, Any]
+        history: Dict[str, Any],
+        intent: Optional[str] = None
     ):
         """Init multi-turn.
 
         Args:
             history: History of current session - last query and response.
+            intent: Known intent of query, skips intent classification.
         """
         self.query = query
         self.history = history
+        self.intent = intent
         self.follow_up_classifier = detect_follow_up.FollowUpClassifier(
             history=self.history,
             query=self.query
@@ -38,17 +45,35 @@ class MultiTurn:
 
     async def process(self):
         """Runner for turn orchestration."""
+        start = time.perf_counter()
+        intent = None
         try:
-            is_follow_up = await self.follow_up_classifier.classify_follow_up()
+            # Out of time, treat as a new query.
+            is_follow_up = await deadline.run_with_budget(
+                self.follow_up_classifier.classify_follow_up(),
+                fallback=False,
+                stage="follow_up",
+                fraction=0.15
+            )
 
             logger.info(f"Follow up: {is_follow_up}")
 
             # Summarize follow up query using history.
+            # Out of time, keep the query as is.
             if is_follow_up:
-                self.query = await self.follow_up_classifier.summarize_follow_up_query() # pylint: disable=line-too-long
+                self.query = await deadline.run_with_budget(
+                    self.follow_up_classifier.summarize_follow_up_query(),
+                    fallback=self.query,
+                    stage="follow_up_rewrite",
+                    fraction=0.2
+                )
                 logger.info(f"Summarized follow up query: {self.query}")
+            stream.emit(
+                "query", {"query": self.query, "follow_up": is_follow_up})
 
-            result = await turn.Turn().process(query=self.query)
+            result = await turn.Turn().process(
+                query=self.query, intent=self.intent)
+            intent = (result or {}).get("intent")
 
             return result
         except Exception as e:
@@ -63,3 +88,7 @@ class MultiTurn:
                 "recipes": [],
                 "intent": None
             }
+        finally:
+            metrics.TURN_LATENCY.labels(
+                intent=metrics.intent_label(intent)
+            ).observe(time.perf_counter() - start)
@@ -3,9 +3,17 @@
 # agreement with Google.
 """Single Turn."""
 
+from typing import Optional
+
+import asyncio
+
+from server.common import deadline
 from server.common import prompts
+from server.common import stream
 from server.config.logging import logger
 from server.functions import detect_intent
+from server.functions import local_guardrail
+from server.services import semantic_cache
 from server.services import sme
 
 
@@ -25,21 +33,54 @@ class Turn:
         self.intent_classifer = detect_intent.IntentClassifier(
             system_context=prompts.intent_classifer_system_prompt)
 
-    async def process(self, query: str):
-        """Runner for turn orchestration."""
+    async def process(self, query: str, intent: Optional[str] = None):
+        """Runner for turn orchestration.
+
+        Args:
+            query: User query.
+            intent: Known intent of query, skips intent classification.
+        """
         # Check whether query is malicious.
-        is_malicious = self.intent_classifer.check_malicious_query(query)
+        # Blocking vector search call, run in a thread.
+        # Out of time, use the local pattern guardrail. Other errors are
+        # handled by check_malicious_query.
+        is_malicious = await deadline.run_with_budget(
+            asyncio.to_thread(
+                self.intent_classifer.check_malicious_query, query),
+            fallback=local_guardrail.is_malicious(query),
+            stage="guardrail",
+            fraction=0.1,
+            errors=()
+        )
 
         # Only process queries that are not malicious.
         # Otherwise return default result.
         if not is_malicious:
-            intent = await self.intent_classifer.classify_intent(query)
+            if intent is None:
+                # Out of time, search products for the query.
+                intent = await deadline.run_with_budget(
+                    self.intent_classifer.classify_intent(query),
+                    fallback="generic_product_search",
+                    stage="intent",
+                    fraction=0.15
+                )
             logger.info(f"Intent for query: {intent}")
+            stream.emit("intent", {"intent": intent})
 
             # Process results based on intent & query.
-            result = await sme.SmeRunner(
+            # Near-duplicate queries reuse a recent result.
+            classifier = self.intent_classifer
+            embed_text = None
+            if classifier.use_vector_db:
+                embed_text = classifier.vector_search_client.embed_text
+            result = await semantic_cache.cached_turn(
                 query=query,
-                intent=intent
-            ).process()
+                intent=intent,
+                process=lambda: sme.SmeRunner(
+                    query=query,
+                    intent=intent
+                ).process(),
+                embed_text=embed_text
+            )
 
             return result
@@ -0,0 +1,65 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+# pylint: disable=invalid-name
+"""Warm caches from a query log on the command line.
+
+Usage:
+    python -m server.warmup --input queries.jsonl --top-n 100 \
+        --concurrency 4 --rps 5
+
+Caches are per process, so warming from the command line only helps
+servers using a shared cache backend (cache_backend sqlite or redis).
+Servers warm themselves at startup with warmup_query_log_path.
+"""
+
+import argparse
+import os
+
+import asyncio
+
+from server.common import utils
+from server.warmup import warmer
+
+
+async def run(args: argparse.Namespace) -> dict:
+    items = warmer.read_query_log(args.input, top_n=args.top_n)
+    print(
+        f"Warming {len(items[warmer.QUERIES])} queries and "
+        f"{len(items[warmer.PRODUCT_TYPES])} product types."
+    )
+    return await warmer.Warmer(
+        concurrency=args.concurrency,
+        rate=args.rps,
+        item_deadline=args.deadline
+    ).run(items)
+
+
+def main(args: argparse.Namespace) -> None:
+    if os.getenv("ENV", "DEV") == "DEV":
+        utils.load_config_to_env("./config.yaml")
+    if args.fake:
+        os.environ["backend_mode"] = "fake"
+
+    stats = asyncio.run(run(args))
+    elapsed = stats.pop("elapsed_s")
+    counts = ", ".join(f"{key} {value}" for key, value in sorted(stats.items()))
+    print(f"Warmed in {elapsed:.1f}s: {counts or 'nothing'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("--input", required=True,
+                        help="JSONL query log.")
+    parser.add_argument("--top-n", type=int, default=50,
+                        help="Max queries and product types each.")
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="Max items warmed at a time.")
+    parser.add_argument("--rps", type=float, default=5.0,
+                        help="Max items started per second, 0 for none.")
+    parser.add_argument("--deadline", type=float, default=30.0,
+                        help="Seconds an item may take.")
+    parser.add_argument("--fake", action="store_true",
+                        help="Use fake backends.")
+    main(parser.parse_args())
@@ -0,0 +1,240 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""Cache warm-up from historical queries.
+
+Reads a query log in JSONL, one record per line, e.g. load test requests,
+batch inputs or batch results:
+    {"session_id": "s1", "user_query": "easy pasta recipes"}
+    {"user_query": "apples", "intent": "generic_product_search"}
+    {"index": 3, "user_query": "...", "result": {"products": [...]}}
+    {"product_type": "avocados"}
+
+The most frequent queries and product types are warmed:
+    - Queries are embedded, filling the embedding cache.
+    - Product types are searched, filling the product search and title
+      caches.
+
+Product types are taken from generic product search queries, product
+titles and recipe ingredients of logged results. Recipe metadata is not
+warmed, it is grounded on the grocery list generated for each query.
+"""
+
+import collections
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+import asyncio
+
+from server.common import deadline
+from server.common import metrics
+from server.common import rate_limit
+from server.common import scheduler
+from server.config.logging import logger
+from server.functions import vector_search
+from server.services.products import product_search
+
+
+QUERIES = "queries"
+PRODUCT_TYPES = "product_types"
+
+
+def normalize(text: str) -> str:
+    """Key of a query or product type."""
+    return " ".join(text.lower().split())
+
+
+def read_query_log(path: str, top_n: int = 50) -> Dict[str, List[str]]:
+    """Most frequent queries and product types of a log.
+
+    Args:
+        path: JSONL query log.
+        top_n: Max items of each kind.
+
+    Returns:
+        Items of each kind, most frequent first, in their first logged
+        spelling.
+            E.g. {
+                    "queries": ["easy pasta recipes", ...],
+                    "product_types": ["Apples", ...]
+                }
+    """
+    counts = {kind: collections.Counter() for kind in (
+        QUERIES, PRODUCT_TYPES)}
+    spellings = {kind: {} for kind in counts}
+
+    def add(kind: str, text: Any) -> None:
+        if not isinstance(text, str) or not text.strip():
+            return
+        key = normalize(text)
+        counts[kind][key] += 1
+        spellings[kind].setdefault(key, " ".join(text.split()))
+
+    with open(path, "r", encoding="utf-8") as f:
+        for index, line in enumerate(f):
+            try:
+                entry = json.loads(line) if line.strip() else None
+            except json.JSONDecodeError as e:
+                logger.error(f"Skipping invalid query log line {index}: {e}")
+                continue
+            if not isinstance(entry, dict):
+                continue
+
+            query = entry.get("user_query")
+            add(QUERIES, query)
+            add(PRODUCT_TYPES, entry.get("product_type"))
+
+            result = entry.get("result") or entry.get("response")
+            if not isinstance(result, dict):
+                result = {}
+            intent = entry.get("intent") or result.get("intent")
+            if intent == "generic_product_search":
+                add(PRODUCT_TYPES, query)
+            for product in result.get("products") or []:
+                if isinstance(product, dict):
+                    add(PRODUCT_TYPES, product.get("title"))
+            for recipe_data in result.get("recipes") or []:
+                if isinstance(recipe_data, dict):
+                    for ingredient in recipe_data.get("ingredients") or []:
+                        add(PRODUCT_TYPES, ingredient)
+
+    return {
+        kind: [spellings[kind][key] for key, _ in counter.most_common(top_n)]
+        for kind, counter in counts.items()
+    }
+
+
+class Warmer:
+    """Fill caches with rate limited backend calls."""
+    def __init__(
+        self,
+        concurrency: int = 4,
+        rate: float = 5.0,
+        item_deadline: float = 30.0
+    ):
+        """Init warmer.
+
+        Args:
+            concurrency: Max items warmed at a time.
+            rate: Max items started per second, 0 for no limit.
+            item_deadline: Seconds an item may take.
+        """
+        self.concurrency = concurrency
+        self.rate_limiter = rate_limit.TokenBucket(rate) if rate > 0 else None
+        self.item_deadline = item_deadline
+        self.stats = collections.Counter()
+
+    async def run(self, items: Dict[str, List[str]]) -> Dict[str, Any]:
+        """Warm caches for items of read_query_log.
+
+        Returns:
+            Counts of warmed and failed items by kind, and seconds taken.
+        """
+        start = time.perf_counter()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        # Created once, model and endpoint initialization is not free.
+        embedder = None
+        if items.get(QUERIES):
+            try:
+                embedder = vector_search.create_vector_search_manager()
+            except Exception as e:
+                logger.error(f"Skipping query embeddings: {e}")
+
+        warmers = {
+            QUERIES: (
+                lambda query: asyncio.to_thread(embedder.embed_text, query)
+            ) if embedder else None,
+            PRODUCT_TYPES: product_search.get_individual_product_type,
+        }
+
+        async def warm(kind, warm_item, item):
+            try:
+                # Warm-up runs before traffic, it may use batch quota.
+                with deadline.deadline_scope(self.item_deadline), \
+                        rate_limit.retry_budget(), \
+                        scheduler.priority(scheduler.BATCH):
+                    result = await warm_item(item)
+                outcome = "ok" if result else "error"
+            except Exception as e:
+                logger.error(f"Error warming {kind} {item}: {e}")
+                outcome = "error"
+            finally:
+                semaphore.release()
+            self.stats[f"{kind}_{outcome}"] += 1
+            metrics.WARMUP_ITEMS.labels(kind=kind, outcome=outcome).inc()
+
+        tasks = []
+        try:
+            for kind, warm_item in warmers.items():
+                if warm_item is None:
+                    continue
+                for item in items.get(kind) or []:
+                    await semaphore.acquire()
+                    if self.rate_limiter:
+                        await self.rate_limiter.acquire()
+                    tasks.append(
+                        asyncio.create_task(warm(kind, warm_item, item)))
+            await asyncio.gather(*tasks)
+        finally:
+            # Cancelled, e.g. by warmup_timeout, stop items in flight too.
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return {**self.stats, "elapsed_s": time.perf_counter() - start}
+
+
+# Progress of the warm-up of this process.
+_status = {"state": "disabled"}
+
+
+def status() -> Dict[str, Any]:
+    """Warm-up progress: disabled, running, completed, timeout or failed."""
+    return dict(_status)
+
+
+async def warm_from_log(path: Optional[str] = None) -> Dict[str, Any]:
+    """Warm caches from a query log, e.g. at startup.
+
+    Settings are read from warmup_top_n, warmup_concurrency,
+    warmup_rate_limit, warmup_item_deadline and warmup_timeout env
+    variables. Warm-up stops after warmup_timeout seconds, keeping what
+    was warmed so far.
+
+    Args:
+        path: JSONL query log, defaults to warmup_query_log_path env
+            variable. Nothing is warmed without one.
+
+    Returns:
+        Warm-up status.
+    """
+    path = path or os.getenv("warmup_query_log_path")
+    if not path:
+        return status()
+    _status.clear()
+    _status.update({"state": "running", "path": path})
+    start = time.perf_counter()
+    warmer = None
+    try:
+        items = read_query_log(
+            path, top_n=int(os.getenv("warmup_top_n", "50")))
+        warmer = Warmer(
+            concurrency=int(os.getenv("warmup_concurrency", "4")),
+            rate=float(os.getenv("warmup_rate_limit", "5")),
+            item_deadline=float(os.getenv("warmup_item_deadline", "30"))
+        )
+        _status.update(await asyncio.wait_for(
+            warmer.run(items),
+            timeout=float(os.getenv("warmup_timeout", "60"))
+        ))
+        _status["state"] = "completed"
+    except asyncio.TimeoutError:
+        _status.update(warmer.stats)
+        _status["state"] = "timeout"
+    except Exception as e:
+        logger.error(f"Error warming caches from {path}: {e}")
+        _status["state"] = "failed"
+    _status["elapsed_s"] = time.perf_counter() - start
+    logger.info(f"Cache warm-up {_status['state']}: {_status}")
+    return status()
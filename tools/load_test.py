@@ -0,0 +1,385 @@
+# Copyright 2024 Google LLC. This software is provided as-is, without warranty
+# or representation for any use or purpose. Your use of it is subject to your
+# agreement with Google.
+"""Load test the chat API by replaying recorded requests.
+
+Each line of the input JSONL file is one chat request:
+    {"session_id": "s1", "user_query": "easy pasta recipes"}
+    {"session_id": "s1", "user_query": "make them vegetarian"}
+    {"session_id": "s2", "image": "grocery_list.jpg"}
+    {"session_id": "s3", "images": ["page_1.jpg", "page_2.jpg"]}
+
+Image paths are relative to the input file. Lines without a user_query
+or image (e.g. other JSONL records) are skipped.
+
+Requests of a session are sent in order, one at a time, as multi-turn
+conversations. Sessions run concurrently, either closed loop with a fixed
+number of concurrent sessions (--concurrency) or open loop at a target
+request rate (--rps).
+
+Without --url the app runs in-process against the fake backends, so
+results are reproducible and event loop lag is the app's own lag.
+
+The semantic turn cache hit rate and latency saved during the run are
+read from the app's /metrics before and after.
+
+Usage:
+    python -m tools.load_test --input tools/sample_requests.jsonl \
+        --concurrency 8 --repeat 5
+    python -m tools.load_test --input requests.jsonl --rps 20 \
+        --url http://localhost:8080
+"""
+
+import argparse
+import collections
+import json
+import logging
+import os
+import random
+import time
+from typing import Any, Dict, List, Optional
+
+import asyncio
+import httpx
+from prometheus_client.parser import text_string_to_metric_families
+
+
+# Interval of the event loop lag probe in seconds.
+LAG_PROBE_INTERVAL = 0.05
+
+
+def load_sessions(path: str) -> List[Dict[str, Any]]:
+    """Group recorded requests into sessions.
+
+    Args:
+        path: JSONL file of recorded requests.
+
+    Returns:
+        List of sessions, each with a session id and ordered requests.
+    """
+    sessions = collections.OrderedDict()
+    skipped = 0
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if not any(k in entry for k in ("user_query", "image", "images")):
+                skipped += 1
+                continue
+            session_id = str(entry.get("session_id") or f"line-{line_number}")
+            sessions.setdefault(session_id, []).append(entry)
+    if skipped:
+        print(f"Skipped {skipped} lines without a user_query or image.")
+    return [
+        {"session_id": session_id, "requests": requests}
+        for session_id, requests in sessions.items()
+    ]
+
+
+async def semantic_cache_counts(client: httpx.AsyncClient) -> Dict[str, float]:
+    """Semantic turn cache counters from the app's metrics.
+
+    Returns:
+        Hits, misses and seconds saved so far, zeros if unavailable.
+    """
+    counts = {"hits": 0.0, "misses": 0.0, "seconds_saved": 0.0}
+    try:
+        response = await client.get("/metrics")
+        families = text_string_to_metric_families(response.text)
+        for family in families:
+            for sample in family.samples:
+                if (sample.name == "sme_cache_requests_total"
+                        and sample.labels.get("cache") == "semantic_turn"):
+                    result = sample.labels["result"]
+                    counts["hits" if result == "hit" else "misses"] += (
+                        sample.value)
+                elif sample.name == (
+                        "sme_semantic_cache_seconds_saved_total"):
+                    counts["seconds_saved"] += sample.value
+    except Exception as e:
+        print(f"Could not read semantic cache metrics: {e}")
+    return counts
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """Nearest rank percentile of values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class LoadTest:
+    """Replay sessions against the chat API and collect results."""
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        sessions: List[Dict[str, Any]],
+        base_dir: str,
+    ):
+        """Init load test.
+
+        Args:
+            client: HTTP client for the app.
+            sessions: Sessions to replay.
+            base_dir: Directory image paths are relative to.
+        """
+        self.client = client
+        self.sessions = sessions
+        self.base_dir = base_dir
+        self.results = []
+        self.loop_lags = []
+        self._run_id = f"{random.randrange(16**6):06x}"
+        self._sessions_started = 0
+
+    async def send(self, session_id: str, entry: Dict[str, Any]) -> None:
+        """Send one request and record its result."""
+        start = time.perf_counter()
+        status, intent, error = None, None, None
+        try:
+            if "user_query" in entry:
+                response = await self.client.post(
+                    "/api/send-message",
+                    json={
+                        "user_query": entry["user_query"],
+                        "session_id": session_id
+                    }
+                )
+            else:
+                paths = entry.get("images") or [entry["image"]]
+                files = []
+                for path in paths:
+                    with open(os.path.join(self.base_dir, path), "rb") as f:
+                        files.append((
+                            "images" if "images" in entry else "image",
+                            (os.path.basename(path), f.read(), "image/jpeg")
+                        ))
+                route = ("/api/send-message/images" if "images" in entry
+                         else "/api/send-message/image")
+                response = await self.client.post(
+                    route, files=files, data={"session_id": session_id})
+
+            status = response.status_code
+            body = response.json()
+            intent = body.get("intent")
+            if status != 200:
+                error = f"http_{status}"
+            elif body.get("msg") == "Error":
+                error = "app_error"
+            elif intent is None:
+                error = "fallback"
+        except Exception as e:
+            error = type(e).__name__
+
+        self.results.append({
+            "latency": time.perf_counter() - start,
+            "intent": intent or "none",
+            "status": status,
+            "error": error,
+        })
+
+    async def run_session(self, session: Dict[str, Any]) -> None:
+        """Send the requests of a session in order."""
+        # Unique per run so repeated sessions start with empty history.
+        self._sessions_started += 1
+        session_id = (
+            f"{session['session_id']}-{self._run_id}-{self._sessions_started}")
+        for entry in session["requests"]:
+            await self.send(session_id, entry)
+
+    async def run_closed_loop(self, concurrency: int) -> None:
+        """Run sessions with a fixed number in flight."""
+        queue = asyncio.Queue()
+        for session in self.sessions:
+            queue.put_nowait(session)
+
+        async def worker():
+            while not queue.empty():
+                await self.run_session(queue.get_nowait())
+
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+
+    async def run_open_loop(self, rps: float) -> None:
+        """Start sessions at Poisson arrivals matching a request rate."""
+        mean_turns = (
+            sum(len(s["requests"]) for s in self.sessions) / len(self.sessions)
+        )
+        session_rate = rps / mean_turns
+        tasks = []
+        for session in self.sessions:
+            tasks.append(asyncio.create_task(self.run_session(session)))
+            await asyncio.sleep(random.expovariate(session_rate))
+        await asyncio.gather(*tasks)
+
+    async def probe_loop_lag(self) -> None:
+        """Measure how late the event loop wakes up from sleeps."""
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(LAG_PROBE_INTERVAL)
+            self.loop_lags.append(
+                time.perf_counter() - start - LAG_PROBE_INTERVAL)
+
+    async def run(
+        self,
+        concurrency: Optional[int],
+        rps: Optional[float]
+    ) -> Dict[str, Any]:
+        """Run load test and build report."""
+        cache_before = await semantic_cache_counts(self.client)
+        probe = asyncio.create_task(self.probe_loop_lag())
+        start = time.perf_counter()
+        try:
+            if rps:
+                await self.run_open_loop(rps)
+            else:
+                await self.run_closed_loop(concurrency or 1)
+        finally:
+            probe.cancel()
+        elapsed = time.perf_counter() - start
+        cache_after = await semantic_cache_counts(self.client)
+        cache_counts = {
+            key: cache_after[key] - cache_before[key] for key in cache_after
+        }
+        return self.report(elapsed, cache_counts)
+
+    def report(
+        self,
+        elapsed: float,
+        cache_counts: Dict[str, float]
+    ) -> Dict[str, Any]:
+        """Summarize results."""
+        def summarize(results):
+            latencies = [r["latency"] for r in results]
+            errors = collections.Counter(
+                r["error"] for r in results if r["error"])
+            return {
+                "requests": len(results),
+                "error_rate": sum(errors.values()) / len(results),
+                "errors": dict(errors),
+                "mean_ms": 1000 * sum(latencies) / len(latencies),
+                "p50_ms": 1000 * percentile(latencies, 50),
+                "p95_ms": 1000 * percentile(latencies, 95),
+                "p99_ms": 1000 * percentile(latencies, 99),
+            }
+
+        lookups = cache_counts["hits"] + cache_counts["misses"]
+        by_intent = collections.defaultdict(list)
+        for result in self.results:
+            by_intent[result["intent"]].append(result)
+
+        return {
+            "elapsed_s": elapsed,
+            "throughput_rps": len(self.results) / elapsed,
+            "overall": summarize(self.results) if self.results else {},
+            "by_intent": {
+                intent: summarize(results)
+                for intent, results in sorted(by_intent.items())
+            },
+            "event_loop_lag_ms": {
+                "p50": 1000 * (percentile(self.loop_lags, 50) or 0),
+                "p99": 1000 * (percentile(self.loop_lags, 99) or 0),
+                "max": 1000 * max(self.loop_lags, default=0),
+            },
+            "semantic_cache": {
+                "hits": int(cache_counts["hits"]),
+                "lookups": int(lookups),
+                "hit_rate": cache_counts["hits"] / lookups if lookups else 0.0,
+                "latency_saved_s": cache_counts["seconds_saved"],
+            },
+        }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    """Print report as a table."""
+    print(
+        f"\n{report['overall'].get('requests', 0)} requests in "
+        f"{report['elapsed_s']:.1f}s: "
+        f"{report['throughput_rps']:.2f} req/s"
+    )
+    header = f"{'intent':<26}{'n':>6}{'err%':>7}{'p50':>9}{'p95':>9}{'p99':>9}"
+    print(header)
+    print("-" * len(header))
+    rows = list(report["by_intent"].items()) + [("ALL", report["overall"])]
+    for intent, summary in rows:
+        if not summary:
+            continue
+        print(
+            f"{intent:<26}{summary['requests']:>6}"
+            f"{100 * summary['error_rate']:>6.1f}%"
+            f"{summary['p50_ms']:>8.0f}ms{summary['p95_ms']:>7.0f}ms"
+            f"{summary['p99_ms']:>7.0f}ms"
+        )
+    lag = report["event_loop_lag_ms"]
+    print(
+        f"\nEvent loop lag: p50 {lag['p50']:.1f}ms, "
+        f"p99 {lag['p99']:.1f}ms, max {lag['max']:.1f}ms"
+    )
+    semantic = report["semantic_cache"]
+    print(
+        f"Semantic cache: {100 * semantic['hit_rate']:.1f}% hit rate "
+        f"({semantic['hits']}/{semantic['lookups']}), "
+        f"{semantic['latency_saved_s']:.1f}s latency saved"
+    )
+
+
+def create_client(url: Optional[str], timeout: float) -> httpx.AsyncClient:
+    """HTTP client for a running server or the in-process app."""
+    if url:
+        return httpx.AsyncClient(base_url=url, timeout=timeout)
+
+    from main import app  # pylint: disable=import-outside-toplevel
+
+    # Set after main loads config.yaml so fakes are always used in-process.
+    os.environ["backend_mode"] = "fake"
+    logging.getLogger("server.config.logging").setLevel(logging.WARNING)
+    return httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app),
+        base_url="http://load-test",
+        timeout=timeout
+    )
+
+
+async def main(args: argparse.Namespace) -> None:
+    random.seed(args.seed)
+    sessions = load_sessions(args.input) * args.repeat
+    if not sessions:
+        raise SystemExit(f"No requests found in {args.input}.")
+
+    async with create_client(args.url, args.timeout) as client:
+        load_test = LoadTest(
+            client=client,
+            sessions=sessions,
+            base_dir=os.path.dirname(os.path.abspath(args.input))
+        )
+        report = await load_test.run(
+            concurrency=args.concurrency, rps=args.rps)
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("--input", required=True,
+                        help="JSONL file of recorded requests.")
+    parser.add_argument("--url",
+                        help="Server url. Defaults to the in-process app "
+                             "with fake backends.")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--concurrency", type=int, default=4,
+                      help="Concurrent sessions (closed loop).")
+    mode.add_argument("--rps", type=float,
+                      help="Target requests per second (open loop).")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="Times to replay the input.")
+    parser.add_argument("--timeout", type=float, default=60.0,
+                        help="Request timeout in seconds.")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed of open loop arrivals.")
+    parser.add_argument("--output", help="Write JSON report to this file.")
+    asyncio.run(main(parser.parse_args()))